@@ -1,15 +1,36 @@
 import os
 import logging
+import gzip
 import json
 import time
+from datetime import datetime
+import threading
+from collections import OrderedDict
+from contextlib import nullcontext
 import pandas as pd
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, render_template, jsonify, request, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import DeclarativeBase
-from grafo_agua import cargar_datos, construir_grafo, calcular_rutas_y_flujos
+from sqlalchemy import inspect, insert, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import DeclarativeBase, defer
+try:
+    import brotli
+except ImportError:  # Optional: /api/topologia falls back to gzip
+    brotli = None
+from grafo_agua import (cargar_datos, calcular_rutas_y_flujos, iterar_rutas_y_flujos,
+                        obtener_red, invalidar_cache, actualizar_red, configurar_fuente_db,
+                        bloqueo_escritura, anexar_filas_csv, comprimir_rutas, expandir_rutas,
+                        rutas_por_indice, CodificadorRutas)
+from distancias import distancia_km
+from estado import EstadoSistema
+from fuente_db import FuenteDB
+from instrumentacion import Medicion, Metricas, contar, medicion_actual, medir, perfilar, resumen_perfil
+from registro import configurar_registro
+from simplificacion import ZOOM_MAXIMO
+from trabajos import ColaTrabajos
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging (level from LOG_LEVEL, INFO by default)
+configurar_registro()
 
 class Base(DeclarativeBase):
     pass
@@ -35,110 +56,541 @@ with app.app_context():
     models_dict = create_models(db)
     db.create_all()
     
+    # create_all() skips tables that already exist, so add the (nullable) columns
+    # and the indexes introduced later
+    inspector = inspect(db.engine)
+    for tabla in db.metadata.sorted_tables:
+        existentes = {columna['name'] for columna in inspector.get_columns(tabla.name)}
+        for columna in tabla.columns:
+            if columna.name in existentes:
+                continue
+            tipo = columna.type.compile(dialect=db.engine.dialect)
+            try:
+                with db.engine.begin() as conexion:
+                    conexion.execute(text(f'ALTER TABLE {tabla.name} ADD COLUMN {columna.name} {tipo}'))
+                logging.info(f"Added column {tabla.name}.{columna.name}")
+            except Exception as column_error:
+                logging.warning(f"Could not add column {tabla.name}.{columna.name}: {column_error}")
+    
+    for tabla in db.metadata.sorted_tables:
+        for indice in tabla.indexes:
+            try:
+                indice.create(db.engine, checkfirst=True)
+            except Exception as index_error:
+                logging.warning(f"Could not create index {indice.name}: {index_error}")
+    
     # Make models globally accessible
     globals().update(models_dict)
 
+# Source of truth for the network: 'csv' (data/*.csv, default) or 'db' (embalses/puntos_criticos/nodos/aristas tables)
+FUENTE_DATOS = os.environ.get("FUENTE_DATOS", "csv").lower()
+if FUENTE_DATOS == 'db':
+    with app.app_context():
+        configurar_fuente_db(FuenteDB(db.engine, Embalse, PuntoCritico, Nodo, Arista))
+
+# Background job queue for long-running processing and network generation
+cola_trabajos = ColaTrabajos(app, db, Trabajo)
+
+# In-memory summary served by /status, refreshed in the background
+estado_sistema = EstadoSistema(app, db, {"procesamientos": Procesamiento, "historial_rutas": HistorialRuta})
+estado_sistema.iniciar()
+
+# Per-stage timing histograms of the processing runs served by this process (see /metrics)
+metricas = Metricas()
+
+# Bounded LRU of /procesar results keyed by network version, source and destination cap
+RESULTADOS_CACHE_MAX = int(os.environ.get("RESULTADOS_CACHE_MAX", "32"))
+_resultados_cache = OrderedDict()
+_resultados_lock = threading.Lock()
+
+def _clave_resultado(version, fuente, limite):
+    """Cache key for a processing result."""
+    return f"{version}:{fuente}:{limite if limite is not None else 'sin_limite'}"
+
+def _guardar_resultado(clave, resultado):
+    """Store a result in the in-memory LRU, evicting the oldest entries."""
+    with _resultados_lock:
+        _resultados_cache[clave] = resultado
+        _resultados_cache.move_to_end(clave)
+        while len(_resultados_cache) > RESULTADOS_CACHE_MAX:
+            _resultados_cache.popitem(last=False)
+
+def _buscar_resultado(clave, fuente):
+    """Look up a previous result in memory, then in procesamientos by its clave_cache."""
+    with _resultados_lock:
+        if clave in _resultados_cache:
+            _resultados_cache.move_to_end(clave)
+            estado_sistema.registrar_resultado('memoria')
+            contar('aciertos_cache')
+            return _resultados_cache[clave]
+    
+    try:
+        procesamiento = Procesamiento.query.filter(
+            Procesamiento.clave_cache == clave,
+            Procesamiento.fuente_principal == fuente,
+            Procesamiento.estado == 'exitoso'
+        ).order_by(Procesamiento.id.desc()).first()
+    except Exception as db_error:
+        logging.warning(f"Result cache lookup in database failed: {db_error}")
+        db.session.rollback()
+        return None
+    
+    if procesamiento is None:
+        estado_sistema.registrar_resultado('fallos')
+        return None
+    
+    estado_sistema.registrar_resultado('base_datos')
+    contar('aciertos_cache')
+    rutas, flujos, distancias = _rutas_guardadas(procesamiento)
+    resultado = {
+        "rutas_optimas": rutas,
+        "flujos_maximos": flujos,
+        "distancias": distancias,
+        "procesamiento_id": procesamiento.id
+    }
+    _guardar_resultado(clave, resultado)
+    return resultado
+
+# Value of the 'fuente' parameter that processes all reservoirs at once
+TODOS_LOS_EMBALSES = 'todos'
+
+def _embalses_asignados(fuente, rutas):
+    """In all-reservoirs mode, the reservoir serving each destination (first node of its route)."""
+    if fuente != TODOS_LOS_EMBALSES:
+        return {}
+    return {"embalses_asignados": {d: r[0] if r else None for d, r in rutas.items()}}
+
+def _nodos_aristas_json(G):
+    """Serialise graph nodes and edges for the map (full /procesar format)."""
+    nodos_json = []
+    for n, d in G.nodes(data=True):
+        node_data = {"id": n}
+        node_data.update(d)
+        nodos_json.append(node_data)
+    
+    aristas_json = []
+    for u, v, d in G.edges(data=True):
+        edge_data = {"origen": u, "destino": v}
+        edge_data.update(d)
+        aristas_json.append(edge_data)
+    
+    return nodos_json, aristas_json
+
+# Response formats of /procesar
+FORMATOS_PROCESAR = ('compacto', 'completo')
+
+def _cuerpo_procesar(red, fuente, rutas, flujos, distancias, compacto=True):
+    """Routes and flows part of a /procesar response; holds ``red.lock`` only while reading the network.
+    
+    Compact: ``version_red`` and ``rutas``, the comprimir_rutas tree with
+    nodes as positions in /api/topologia of that version (the reservoir
+    serving a destination is the first node of its route). Full: routes
+    and flows keyed by node name plus every node and edge of the network.
+    """
+    if compacto:
+        with red.lock:
+            # GrafoCSR ids are the topology positions, and never change as the network grows
+            version, indice = red.version, red.grafo.indice
+        return {
+            "version_red": version,
+            "rutas": rutas_por_indice(comprimir_rutas(rutas, flujos, distancias), indice)
+        }
+    with red.lock:
+        nodos_json, aristas_json = _nodos_aristas_json(red.G)
+    return {
+        "rutas_optimas": rutas,
+        "flujos_maximos": flujos,
+        "nodos": nodos_json,
+        "aristas": aristas_json,
+        **_embalses_asignados(fuente, rutas)
+    }
+
 @app.route("/")
 def home():
     """Render the main interface for the water distribution system."""
     return render_template("index.html")
 
-@app.route("/procesar", methods=["POST"])
-def procesar():
-    """Process water distribution data and calculate optimal routes and flows."""
-    start_time = time.time()
+def _distancias_rutas(arbol, rutas):
+    """Length in km of each route, read from the shortest-path tree that produced it."""
+    return {destino: arbol.distancia(destino) for destino, ruta in rutas.items() if ruta is not None}
+
+def _rutas_guardadas(procesamiento, destinos=None):
+    """``(rutas, flujos, distancias)`` stored in a processing run's detalles_json.
+    
+    Runs saved before routes were stored as a tree keep the full
+    rutas_optimas/flujos_maximos dicts and have no distances there.
+    """
+    detalles = json.loads(procesamiento.detalles_json)
+    if "rutas" in detalles:
+        return expandir_rutas(detalles["rutas"], destinos)
+    return detalles["rutas_optimas"], detalles["flujos_maximos"], {}
+
+def _guardar_procesamiento(fuente, clave, rutas, flujos, distancias, processing_time_ms, nodos_count, aristas_count,
+                           instrumentacion=None):
+    """Save a processing run and its routes to the database; returns its id (None on failure).
+    
+    The routes are stored once, as the shortest-path tree they share (see
+    comprimir_rutas), in detalles_json; the historial_rutas rows keep the
+    per-route figures and are written with bulk INSERTs in the same
+    transaction, leaving ruta_json empty. ``instrumentacion`` is the stage
+    breakdown of the run up to this point (Medicion.resumen()).
+    """
+    total_rutas_calculadas = len([r for r in rutas.values() if r is not None])
+    total_flujo_maximo = sum(flujos.values())
     
     try:
-        # Load data from CSV files
-        embalses, puntos, nodos, aristas = cargar_datos()
-        
-        # Construct the water distribution graph
-        G = construir_grafo(embalses, puntos, nodos, aristas)
+        procesamiento = Procesamiento(
+            fuente_principal=fuente,
+            total_rutas_calculadas=total_rutas_calculadas,
+            total_flujo_maximo=total_flujo_maximo,
+            tiempo_procesamiento_ms=processing_time_ms,
+            estado='exitoso',
+            clave_cache=clave,
+            detalles_json=json.dumps({
+                "rutas": comprimir_rutas(rutas, flujos, distancias),
+                "nodos_count": nodos_count,
+                "aristas_count": aristas_count,
+                "version_red": clave.split(':', 1)[0],
+                "clave_cache": clave,
+                "instrumentacion": instrumentacion
+            })
+        )
+        db.session.add(procesamiento)
+        db.session.flush()
         
-        # Use the first reservoir as the main water source
-        if len(embalses) > 0:
-            fuente = embalses.iloc[0]['Nombre']
-        else:
-            return jsonify({"error": "No reservoirs found in data"}), 400
+        # Route history, with the lengths taken from the shortest-path tree
+        filas = []
+        for destino, ruta in rutas.items():
+            if ruta is not None:
+                distancia_total = distancias.get(destino) or 0
+                filas.append({
+                    "procesamiento_id": procesamiento.id,
+                    "origen": ruta[0],
+                    "destino": destino,
+                    "flujo_maximo": flujos.get(destino, 0),
+                    "distancia_total": distancia_total,
+                    "tiempo_estimado_h": distancia_total / 50.0  # Assuming 50 km/h average speed
+                })
+        for inicio in range(0, len(filas), TAMANO_LOTE_IMPORT):
+            db.session.execute(insert(HistorialRuta), filas[inicio:inicio + TAMANO_LOTE_IMPORT])
         
-        # Calculate optimal routes and maximum flows
-        rutas, flujos = calcular_rutas_y_flujos(G, fuente)
+        db.session.commit()
+        estado_sistema.sumar_filas('procesamientos')
+        estado_sistema.sumar_filas('historial_rutas', len(filas))
+        logging.info(f"Processing results saved to database (ID: {procesamiento.id})")
+        return procesamiento.id
         
-        # Calculate processing time
-        processing_time_ms = int((time.time() - start_time) * 1000)
+    except Exception as db_error:
+        logging.warning(f"Failed to save to database: {db_error}")
+        db.session.rollback()
+        return None
+
+# Nodes and edges are streamed in batches of this size
+TAMANO_LOTE_STREAM = 1000
+
+def _linea_ndjson(objeto):
+    """Encode one NDJSON line."""
+    return json.dumps(objeto, default=str) + "\n"
+
+def _lotes_topologia(nodos_json, aristas_json):
+    """Yield NDJSON lines with the serialised nodes and edges (see _nodos_aristas_json) in batches."""
+    for tipo, datos in (("nodos", nodos_json), ("aristas", aristas_json)):
+        for i in range(0, len(datos), TAMANO_LOTE_STREAM):
+            yield _linea_ndjson({"tipo": tipo, "datos": datos[i:i + TAMANO_LOTE_STREAM]})
+
+def _procesar_stream(red, fuente, origen_calculo, limite, recalcular, start_time, compacto=True,
+                     codificacion=None):
+    """Generate the /procesar result as NDJSON, one line per route.
+    
+    In the compact format the ``inicio`` line carries the network version
+    and each route line the destination's position in /api/topologia plus
+    the route delta-encoded by CodificadorRutas (``padre`` and ``nuevos``).
+    The full format streams the topology first and routes as node names.
+    
+    The network lock is only held to read what the run needs (see
+    RedCargada.vista_calculo), never while a line is yielded, so an
+    incremental update does not wait for a slow client. In the compact
+    format the /api/topologia body (in ``codificacion``) is built and
+    cached before ``inicio``: the client fetches it on that line.
+    """
+    medicion = medicion_actual()
+    with red.lock:
+        grafo = red.grafo
+        version = red.version
+        nodos_count, aristas_count = grafo.numero_nodos, grafo.numero_aristas_activas
+    medicion.contar('nodos', nodos_count)
+    medicion.contar('aristas', aristas_count)
+    
+    clave = _clave_resultado(version, fuente, limite)
+    with medicion.etapa('resultado_cache'):
+        resultado = None if recalcular else _buscar_resultado(clave, fuente)
+    
+    with red.lock:
+        if resultado is None:
+            version, arbol, red_flujo, destinos = red.vista_calculo(origen_calculo, limite)
+            clave = _clave_resultado(version, fuente, limite)
+        if compacto:
+            codificador = CodificadorRutas(red.grafo.indice)
+        else:
+            version_red = red.version
+            nodos_json, aristas_json = _nodos_aristas_json(red.G)
+    if compacto:
+        # Version of the topology the lines refer to (newer than a cached result's, if the network
+        # moved on); positions never change as the network grows, so any later version fits too
+        version_red, _ = _cuerpo_topologia(red, codificacion)
+    
+    yield _linea_ndjson({"tipo": "inicio", "fuente": fuente, "version_red": version_red,
+                         "nodos_count": nodos_count, "aristas_count": aristas_count})
+    if compacto:
+        def linea_ruta(destino, ruta, flujo):
+            padre, nuevos = codificador.codificar(ruta)
+            return _linea_ndjson({"tipo": "ruta", "destino": codificador.indice[destino],
+                                  "padre": padre, "nuevos": nuevos, "flujo": flujo})
+    else:
+        yield from _lotes_topologia(nodos_json, aristas_json)
         
-        # Prepare data for JSON response
-        nodos_json = []
-        for n, d in G.nodes(data=True):
-            node_data = {"id": n}
-            node_data.update(d)
-            nodos_json.append(node_data)
+        def linea_ruta(destino, ruta, flujo):
+            return _linea_ndjson({"tipo": "ruta", "destino": destino, "ruta": ruta, "flujo": flujo})
+    
+    if resultado is not None:
+        logging.info(f"Streaming cached result for {clave}")
+        rutas, flujos = resultado["rutas_optimas"], resultado["flujos_maximos"]
+        for destino, ruta in rutas.items():
+            yield linea_ruta(destino, ruta, flujos.get(destino, 0))
+        yield _linea_ndjson({
+            "tipo": "fin",
+            "procesamiento_id": resultado["procesamiento_id"],
+            "tiempo_procesamiento_ms": int((time.time() - start_time) * 1000),
+            "cached": True
+        })
+        return
+    
+    rutas = {}
+    flujos = {}
+    for destino, ruta, flujo in iterar_rutas_y_flujos(
+        None, origen_calculo, limite=limite,
+        grafo=arbol.grafo, red_flujo=red_flujo, arbol=arbol, destinos=destinos
+    ):
+        rutas[destino] = ruta
+        flujos[destino] = flujo
+        yield linea_ruta(destino, ruta, flujo)
+    
+    distancias = _distancias_rutas(arbol, rutas)
+    processing_time_ms = int((time.time() - start_time) * 1000)
+    
+    with medicion.etapa('guardar_db'):
+        procesamiento_id = _guardar_procesamiento(
+            fuente, clave, rutas, flujos, distancias, processing_time_ms, nodos_count, aristas_count,
+            medicion.resumen()
+        )
+    _guardar_resultado(clave, {
+        "rutas_optimas": rutas,
+        "flujos_maximos": flujos,
+        "distancias": distancias,
+        "procesamiento_id": procesamiento_id
+    })
+    yield _linea_ndjson({
+        "tipo": "fin",
+        "procesamiento_id": procesamiento_id,
+        "tiempo_procesamiento_ms": processing_time_ms,
+        "cached": False
+    })
+
+def _stream_medido(medicion, lineas):
+    """Run an NDJSON generator as the active measurement, counting its bytes; recorded when it finishes."""
+    with medir(medicion):
+        for linea in lineas:
+            medicion.contar('bytes_respuesta', len(linea))
+            yield linea
+    metricas.registrar('procesar_stream', medicion)
+
+def _respuesta_medida(medicion, datos, perfilador=None):
+    """jsonify a /procesar result with its stage breakdown and record it in the metrics.
+    
+    The encoding is timed as well, so it only shows in the Server-Timing
+    header and /metrics, not in the body's ``instrumentacion``.
+    """
+    datos["instrumentacion"] = medicion.resumen()
+    if perfilador is not None:
+        datos["perfil"] = resumen_perfil(perfilador)
+    with medicion.etapa('serializar_json'):
+        respuesta = jsonify(datos)
+    medicion.contar('bytes_respuesta', len(respuesta.get_data()))
+    respuesta.headers['Server-Timing'] = medicion.server_timing()
+    metricas.registrar('procesar', medicion)
+    return respuesta
+
+def _stream_con_errores(lineas):
+    """Turn an exception raised mid-stream into a final error line."""
+    try:
+        yield from lineas
+    except Exception as e:
+        logging.error(f"Error streaming water distribution data: {str(e)}")
+        yield _linea_ndjson({"tipo": "error", "error": f"Error processing data: {str(e)}"})
+
+def _leer_limite(params):
+    """Optional cap on the number of destinations; raises ValueError if invalid."""
+    limite = params.get('limite', request.args.get('limite'))
+    if limite is not None:
+        try:
+            limite = int(limite)
+            if limite <= 0:
+                raise ValueError
+        except (TypeError, ValueError):
+            raise ValueError("El parámetro 'limite' debe ser un entero positivo")
+    return limite
+
+# Accepted spellings of a boolean parameter (JSON booleans and 0/1 are accepted as well)
+VALORES_BANDERA = {'1': True, 'true': True, '0': False, 'false': False}
+
+def _leer_bandera(params, nombre):
+    """Boolean parameter from the JSON body or the query string (False when absent); raises ValueError if invalid."""
+    valor = params.get(nombre, request.args.get(nombre))
+    if valor is None:
+        return False
+    if isinstance(valor, bool):
+        return valor
+    if isinstance(valor, int) and valor in (0, 1):
+        return bool(valor)
+    if isinstance(valor, str) and valor.strip().lower() in VALORES_BANDERA:
+        return VALORES_BANDERA[valor.strip().lower()]
+    raise ValueError(f"El parámetro '{nombre}' debe ser true/false o 1/0")
+
+def _resolver_fuente(params, embalses):
+    """Return ``(fuente, origen_calculo)`` for the requested reservoir; raises ValueError if invalid."""
+    # Use the requested reservoir, all of them ('todos'), or by default the first one
+    if len(embalses) == 0:
+        raise ValueError("No reservoirs found in data")
+    nombres_embalses = embalses['Nombre'].tolist()
+    fuente = params.get('fuente', request.args.get('fuente')) or nombres_embalses[0]
+    if fuente == TODOS_LOS_EMBALSES:
+        return fuente, nombres_embalses
+    if fuente in nombres_embalses:
+        return fuente, fuente
+    raise ValueError(f"Embalse desconocido: {fuente}")
+
+@app.route("/procesar", methods=["POST"])
+def procesar():
+    """Process water distribution data and calculate optimal routes and flows.
+    
+    By default (``formato`` 'compacto') only the routes and flows are
+    returned, with nodes as positions in /api/topologia of the returned
+    ``version_red`` (see _cuerpo_procesar); ``formato`` 'completo' returns
+    node names plus every node and edge of the network instead.
+    
+    With ``stream`` set, the result is sent as newline-delimited JSON, each
+    route and flow as soon as it is computed (see _procesar_stream).
+    
+    Every run is timed per stage (see instrumentacion): the breakdown is
+    returned as ``instrumentacion`` and in a Server-Timing header, stored
+    with the run and aggregated in /metrics. With ``profile`` set (not
+    available when streaming) the response also carries a cProfile summary
+    of the request as ``perfil``.
+    """
+    start_time = time.time()
+    medicion = Medicion()
+    
+    # Optional cap on the number of destinations (all distribution nodes by default)
+    params = request.get_json(silent=True) or {}
+    try:
+        limite = _leer_limite(params)
+        # Skip the result cache and force a full recomputation
+        recalcular = _leer_bandera(params, 'recalcular')
+        stream = _leer_bandera(params, 'stream')
+        perfil = _leer_bandera(params, 'profile')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    formato = params.get('formato', request.args.get('formato', 'compacto'))
+    if formato not in FORMATOS_PROCESAR:
+        return jsonify({"error": f"El parámetro 'formato' debe ser uno de: {', '.join(FORMATOS_PROCESAR)}"}), 400
+    compacto = formato == 'compacto'
+    
+    try:
+        # Load data and the water distribution graph (cached until the CSV files change)
+        with medir(medicion):
+            red = obtener_red()
+            embalses = red.embalses
         
-        aristas_json = []
-        for u, v, d in G.edges(data=True):
-            edge_data = {"origen": u, "destino": v}
-            edge_data.update(d)
-            aristas_json.append(edge_data)
+        try:
+            fuente, origen_calculo = _resolver_fuente(params, embalses)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
-        # Calculate statistics
-        total_rutas_calculadas = len([r for r in rutas.values() if r is not None])
-        total_flujo_maximo = sum(flujos.values())
+        if stream:
+            return Response(
+                stream_with_context(_stream_con_errores(_stream_medido(
+                    medicion, _procesar_stream(red, fuente, origen_calculo, limite, recalcular, start_time, compacto,
+                                               _codificacion_aceptada())
+                ))),
+                mimetype='application/x-ndjson'
+            )
         
-        # Save processing results to database
-        try:
-            procesamiento = Procesamiento(
-                fuente_principal=fuente,
-                total_rutas_calculadas=total_rutas_calculadas,
-                total_flujo_maximo=total_flujo_maximo,
-                tiempo_procesamiento_ms=processing_time_ms,
-                estado='exitoso',
-                detalles_json=json.dumps({
-                    "rutas_optimas": rutas,
-                    "flujos_maximos": flujos,
-                    "nodos_count": len(nodos_json),
-                    "aristas_count": len(aristas_json)
-                })
+        with medir(medicion), perfilar(perfil) as perfilador:
+            # The network lock is only held to read a consistent view of it, so
+            # incremental updates are not held up by the lookup or the run
+            with red.lock:
+                grafo = red.grafo
+                version = red.version
+                nodos_count, aristas_count = grafo.numero_nodos, grafo.numero_aristas_activas
+            medicion.contar('nodos', nodos_count)
+            medicion.contar('aristas', aristas_count)
+            
+            # Return the stored result when the network and source did not change
+            clave = _clave_resultado(version, fuente, limite)
+            with medicion.etapa('resultado_cache'):
+                resultado = None if recalcular else _buscar_resultado(clave, fuente)
+            if resultado is not None:
+                with medicion.etapa('json_respuesta'):
+                    cuerpo = _cuerpo_procesar(red, fuente, resultado["rutas_optimas"], resultado["flujos_maximos"],
+                                              resultado.get("distancias", {}), compacto)
+                logging.info(f"Returning cached result for {clave}")
+                return _respuesta_medida(medicion, {
+                    **cuerpo,
+                    "fuente": fuente,
+                    "procesamiento_id": resultado["procesamiento_id"],
+                    "tiempo_procesamiento_ms": int((time.time() - start_time) * 1000),
+                    "cached": True
+                }, perfilador)
+            
+            # Calculate optimal routes and maximum flows on a view of the network
+            # (the version may have moved on since the lookup)
+            version, arbol, red_flujo, destinos = red.vista_calculo(origen_calculo, limite)
+            clave = _clave_resultado(version, fuente, limite)
+            rutas, flujos = calcular_rutas_y_flujos(
+                None, origen_calculo, limite=limite,
+                grafo=arbol.grafo, red_flujo=red_flujo, arbol=arbol, destinos=destinos
             )
-            db.session.add(procesamiento)
-            db.session.commit()
+            distancias = _distancias_rutas(arbol, rutas)
             
-            # Save individual routes to history
-            for destino, ruta in rutas.items():
-                if ruta is not None:
-                    # Calculate total distance for the route
-                    distancia_total = 0
-                    for i in range(len(ruta) - 1):
-                        edge_data = G.get_edge_data(ruta[i], ruta[i+1])
-                        if edge_data and 'distancia' in edge_data:
-                            distancia_total += edge_data['distancia']
-                    
-                    historial_ruta = HistorialRuta(
-                        procesamiento_id=procesamiento.id,
-                        origen=fuente,
-                        destino=destino,
-                        ruta_json=json.dumps(ruta),
-                        flujo_maximo=flujos.get(destino, 0),
-                        distancia_total=distancia_total,
-                        tiempo_estimado_h=distancia_total / 50.0 if distancia_total > 0 else 0  # Assuming 50 km/h average speed
-                    )
-                    db.session.add(historial_ruta)
+            # Calculate processing time
+            processing_time_ms = int((time.time() - start_time) * 1000)
             
-            db.session.commit()
-            logging.info(f"Processing results saved to database (ID: {procesamiento.id})")
+            # Prepare data for JSON response
+            with medicion.etapa('json_respuesta'):
+                cuerpo = _cuerpo_procesar(red, fuente, rutas, flujos, distancias, compacto)
             
-        except Exception as db_error:
-            logging.warning(f"Failed to save to database: {db_error}")
-            db.session.rollback()
-        
-        return jsonify({
-            "rutas_optimas": rutas,
-            "flujos_maximos": flujos,
-            "nodos": nodos_json,
-            "aristas": aristas_json,
-            "fuente": fuente,
-            "procesamiento_id": procesamiento.id if 'procesamiento' in locals() else None,
-            "tiempo_procesamiento_ms": processing_time_ms
-        })
+            # Save processing results to database
+            with medicion.etapa('guardar_db'):
+                procesamiento_id = _guardar_procesamiento(
+                    fuente, clave, rutas, flujos, distancias, processing_time_ms, nodos_count, aristas_count,
+                    medicion.resumen()
+                )
+            
+            _guardar_resultado(clave, {
+                "rutas_optimas": rutas,
+                "flujos_maximos": flujos,
+                "distancias": distancias,
+                "procesamiento_id": procesamiento_id
+            })
+            
+            return _respuesta_medida(medicion, {
+                **cuerpo,
+                "fuente": fuente,
+                "procesamiento_id": procesamiento_id,
+                "tiempo_procesamiento_ms": processing_time_ms,
+                "cached": False
+            }, perfilador)
         
     except Exception as e:
         logging.error(f"Error processing water distribution data: {str(e)}")
@@ -146,63 +598,295 @@ def procesar():
 
 @app.route("/status")
 def status():
-    """Check system status and data availability."""
+    """Check system status and data availability.
+    
+    Served from the in-memory summary kept by estado_sistema: it does not
+    read the data files or count rows, so it answers in microseconds.
+    """
+    resumen = estado_sistema.resumen()
+    return jsonify(resumen), 500 if resumen["status"] == "error" else 200
+
+@app.route("/metrics")
+def metrics():
+    """Processing and per-stage duration histograms in the Prometheus text format."""
+    return Response(metricas.exponer(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# Encoded /api/topologia bodies of the current network version: (version, encoding) -> bytes
+_topologia_cuerpos = {}
+_topologia_lock = threading.Lock()
+
+def _codificacion_aceptada():
+    """'br', 'gzip' or None: the best Content-Encoding the client accepts."""
+    aceptadas = request.accept_encodings
+    if brotli is not None and aceptadas['br']:
+        return 'br'
+    if aceptadas['gzip']:
+        return 'gzip'
+    return None
+
+def _json_topologia(version, columnas):
+    """Compact JSON body of /api/topologia."""
+    return json.dumps({"version": version, **columnas}, separators=(',', ':'), default=str).encode('utf-8')
+
+def _etag_red(version, codificacion):
+    """ETag of a body that depends only on the network version (and the URL)."""
+    return version + (f"-{codificacion}" if codificacion else "")
+
+def _respuesta_red(etag, codificacion, cuerpo=None):
+    """Revalidatable response for a network body already encoded for ``codificacion``; None gives a 304."""
+    if cuerpo is None:
+        respuesta = Response(status=304)
+    else:
+        respuesta = Response(cuerpo, content_type='application/json')
+        if codificacion:
+            respuesta.headers['Content-Encoding'] = codificacion
+    respuesta.set_etag(etag)
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    respuesta.headers['Vary'] = 'Accept-Encoding'
+    return respuesta
+
+def _comprimir(cuerpo, codificacion):
+    """Encode a body for ``Content-Encoding: codificacion`` (None leaves it as is)."""
+    if codificacion == 'br':
+        return brotli.compress(cuerpo)
+    if codificacion == 'gzip':
+        return gzip.compress(cuerpo, compresslevel=6)
+    return cuerpo
+
+def _cuerpo_topologia(red, codificacion):
+    """``(version, body)``: the encoded /api/topologia body of ``red``, built once per version and encoding."""
+    version = red.version
+    with _topologia_lock:
+        cuerpo = _topologia_cuerpos.get((version, codificacion))
+    if cuerpo is not None:
+        return version, cuerpo
+    # The columns of a version never change, so only reading them needs the lock
+    with red.lock:
+        version = red.version
+        columnas = red.topologia()
+    cuerpo = _comprimir(_json_topologia(version, columnas), codificacion)
+    with _topologia_lock:
+        # Only the current version is kept
+        for vieja in [c for c in _topologia_cuerpos if c[0] != version]:
+            del _topologia_cuerpos[vieja]
+        _topologia_cuerpos[(version, codificacion)] = cuerpo
+    return version, cuerpo
+
+@app.route("/api/topologia")
+def get_topologia():
+    """Nodes and edges of the current network as columns, for the map.
+    
+    Routes returned by /procesar refer to nodes by their position in these
+    arrays. The body depends only on the network version, which is also
+    the ETag: clients revalidate with If-None-Match and get a 304 until the
+    network changes. Sent gzip- or brotli-compressed when accepted.
+    """
     try:
-        embalses, puntos, nodos, aristas = cargar_datos()
-        
-        # Also check database status
-        db_status = "ok"
-        db_counts = {}
-        try:
-            db_counts = {
-                "procesamientos": Procesamiento.query.count(),
-                "historial_rutas": HistorialRuta.query.count()
-            }
-        except Exception as db_error:
-            db_status = f"Database error: {db_error}"
-        
-        return jsonify({
-            "status": "ok",
-            "data_summary": {
-                "embalses": len(embalses),
-                "puntos_criticos": len(puntos),
-                "nodos": len(nodos),
-                "aristas": len(aristas)
-            },
-            "database_status": db_status,
-            "database_counts": db_counts
-        })
+        red = obtener_red()
+        codificacion = _codificacion_aceptada()
+        etag = _etag_red(red.version, codificacion)
+        if etag in request.if_none_match:
+            return _respuesta_red(etag, codificacion)
+        version, cuerpo = _cuerpo_topologia(red, codificacion)
+        return _respuesta_red(_etag_red(version, codificacion), codificacion, cuerpo)
     except Exception as e:
-        return jsonify({
-            "status": "error",
-            "message": str(e)
-        }), 500
+        logging.error(f"Error serving the network topology: {str(e)}")
+        return jsonify({"error": f"Error loading topology: {str(e)}"}), 500
+
+def _leer_limites():
+    """Optional ``bbox`` (``sur,oeste,norte,este`` in degrees) from the query string; raises ValueError if invalid."""
+    bbox = request.args.get('bbox')
+    if bbox is None:
+        return None
+    try:
+        sur, oeste, norte, este = (float(valor) for valor in bbox.split(','))
+    except ValueError:
+        raise ValueError("El parámetro 'bbox' debe ser 'sur,oeste,norte,este' en grados")
+    if sur > norte or oeste > este:
+        raise ValueError("El parámetro 'bbox' debe ser 'sur,oeste,norte,este' en grados")
+    return sur, oeste, norte, este
+
+@app.route("/api/topologia/vista")
+def get_topologia_vista():
+    """The network simplified for a map view at ``zoom`` (Leaflet's), within an optional ``bbox``.
+    
+    Distribution nodes are clustered on a screen-space grid for the zoom
+    level and only the visible part is sent; at high zoom, or when few
+    nodes are visible, nodes are sent one by one (see simplificacion).
+    Like /api/topologia, the ETag is the network version.
+    """
+    try:
+        zoom = request.args.get('zoom', type=int)
+        if zoom is None or not 0 <= zoom <= ZOOM_MAXIMO:
+            raise ValueError(f"El parámetro 'zoom' debe ser un entero entre 0 y {ZOOM_MAXIMO}")
+        limites = _leer_limites()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        red = obtener_red()
+        codificacion = _codificacion_aceptada()
+        etag = _etag_red(red.version, codificacion)
+        if etag in request.if_none_match:
+            return _respuesta_red(etag, codificacion)
+        with red.lock:
+            version = red.version
+            vistas = red.vistas()
+        cuerpo = json.dumps({"version": version, **vistas.vista(zoom, limites)}, separators=(',', ':')).encode('utf-8')
+        return _respuesta_red(_etag_red(version, codificacion), codificacion, _comprimir(cuerpo, codificacion))
+    except Exception as e:
+        logging.error(f"Error serving a network view: {str(e)}")
+        return jsonify({"error": f"Error loading topology: {str(e)}"}), 500
+
+# Page size limit of the history endpoints
+TAMANO_PAGINA_MAX = 1000
+
+def _leer_paginacion(por_defecto):
+    """``(limite, despues)`` from the query string; raises ValueError if invalid.
+    
+    Pages are keyset-based: ``despues`` is the ``siguiente`` value returned
+    with the previous page (the last id it contained).
+    """
+    limite = min(_leer_limite({}) or por_defecto, TAMANO_PAGINA_MAX)
+    despues = request.args.get('despues')
+    if despues is not None:
+        try:
+            despues = int(despues)
+        except ValueError:
+            raise ValueError("El parámetro 'despues' debe ser un entero")
+    return limite, despues
+
+def _leer_fecha(nombre):
+    """Optional ISO 8601 date from the query string; raises ValueError if invalid."""
+    valor = request.args.get(nombre)
+    if valor is None:
+        return None
+    try:
+        return datetime.fromisoformat(valor)
+    except ValueError:
+        raise ValueError(f"El parámetro '{nombre}' debe ser una fecha ISO 8601")
+
+def _pagina(consulta, columna_id, limite):
+    """Run a keyset query ordered by ``columna_id``; returns ``(filas, siguiente)``."""
+    filas = consulta.limit(limite + 1).all()
+    if len(filas) <= limite:
+        return filas, None
+    filas = filas[:limite]
+    return filas, getattr(filas[-1], columna_id.key)
 
 @app.route("/api/procesamientos")
 def get_procesamientos():
-    """Get all processing history records."""
+    """Processing history, newest first, one page at a time.
+    
+    Query parameters: ``limite`` (page size, 10 by default), ``despues``,
+    ``fuente`` and the ``desde``/``hasta`` date range (from inclusive, to
+    exclusive).
+    """
     try:
-        procesamientos = Procesamiento.query.order_by(Procesamiento.fecha_procesamiento.desc()).limit(10).all()
+        limite, despues = _leer_paginacion(10)
+        desde, hasta = _leer_fecha('desde'), _leer_fecha('hasta')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        # Newest first by id (insertion order); the stored results are not needed for the listing
+        consulta = Procesamiento.query.options(defer(Procesamiento.detalles_json))
+        fuente = request.args.get('fuente')
+        if fuente:
+            consulta = consulta.filter(Procesamiento.fuente_principal == fuente)
+        if desde is not None:
+            consulta = consulta.filter(Procesamiento.fecha_procesamiento >= desde)
+        if hasta is not None:
+            consulta = consulta.filter(Procesamiento.fecha_procesamiento < hasta)
+        if despues is not None:
+            consulta = consulta.filter(Procesamiento.id < despues)
+        procesamientos, siguiente = _pagina(consulta.order_by(Procesamiento.id.desc()), Procesamiento.id, limite)
         return jsonify({
-            "procesamientos": [p.to_dict() for p in procesamientos]
+            "procesamientos": [p.to_dict() for p in procesamientos],
+            "siguiente": siguiente
         })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route("/api/procesamiento/<int:procesamiento_id>/rutas")
 def get_rutas_procesamiento(procesamiento_id):
-    """Get route details for a specific processing run."""
+    """Route details of a processing run, one page at a time.
+    
+    Query parameters: ``limite`` (page size, 100 by default), ``despues``,
+    ``origen``, ``destino`` and ``incluir_ruta`` (0 leaves ``ruta_json``
+    out, which skips reading and decoding the stored routes).
+    """
     try:
-        procesamiento = Procesamiento.query.get_or_404(procesamiento_id)
-        rutas = HistorialRuta.query.filter_by(procesamiento_id=procesamiento_id).all()
+        limite, despues = _leer_paginacion(100)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    incluir_ruta = request.args.get('incluir_ruta', '1') != '0'
+    
+    try:
+        procesamiento = db.session.get(Procesamiento, procesamiento_id,
+                                       options=[defer(Procesamiento.detalles_json)])
+        if procesamiento is None:
+            return jsonify({"error": f"Procesamiento {procesamiento_id} no encontrado"}), 404
+        
+        consulta = HistorialRuta.query.filter(HistorialRuta.procesamiento_id == procesamiento_id)
+        if not incluir_ruta:
+            consulta = consulta.options(defer(HistorialRuta.ruta_json))
+        for campo in ('origen', 'destino'):
+            if request.args.get(campo):
+                consulta = consulta.filter(getattr(HistorialRuta, campo) == request.args[campo])
+        if despues is not None:
+            consulta = consulta.filter(HistorialRuta.id > despues)
+        rutas, siguiente = _pagina(consulta.order_by(HistorialRuta.id), HistorialRuta.id, limite)
+        
+        if not incluir_ruta:
+            rutas_json = [r.to_dict(incluir_ruta=False) for r in rutas]
+        else:
+            # Newer runs store the routes once in the processing run instead of per row
+            pendientes = [r.destino for r in rutas if r.ruta_json is None]
+            guardadas = _rutas_guardadas(procesamiento, pendientes)[0] if pendientes else {}
+            rutas_json = []
+            for r in rutas:
+                datos = r.to_dict()
+                if datos["ruta_json"] is None and guardadas.get(r.destino) is not None:
+                    datos["ruta_json"] = json.dumps(guardadas[r.destino])
+                rutas_json.append(datos)
         
         return jsonify({
             "procesamiento": procesamiento.to_dict(),
-            "rutas": [r.to_dict() for r in rutas]
+            "rutas": rutas_json,
+            "siguiente": siguiente
         })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# Rows per INSERT statement in the bulk CSV import
+TAMANO_LOTE_IMPORT = 5000
+
+def _importar_nuevos(modelo, df, columnas, claves):
+    """Bulk-insert the rows of ``df`` whose key is not yet in the table; returns how many were added.
+    
+    ``columnas`` maps model attributes to DataFrame columns and ``claves``
+    lists the attributes forming the unique key. Existing keys are read once
+    into a set instead of querying per row.
+    """
+    if len(df) == 0:
+        return 0
+    
+    # CSV headers are matched case-insensitively (puntos_criticos.csv uses lowercase names)
+    por_nombre = {c.lower(): c for c in df.columns}
+    filas = df[[por_nombre[v.lower()] for v in columnas.values()]]
+    filas.columns = list(columnas.keys())
+    filas = filas.astype(object).where(filas.notna(), None)
+    
+    existentes = {tuple(fila) for fila in db.session.execute(select(*[getattr(modelo, c) for c in claves]))}
+    clave_fila = pd.Series(list(zip(*[filas[c] for c in claves])), index=filas.index)
+    filas = filas[~clave_fila.isin(existentes) & ~clave_fila.duplicated()]
+    
+    registros = filas.to_dict('records')
+    for inicio in range(0, len(registros), TAMANO_LOTE_IMPORT):
+        db.session.execute(insert(modelo), registros[inicio:inicio + TAMANO_LOTE_IMPORT])
+    return len(registros)
+
 @app.route("/api/data/import", methods=["POST"])
 def import_csv_to_db():
     """Import CSV data to database tables."""
@@ -216,56 +900,57 @@ def import_csv_to_db():
         # db.session.query(Nodo).delete()
         # db.session.query(Arista).delete()
         
-        # Import embalses
-        for _, row in embalses.iterrows():
-            embalse = Embalse.query.filter_by(nombre=row['Nombre']).first()
-            if not embalse:
-                embalse = Embalse(
-                    nombre=row['Nombre'],
-                    latitud=row['Latitud'],
-                    longitud=row['Longitud'],
-                    volumen_almacenado_m3=row['Volumen_Almacenado_m3']
-                )
-                db.session.add(embalse)
-        
-        # Import puntos críticos
-        for _, row in puntos.iterrows():
-            punto = PuntoCritico.query.filter_by(nombre=row['Nombre']).first()
-            if not punto:
-                punto = PuntoCritico(
-                    nombre=row['Nombre'],
-                    latitud=row['Latitud'],
-                    longitud=row['Longitud'],
-                    tipo=row['Tipo']
-                )
-                db.session.add(punto)
-        
-        # Import nodos
-        for _, row in nodos.iterrows():
-            nodo = Nodo.query.filter_by(id_nodo=row['id_nodo']).first()
-            if not nodo:
-                nodo = Nodo(
-                    id_nodo=row['id_nodo'],
-                    latitud=row['latitud'],
-                    longitud=row['longitud'],
-                    tipo=row['tipo'],
-                    estado=row['estado']
-                )
-                db.session.add(nodo)
-        
-        # Import aristas
-        for _, row in aristas.iterrows():
-            arista = Arista.query.filter_by(origen=row['origen'], destino=row['destino']).first()
-            if not arista:
-                arista = Arista(
-                    origen=row['origen'],
-                    destino=row['destino'],
-                    distancia=row['distancia'],
-                    estado=row['estado']
-                )
-                db.session.add(arista)
+        # Edges without a distance get the length between their nodes
+        if 'distancia' in aristas.columns and aristas['distancia'].isna().any():
+            coords = pd.concat([
+                embalses.rename(columns={'Nombre': 'id_nodo', 'Latitud': 'latitud', 'Longitud': 'longitud'}),
+                nodos
+            ])[['id_nodo', 'latitud', 'longitud']].drop_duplicates('id_nodo', keep='last').set_index('id_nodo')
+            faltantes = aristas['distancia'].isna()
+            aristas.loc[faltantes, 'distancia'] = distancia_km(
+                aristas.loc[faltantes, 'origen'].map(coords['latitud']).to_numpy(dtype=float),
+                aristas.loc[faltantes, 'origen'].map(coords['longitud']).to_numpy(dtype=float),
+                aristas.loc[faltantes, 'destino'].map(coords['latitud']).to_numpy(dtype=float),
+                aristas.loc[faltantes, 'destino'].map(coords['longitud']).to_numpy(dtype=float)
+            ).round(4)
+            
+            # Edges whose endpoints have no coordinates cannot be stored (distancia is NOT NULL)
+            sin_distancia = aristas['distancia'].isna()
+            if sin_distancia.any():
+                logging.warning(f"Skipping {int(sin_distancia.sum())} edges with unknown endpoints")
+                aristas = aristas[~sin_distancia]
+        
+        # Insert only records whose key is not in the database yet
+        importados = {
+            "embalses": _importar_nuevos(Embalse, embalses, {
+                'nombre': 'Nombre',
+                'latitud': 'Latitud',
+                'longitud': 'Longitud',
+                'volumen_almacenado_m3': 'Volumen_Almacenado_m3'
+            }, ['nombre']),
+            "puntos_criticos": _importar_nuevos(PuntoCritico, puntos, {
+                'nombre': 'Nombre',
+                'latitud': 'Latitud',
+                'longitud': 'Longitud',
+                'tipo': 'Tipo'
+            }, ['nombre']),
+            "nodos": _importar_nuevos(Nodo, nodos, {
+                'id_nodo': 'id_nodo',
+                'latitud': 'latitud',
+                'longitud': 'longitud',
+                'tipo': 'tipo',
+                'estado': 'estado'
+            }, ['id_nodo']),
+            "aristas": _importar_nuevos(Arista, aristas, {
+                'origen': 'origen',
+                'destino': 'destino',
+                'distancia': 'distancia',
+                'estado': 'estado'
+            }, ['origen', 'destino'])
+        }
         
         db.session.commit()
+        logging.info(f"CSV import added {importados}")
         
         # Count imported records
         counts = {
@@ -278,7 +963,8 @@ def import_csv_to_db():
         return jsonify({
             "status": "success",
             "message": "CSV data imported successfully",
-            "counts": counts
+            "counts": counts,
+            "importados": importados
         })
         
     except Exception as e:
@@ -286,127 +972,230 @@ def import_csv_to_db():
         logging.error(f"Error importing CSV data: {e}")
         return jsonify({"error": str(e)}), 500
 
+# CSV columns of new nodes and critical points (also the header of a newly created file)
+COLUMNAS_NODOS = ['id_nodo', 'latitud', 'longitud', 'tipo', 'estado']
+COLUMNAS_PUNTOS = ['nombre', 'latitud', 'longitud', 'tipo', 'prioridad', 'poblacion_afectada']
+
+# Maximum number of nodes accepted by /api/agregar-nodos in one request
+MAX_NODOS_LOTE = int(os.environ.get("MAX_NODOS_LOTE", "1000"))
+
+def _leer_coordenadas(data):
+    """Latitude and longitude of a request item as floats; raises ValueError if invalid."""
+    try:
+        return float(data['latitud']), float(data['longitud'])
+    except (TypeError, ValueError):
+        raise ValueError("Latitud y longitud deben ser numéricas")
+
+def _leer_nodo(data):
+    """Validate a node from the request body; returns its row or raises ValueError."""
+    if not isinstance(data, dict):
+        raise ValueError("Se esperaba un objeto JSON")
+    for field in COLUMNAS_NODOS:
+        if field not in data:
+            raise ValueError(f"Campo requerido faltante: {field}")
+    latitud, longitud = _leer_coordenadas(data)
+    return {
+        'id_nodo': data['id_nodo'],
+        'latitud': latitud,
+        'longitud': longitud,
+        'tipo': data['tipo'],
+        'estado': data['estado']
+    }
+
+def _leer_punto(data):
+    """Validate a critical point from the request body; returns its row or raises ValueError."""
+    if not isinstance(data, dict):
+        raise ValueError("Se esperaba un objeto JSON")
+    for field in ['nombre', 'latitud', 'longitud', 'tipo', 'prioridad']:
+        if field not in data:
+            raise ValueError(f"Campo requerido faltante: {field}")
+    latitud, longitud = _leer_coordenadas(data)
+    return {
+        'nombre': data['nombre'],
+        'latitud': latitud,
+        'longitud': longitud,
+        'tipo': data['tipo'],
+        'prioridad': data['prioridad'],
+        'poblacion_afectada': int(data.get('poblacion_afectada', 0))
+    }
+
+def _insertar_en_db(modelo, filas):
+    """Insert rows in one transaction (persistence step of actualizar_red in database mode)."""
+    try:
+        db.session.execute(insert(modelo), filas)
+        db.session.commit()
+    except IntegrityError:
+        # Another worker stored one of the keys first; the unique constraint is the last word
+        db.session.rollback()
+        raise ValueError("Uno de los registros ya existe")
+
+def _registrar(filas, clave, modelo, archivo, columnas, aplicar, mensaje_repetidos):
+    """Persist new rows append-only and apply them to the live network.
+    
+    While holding the write lock (CSV mode; in database mode the insert
+    transaction and unique constraints play that role) the keys are checked
+    against the node index of the current network, which is reloaded first
+    if another process changed the data. The rows are then appended to the
+    CSV file, never rewriting it, or inserted in one transaction. Raises
+    ValueError when a key already exists.
+    """
+    with (bloqueo_escritura() if FUENTE_DATOS != 'db' else nullcontext()):
+        indice = obtener_red().grafo.indice
+        repetidos = [fila[clave] for fila in filas if fila[clave] in indice]
+        if repetidos:
+            raise ValueError(mensaje_repetidos(repetidos))
+        
+        if FUENTE_DATOS == 'db':
+            persistir = lambda: _insertar_en_db(modelo, filas)
+        else:
+            persistir = lambda: anexar_filas_csv(archivo, filas, columnas)
+        return actualizar_red(persistir, aplicar)
+
 @app.route("/api/agregar-nodo", methods=["POST"])
 def agregar_nodo():
     """Agregar un nuevo nodo al archivo CSV."""
     try:
-        data = request.get_json()
-        
-        # Validar datos requeridos
-        required_fields = ['id_nodo', 'latitud', 'longitud', 'tipo', 'estado']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({"error": f"Campo requerido faltante: {field}"}), 400
-        
-        # Validar que el ID no exista ya
         try:
-            nodos_df = pd.read_csv('data/nodos.csv')
-            if data['id_nodo'] in nodos_df['id_nodo'].values:
-                return jsonify({"error": f"El ID {data['id_nodo']} ya existe"}), 400
-        except FileNotFoundError:
-            # Si el archivo no existe, crearlo con headers
-            nodos_df = pd.DataFrame(columns=['id_nodo', 'latitud', 'longitud', 'tipo', 'estado'])
-        
-        # Crear el nuevo nodo
-        nuevo_nodo = {
-            'id_nodo': data['id_nodo'],
-            'latitud': float(data['latitud']),
-            'longitud': float(data['longitud']),
-            'tipo': data['tipo'],
-            'estado': data['estado']
-        }
-        
-        # Agregar el nuevo nodo al DataFrame
-        nuevo_nodo_df = pd.DataFrame([nuevo_nodo])
-        nodos_actualizado = pd.concat([nodos_df, nuevo_nodo_df], ignore_index=True)
-        
-        # Guardar en el archivo CSV
-        nodos_actualizado.to_csv('data/nodos.csv', index=False)
+            nuevo_nodo = _leer_nodo(request.get_json(silent=True))
+            
+            # Guardar en el archivo CSV (o la base de datos) y aplicar el cambio a la red en memoria
+            actualizacion = _registrar(
+                [nuevo_nodo], 'id_nodo', Nodo, 'data/nodos.csv', COLUMNAS_NODOS,
+                lambda red: red.agregar_nodo(nuevo_nodo),
+                lambda repetidos: f"El ID {repetidos[0]} ya existe"
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
-        logging.info(f"Nuevo nodo agregado: {data['id_nodo']} en ({data['latitud']}, {data['longitud']})")
+        logging.info(f"Nuevo nodo agregado: {nuevo_nodo['id_nodo']} en ({nuevo_nodo['latitud']}, {nuevo_nodo['longitud']})")
         
         return jsonify({
             "status": "success",
-            "message": f"Nodo {data['id_nodo']} agregado exitosamente",
-            "nodo": nuevo_nodo
+            "message": f"Nodo {nuevo_nodo['id_nodo']} agregado exitosamente",
+            "nodo": nuevo_nodo,
+            "actualizacion_incremental": actualizacion
         })
         
     except Exception as e:
         logging.error(f"Error agregando nodo: {str(e)}")
         return jsonify({"error": f"Error agregando nodo: {str(e)}"}), 500
 
-@app.route("/api/agregar-punto-critico", methods=["POST"])
-def agregar_punto_critico():
-    """Agregar un nuevo punto crítico al archivo CSV."""
+@app.route("/api/agregar-nodos", methods=["POST"])
+def agregar_nodos():
+    """Agregar un lote de nodos con una sola escritura; si alguno es inválido no se agrega ninguno."""
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True)
+        lista = data.get('nodos') if isinstance(data, dict) else data
+        if not isinstance(lista, list) or not lista:
+            return jsonify({"error": "Se esperaba una lista 'nodos' no vacía"}), 400
+        if len(lista) > MAX_NODOS_LOTE:
+            return jsonify({"error": f"Máximo {MAX_NODOS_LOTE} nodos por lote"}), 400
         
-        # Validar datos requeridos
-        required_fields = ['nombre', 'latitud', 'longitud', 'tipo', 'prioridad']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({"error": f"Campo requerido faltante: {field}"}), 400
+        nuevos_nodos = []
+        errores = []
+        vistos = set()
+        for i, item in enumerate(lista):
+            try:
+                nodo = _leer_nodo(item)
+                if nodo['id_nodo'] in vistos:
+                    raise ValueError(f"ID repetido en el lote: {nodo['id_nodo']}")
+                vistos.add(nodo['id_nodo'])
+                nuevos_nodos.append(nodo)
+            except ValueError as e:
+                errores.append({"indice": i, "error": str(e)})
+        if errores:
+            return jsonify({"error": "Lote rechazado", "errores": errores}), 400
         
-        # Validar que el nombre no exista ya
         try:
-            puntos_df = pd.read_csv('data/puntos_criticos.csv')
-            if data['nombre'] in puntos_df['nombre'].values:
-                return jsonify({"error": f"El punto crítico {data['nombre']} ya existe"}), 400
-        except FileNotFoundError:
-            # Si el archivo no existe, crearlo con headers
-            puntos_df = pd.DataFrame(columns=['nombre', 'latitud', 'longitud', 'tipo', 'prioridad', 'poblacion_afectada'])
-        
-        # Crear el nuevo punto crítico
-        nuevo_punto = {
-            'nombre': data['nombre'],
-            'latitud': float(data['latitud']),
-            'longitud': float(data['longitud']),
-            'tipo': data['tipo'],
-            'prioridad': data['prioridad'],
-            'poblacion_afectada': int(data.get('poblacion_afectada', 0))
-        }
+            actualizacion = _registrar(
+                nuevos_nodos, 'id_nodo', Nodo, 'data/nodos.csv', COLUMNAS_NODOS,
+                lambda red: red.agregar_nodos(nuevos_nodos),
+                lambda repetidos: f"Los IDs ya existen: {', '.join(map(str, repetidos))}"
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
-        # Agregar el nuevo punto al DataFrame
-        nuevo_punto_df = pd.DataFrame([nuevo_punto])
-        puntos_actualizado = pd.concat([puntos_df, nuevo_punto_df], ignore_index=True)
+        logging.info(f"Lote de {len(nuevos_nodos)} nodos agregado")
         
-        # Guardar en el archivo CSV
-        puntos_actualizado.to_csv('data/puntos_criticos.csv', index=False)
+        return jsonify({
+            "status": "success",
+            "message": f"{len(nuevos_nodos)} nodos agregados exitosamente",
+            "total": len(nuevos_nodos),
+            "actualizacion_incremental": actualizacion
+        })
         
-        logging.info(f"Nuevo punto crítico agregado: {data['nombre']} en ({data['latitud']}, {data['longitud']})")
+    except Exception as e:
+        logging.error(f"Error agregando lote de nodos: {str(e)}")
+        return jsonify({"error": f"Error agregando nodos: {str(e)}"}), 500
+
+@app.route("/api/agregar-punto-critico", methods=["POST"])
+def agregar_punto_critico():
+    """Agregar un nuevo punto crítico al archivo CSV."""
+    try:
+        try:
+            nuevo_punto = _leer_punto(request.get_json(silent=True))
+            
+            # Guardar en el archivo CSV (o la base de datos) y marcar el obstáculo en la red en memoria
+            actualizacion = _registrar(
+                [nuevo_punto], 'nombre', PuntoCritico, 'data/puntos_criticos.csv', COLUMNAS_PUNTOS,
+                lambda red: red.agregar_punto_critico(nuevo_punto),
+                lambda repetidos: f"El punto crítico {repetidos[0]} ya existe"
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        logging.info(f"Nuevo punto crítico agregado: {nuevo_punto['nombre']} en ({nuevo_punto['latitud']}, {nuevo_punto['longitud']})")
         
         return jsonify({
             "status": "success",
-            "message": f"Punto crítico {data['nombre']} agregado exitosamente",
-            "punto_critico": nuevo_punto
+            "message": f"Punto crítico {nuevo_punto['nombre']} agregado exitosamente",
+            "punto_critico": nuevo_punto,
+            "actualizacion_incremental": actualizacion
         })
         
     except Exception as e:
         logging.error(f"Error agregando punto crítico: {str(e)}")
         return jsonify({"error": f"Error agregando punto crítico: {str(e)}"}), 500
 
-@app.route("/generar-red-completa", methods=["POST"])
-def generar_red_completa():
-    """Genera una red completa de 100+ nodos de distribución para Arequipa"""
-    try:
-        import subprocess
-        
-        # Ejecutar el generador de red completa
+def _ejecutar_generador():
+    """Run the full-network generator script and drop the cached network."""
+    import subprocess
+    
+    # Ejecutar el generador de red completa (rewrites the CSV files, so no appends may run meanwhile)
+    with bloqueo_escritura():
         result = subprocess.run(
             ['python', 'generar_red_completa_arequipa.py'],
             capture_output=True,
             text=True,
             cwd='.'
         )
+    
+    # The generator rewrites the CSV files
+    invalidar_cache()
+    return result
+
+def _contar_red_generada():
+    """Count nodes, critical points and edges in the generated CSV files."""
+    nodos_df = pd.read_csv('data/nodos.csv')
+    puntos_df = pd.read_csv('data/puntos_criticos.csv')
+    aristas_df = pd.read_csv('data/aristas.csv')
+    return {
+        "nodos": len(nodos_df),
+        "puntos_criticos": len(puntos_df),
+        "aristas": len(aristas_df)
+    }
+
+@app.route("/generar-red-completa", methods=["POST"])
+def generar_red_completa():
+    """Genera una red completa de 100+ nodos de distribución para Arequipa"""
+    try:
+        result = _ejecutar_generador()
         
         if result.returncode == 0:
             # Contar los resultados
             try:
-                nodos_df = pd.read_csv('data/nodos.csv')
-                puntos_df = pd.read_csv('data/puntos_criticos.csv')
-                aristas_df = pd.read_csv('data/aristas.csv')
-                
-                summary = f"{len(nodos_df)} nodos, {len(puntos_df)} obstáculos, {len(aristas_df)} conexiones"
+                details = _contar_red_generada()
+                summary = f"{details['nodos']} nodos, {details['puntos_criticos']} obstáculos, {details['aristas']} conexiones"
                 
                 logging.info(f"Red completa generada: {summary}")
                 
@@ -414,11 +1203,7 @@ def generar_red_completa():
                     "status": "success",
                     "message": "Red completa generada exitosamente",
                     "summary": summary,
-                    "details": {
-                        "nodos": len(nodos_df),
-                        "puntos_criticos": len(puntos_df),
-                        "aristas": len(aristas_df)
-                    }
+                    "details": details
                 })
             except Exception as e:
                 return jsonify({
@@ -437,5 +1222,137 @@ def generar_red_completa():
         logging.error(f"Error generando red completa: {str(e)}")
         return jsonify({"error": f"Error generando red completa: {str(e)}"}), 500
 
+def _trabajo_procesar(progreso, fuente, origen_calculo, limite=None, recalcular=False):
+    """Job body for /api/jobs/procesar: compute, persist and cache a processing run.
+    
+    The run is timed per stage like /procesar; the breakdown is part of the
+    job result.
+    """
+    with medir() as medicion:
+        start_time = time.time()
+        red = obtener_red()
+        
+        # As in /procesar, the network lock is only held to read a consistent view
+        with red.lock:
+            grafo = red.grafo
+            version = red.version
+            nodos_count, aristas_count = grafo.numero_nodos, grafo.numero_aristas_activas
+        medicion.contar('nodos', nodos_count)
+        medicion.contar('aristas', aristas_count)
+        clave = _clave_resultado(version, fuente, limite)
+        with medicion.etapa('resultado_cache'):
+            resultado = None if recalcular else _buscar_resultado(clave, fuente)
+        if resultado is not None:
+            metricas.registrar('trabajo', medicion)
+            return {
+                "procesamiento_id": resultado["procesamiento_id"],
+                "total_rutas_calculadas": len([r for r in resultado["rutas_optimas"].values() if r is not None]),
+                "tiempo_procesamiento_ms": int((time.time() - start_time) * 1000),
+                "cached": True,
+                "instrumentacion": medicion.resumen()
+            }
+        
+        version, arbol, red_flujo, destinos = red.vista_calculo(origen_calculo, limite)
+        clave = _clave_resultado(version, fuente, limite)
+        total = len(destinos)
+        progreso(0.0, f"Calculando rutas hacia {total} nodos")
+        
+        rutas = {}
+        flujos = {}
+        for destino, ruta, flujo in iterar_rutas_y_flujos(
+            None, origen_calculo, limite=limite,
+            grafo=arbol.grafo, red_flujo=red_flujo, arbol=arbol, destinos=destinos
+        ):
+            rutas[destino] = ruta
+            flujos[destino] = flujo
+            progreso(len(rutas) / total * 0.95)
+        
+        distancias = _distancias_rutas(arbol, rutas)
+        processing_time_ms = int((time.time() - start_time) * 1000)
+        
+        progreso(0.95, "Guardando resultados")
+        with medicion.etapa('guardar_db'):
+            procesamiento_id = _guardar_procesamiento(
+                fuente, clave, rutas, flujos, distancias, processing_time_ms, nodos_count, aristas_count,
+                medicion.resumen()
+            )
+        _guardar_resultado(clave, {
+            "rutas_optimas": rutas,
+            "flujos_maximos": flujos,
+            "distancias": distancias,
+            "procesamiento_id": procesamiento_id
+        })
+        metricas.registrar('trabajo', medicion)
+        return {
+            "procesamiento_id": procesamiento_id,
+            "total_rutas_calculadas": len([r for r in rutas.values() if r is not None]),
+            "tiempo_procesamiento_ms": processing_time_ms,
+            "cached": False,
+            "instrumentacion": medicion.resumen()
+        }
+
+def _trabajo_generar_red(progreso):
+    """Job body for /api/jobs/generar-red-completa."""
+    progreso(0.0, "Generando red completa")
+    result = _ejecutar_generador()
+    if result.returncode != 0:
+        raise RuntimeError(f"Error generando red: {result.stderr}")
+    progreso(0.9, "Contando resultados")
+    return _contar_red_generada()
+
+def _respuesta_trabajo(trabajo_id):
+    """202 response pointing at the status endpoint of a queued job."""
+    return jsonify({
+        "job_id": trabajo_id,
+        "estado": "pendiente",
+        "url": f"/api/jobs/{trabajo_id}"
+    }), 202
+
+@app.route("/api/jobs/procesar", methods=["POST"])
+def encolar_procesar():
+    """Queue a /procesar run in the background; returns a job id."""
+    params = request.get_json(silent=True) or {}
+    try:
+        limite = _leer_limite(params)
+        recalcular = _leer_bandera(params, 'recalcular')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        try:
+            fuente, origen_calculo = _resolver_fuente(params, obtener_red().embalses)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        trabajo_id = cola_trabajos.encolar(
+            'procesar', _trabajo_procesar,
+            fuente=fuente, origen_calculo=origen_calculo, limite=limite, recalcular=recalcular
+        )
+        return _respuesta_trabajo(trabajo_id)
+    except Exception as e:
+        logging.error(f"Error encolando procesamiento: {str(e)}")
+        return jsonify({"error": f"Error encolando procesamiento: {str(e)}"}), 500
+
+@app.route("/api/jobs/generar-red-completa", methods=["POST"])
+def encolar_generar_red_completa():
+    """Queue a full-network generation in the background; returns a job id."""
+    try:
+        trabajo_id = cola_trabajos.encolar('generar_red', _trabajo_generar_red)
+        return _respuesta_trabajo(trabajo_id)
+    except Exception as e:
+        logging.error(f"Error encolando generación de red: {str(e)}")
+        return jsonify({"error": f"Error encolando generación de red: {str(e)}"}), 500
+
+@app.route("/api/jobs/<int:trabajo_id>")
+def get_trabajo(trabajo_id):
+    """Get the status, progress and result of a background job."""
+    try:
+        trabajo = cola_trabajos.obtener(trabajo_id)
+        if trabajo is None:
+            return jsonify({"error": f"Trabajo {trabajo_id} no encontrado"}), 404
+        return jsonify(trabajo.to_dict())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=5000, debug=True)
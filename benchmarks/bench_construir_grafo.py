@@ -0,0 +1,156 @@
+"""
+Benchmark de construir_grafo: versión columnar frente a la versión original con iterrows.
+
+Uso:
+    python benchmarks/bench_construir_grafo.py [--tamanos 1000 10000 100000] [--repeticiones 3]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+from geopy.distance import geodesic
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from distancias import cerca_de_puntos  # noqa: E402
+from grafo_agua import RADIO_PUNTO_CRITICO_KM, construir_grafo  # noqa: E402
+
+
+def construir_grafo_iterrows(embalses, puntos, nodos, aristas):
+    """Reference copy of the original row-by-row construir_grafo."""
+    G = nx.DiGraph()
+
+    for _, e in embalses.iterrows():
+        nombre = e.get('Nombre', e.get('nombre', f'Embalse_{_}'))
+        latitud = e.get('Latitud', e.get('latitud', 0))
+        longitud = e.get('Longitud', e.get('longitud', 0))
+        capacidad = e.get('Volumen_Almacenado_m3', e.get('volumen_almacenado_m3', 1000000))
+        G.add_node(nombre, pos=(latitud, longitud), tipo='embalse', capacidad=capacidad, estado='transitable')
+
+    for _, p in puntos.iterrows():
+        nombre = p.get('Nombre', p.get('nombre', f'PC_{_}'))
+        latitud = p.get('Latitud', p.get('latitud', 0))
+        longitud = p.get('Longitud', p.get('longitud', 0))
+        tipo = p.get('Tipo', p.get('tipo', 'critico'))
+        G.add_node(nombre, pos=(latitud, longitud), tipo='punto_critico', subtipo=tipo, estado='obstaculo')
+
+    for _, n in nodos.iterrows():
+        G.add_node(n['id_nodo'], pos=(n['latitud'], n['longitud']), tipo=n['tipo'], estado=n['estado'])
+
+    for _, a in aristas.iterrows():
+        if a['origen'] in G.nodes and a['destino'] in G.nodes:
+            origen_estado = G.nodes[a['origen']].get('estado', 'transitable')
+            destino_estado = G.nodes[a['destino']].get('estado', 'transitable')
+            if (origen_estado == 'obstaculo' or destino_estado == 'obstaculo' or
+                    a['estado'] == 'bloqueado'):
+                continue
+            pos1 = G.nodes[a['origen']]['pos']
+            pos2 = G.nodes[a['destino']]['pos']
+            if 'distancia' in a and pd.notna(a['distancia']) and a['distancia'] > 0:
+                dist = float(a['distancia'])
+            else:
+                dist = geodesic(pos1, pos2).kilometers
+            capacidad = float(a.get('capacidad', 1000))
+            G.add_edge(a['origen'], a['destino'], weight=dist, estado=a['estado'], color='blue',
+                       capacidad=capacidad, distancia=dist)
+    return G
+
+
+def red_sintetica(num_aristas, semilla=42):
+    """Random Arequipa-like network with roughly ``num_aristas`` edges (3 per node)."""
+    rng = np.random.default_rng(semilla)
+    num_nodos = max(num_aristas // 3, 10)
+
+    embalses = pd.DataFrame({
+        'Nombre': [f'Embalse_{i}' for i in range(5)],
+        'Latitud': rng.uniform(-16.45, -16.35, 5),
+        'Longitud': rng.uniform(-71.60, -71.50, 5),
+        'Volumen_Almacenado_m3': rng.integers(900000, 1500000, 5),
+    })
+    puntos = pd.DataFrame({
+        'nombre': [f'PC_{i:03d}' for i in range(15)],
+        'latitud': rng.uniform(-16.45, -16.35, 15),
+        'longitud': rng.uniform(-71.60, -71.50, 15),
+        'tipo': rng.choice(['inundacion', 'deslizamiento', 'obra'], 15),
+        'prioridad': rng.choice(['alta', 'media', 'baja'], 15),
+        'poblacion_afectada': rng.integers(100, 5000, 15),
+    })
+    ids = np.array([f'D{i:06d}' for i in range(num_nodos)])
+    nodos = pd.DataFrame({
+        'id_nodo': ids,
+        'latitud': rng.uniform(-16.45, -16.35, num_nodos),
+        'longitud': rng.uniform(-71.60, -71.50, num_nodos),
+        'tipo': rng.choice(['cuadra', 'tubo', 'bomba', 'valvula'], num_nodos),
+        'estado': rng.choice(['transitable'] * 3 + ['obstaculo'], num_nodos),
+    })
+    todos = np.concatenate([ids, embalses['Nombre'].to_numpy()])
+    distancia = np.round(rng.uniform(0.05, 2.0, num_aristas), 2)
+    distancia[rng.random(num_aristas) < 0.1] = np.nan  # some edges without distance
+    aristas = pd.DataFrame({
+        'origen': rng.choice(todos, num_aristas),
+        'destino': rng.choice(todos, num_aristas),
+        'distancia': distancia,
+        'estado': rng.choice(['transitable'] * 9 + ['bloqueado'], num_aristas),
+        'capacidad': 1000,
+    })
+    return embalses, puntos, nodos, aristas
+
+
+def medir(funcion, datos, repeticiones):
+    """Best wall-clock time (s) over several runs, plus the last result."""
+    mejor = float('inf')
+    resultado = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion(*datos)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor, resultado
+
+
+def comparar(G_ref, G_nuevo, puntos):
+    """Check both builds produce the same nodes, edges and (approximately) weights.
+
+    The original builder predates the critical-point radius rule, so when it
+    is on (RADIO_PUNTO_CRITICO_KM > 0) the edges touching a node within that
+    radius of a critical point are dropped from the reference before
+    comparing. With the rule off both builds must match as they are.
+    """
+    assert set(G_ref.nodes) == set(G_nuevo.nodes), "node sets differ"
+    nombres = list(G_ref.nodes)
+    posiciones = np.array([G_ref.nodes[n]['pos'] for n in nombres], dtype=float)
+    if RADIO_PUNTO_CRITICO_KM > 0:
+        cerca = cerca_de_puntos(posiciones[:, 0], posiciones[:, 1], puntos['latitud'], puntos['longitud'],
+                                RADIO_PUNTO_CRITICO_KM)
+    else:
+        cerca = np.zeros(len(nombres), dtype=bool)
+    excluidos = {n for n, c in zip(nombres, cerca) if c and G_ref.nodes[n]['tipo'] != 'punto_critico'}
+    aristas_ref = [(u, v) for u, v in G_ref.edges if u not in excluidos and v not in excluidos]
+    assert set(aristas_ref) == set(G_nuevo.edges), "edge sets differ"
+    pesos_ref = np.array([G_ref.edges[u, v]['weight'] for u, v in aristas_ref])
+    pesos_nuevo = np.array([G_nuevo.edges[u, v]['weight'] for u, v in aristas_ref])
+    # distancias.distancia_km vs geodesic differ by far less than 1e-6 at Arequipa's scale
+    return float(np.max(np.abs(pesos_ref - pesos_nuevo) / np.maximum(pesos_ref, 1e-9), initial=0.0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tamanos', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeticiones', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'aristas':>10} {'iterrows (s)':>14} {'columnar (s)':>14} {'speedup':>9} {'err. rel.':>10}")
+    for tamano in args.tamanos:
+        datos = red_sintetica(tamano)
+        t_ref, G_ref = medir(construir_grafo_iterrows, datos, args.repeticiones)
+        t_nuevo, G_nuevo = medir(construir_grafo, datos, args.repeticiones)
+        error = comparar(G_ref, G_nuevo, datos[1])
+        print(f"{tamano:>10} {t_ref:>14.3f} {t_nuevo:>14.3f} {t_ref / t_nuevo:>8.1f}x {error:>10.2e}")
+
+
+if __name__ == "__main__":
+    main()
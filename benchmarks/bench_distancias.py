@@ -0,0 +1,62 @@
+"""
+Precisión y velocidad de los núcleos de distancia frente a la geodésica WGS84 (geopy).
+
+Uso:
+    python benchmarks/bench_distancias.py [--pares 20000] [--semilla 0]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from distancias import distancia_km, equirectangular_km, geodesica_km, haversine_km  # noqa: E402
+
+
+def pares_arequipa(num_pares, alcance_grados, semilla=0):
+    """Random coordinate pairs in the Arequipa area, at most alcance_grados apart per axis."""
+    rng = np.random.default_rng(semilla)
+    lat1 = rng.uniform(-16.50, -16.30, num_pares)
+    lon1 = rng.uniform(-71.65, -71.45, num_pares)
+    lat2 = lat1 + rng.uniform(-alcance_grados, alcance_grados, num_pares)
+    lon2 = lon1 + rng.uniform(-alcance_grados, alcance_grados, num_pares)
+    return lat1, lon1, lat2, lon2
+
+
+def medir(funcion, pares):
+    """Wall-clock time per pair (ns) and the computed distances."""
+    inicio = time.perf_counter()
+    resultado = funcion(*pares)
+    return (time.perf_counter() - inicio) / len(pares[0]) * 1e9, resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pares', type=int, default=20000)
+    parser.add_argument('--semilla', type=int, default=0)
+    args = parser.parse_args()
+
+    metodos = [
+        ('equirectangular_km', equirectangular_km),
+        ('haversine_km', haversine_km),
+        ('distancia_km', distancia_km),
+    ]
+    print(f"{'escala':>8} {'método':>20} {'err. rel. máx':>14} {'err. abs. máx (m)':>18} {'ns/par':>10}")
+    # ~0.045° is ~5 km (pipe scale), ~0.45° is ~50 km (regional scale)
+    for etiqueta, alcance in [('5 km', 0.045), ('50 km', 0.45)]:
+        pares = pares_arequipa(args.pares, alcance, args.semilla)
+        t_ref, referencia = medir(geodesica_km, pares)
+        for nombre, funcion in metodos:
+            t, d = medir(funcion, pares)
+            error = np.abs(d - referencia)
+            relativo = np.max(error / np.maximum(referencia, 1e-12))
+            print(f"{etiqueta:>8} {nombre:>20} {relativo:>14.2e} {np.max(error) * 1000:>18.4f} {t:>10.1f}")
+        print(f"{etiqueta:>8} {'geodesica_km':>20} {'referencia':>14} {'--':>18} {t_ref:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""
+Benchmark del pipeline de grafo_agua sobre redes sintéticas de Arequipa.
+
+Genera redes reproducibles (con semilla) usando la lógica de
+generar_red_completa_arequipa y mide, por separado, el tiempo y el pico de
+memoria de cada etapa: lectura de los CSV (cargar_datos), construcción del
+DiGraph (construir_grafo) y del grafo compacto, cálculo de rutas y de flujos
+máximos, y serialización de la topología (/api/topologia, con gzip) y de la
+respuesta JSON de /procesar.
+
+El resultado se escribe como JSON para compararlo entre commits:
+
+    python benchmarks/bench_pipeline.py --salida base.json
+    python benchmarks/bench_pipeline.py --comparar base.json
+
+La memoria se mide con tracemalloc en una ejecución aparte, que en el cálculo
+de flujos es varias veces más lenta: la red de un millón de aristas tarda
+unos 25 minutos en total, o unos 4 con --sin-memoria.
+
+Uso:
+    python benchmarks/bench_pipeline.py [--tamanos 1000 10000 100000 1000000] [--semilla 1]
+        [--destinos 100] [--repeticiones 1] [--sin-memoria] [--log-level NIVEL]
+        [--salida archivo.json] [--comparar base.json]
+
+Por defecto el registro (logging) está desactivado; con --log-level los
+mensajes de ese nivel se formatean y se escriben en os.devnull, de modo que
+su coste entra en los tiempos.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import generar_red_completa_arequipa as generador  # noqa: E402
+from grafo_agua import (calcular_flujos, calcular_rutas, cargar_datos, comprimir_rutas,  # noqa: E402
+                        construir_grafo, construir_grafo_csr_y_atributos, rutas_por_indice,
+                        topologia_columnar)
+from registro import FORMATO_LOG  # noqa: E402
+
+# Bumped when the layout of the JSON output changes
+FORMATO_RESULTADOS = 2
+
+# Up to this many nearest neighbours per node: the generator's default of 4 leaves the city
+# in islands of a few hundred nodes, with 8 a reservoir reaches nearly every distribution node
+MAX_CONEXIONES = 8
+# Edges per distribution node once the generated pipes are listed both ways (measured: about 3.25)
+ARISTAS_POR_NODO = 3.25
+NUM_PUNTOS = 15
+VOLUMEN_EMBALSE_M3 = 1000000
+FUENTE = generador.EMBALSES[0]['id']
+
+# Stages faster or smaller than this are not flagged by --comparar (their noise is larger than the signal)
+TIEMPO_MINIMO_S = 0.05
+MEMORIA_MINIMA_MB = 1.0
+
+
+def red_arequipa(num_aristas, semilla, directorio):
+    """Write data/*.csv of an Arequipa-like network with about ``num_aristas`` edges under directorio.
+
+    The generator links each node only towards its nearest neighbours (and
+    the reservoirs only as destinations), which leaves almost nothing
+    reachable from a reservoir. Each pipe is therefore listed in both
+    directions, as in data/aristas.csv.
+    """
+    random.seed(semilla)
+    nodos = generador.generar_nodos_distribucion(max(int(num_aristas / ARISTAS_POR_NODO), 10))
+    puntos = generador.generar_puntos_criticos_obstaculos(NUM_PUNTOS)
+    aristas = pd.DataFrame(generador.generar_aristas_red([], nodos, puntos, MAX_CONEXIONES))
+
+    inversas = aristas.rename(columns={'origen': 'destino', 'destino': 'origen'})[aristas.columns]
+    aristas = pd.concat([aristas, inversas], ignore_index=True).drop_duplicates(['origen', 'destino'])
+    nombres = [e['id'] for e in generador.EMBALSES]
+
+    embalses = pd.DataFrame({
+        'Nombre': nombres,
+        'Latitud': [e['coords'][0] for e in generador.EMBALSES],
+        'Longitud': [e['coords'][1] for e in generador.EMBALSES],
+        'Volumen_Almacenado_m3': VOLUMEN_EMBALSE_M3,
+    })
+
+    datos = os.path.join(directorio, 'data')
+    os.makedirs(datos, exist_ok=True)
+    embalses.to_csv(os.path.join(datos, 'embalses.csv'), index=False)
+    pd.DataFrame(puntos).to_csv(os.path.join(datos, 'puntos_criticos.csv'), index=False)
+    pd.DataFrame(nodos).to_csv(os.path.join(datos, 'nodos.csv'), index=False)
+    aristas.to_csv(os.path.join(datos, 'aristas.csv'), index=False)
+    return len(nodos), len(aristas)
+
+
+def medir(funcion, repeticiones, memoria=True):
+    """Best wall-clock time (s) over several runs, peak traced memory (MB) of one more run, and its result.
+
+    Memory is measured in a separate run because tracemalloc slows the code
+    down; numpy and pandas buffers are traced too. Without ``memoria`` the
+    peak is None.
+    """
+    mejor = float('inf')
+    resultado = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+    if not memoria:
+        return mejor, None, resultado
+
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        resultado = funcion()
+        pico = tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+    return mejor, pico / 2**20, resultado
+
+
+def importar_app():
+    """The app module, configured to start without a database server or background thread."""
+    os.environ.setdefault('DATABASE_URL', 'sqlite://')
+    os.environ['FUENTE_DATOS'] = 'csv'
+    os.environ['ESTADO_INTERVALO_S'] = '0'
+    import app as aplicacion
+    return aplicacion
+
+
+def serializar_topologia(grafo, atributos):
+    """Gzip-encoded /api/topologia body of the network, as the endpoint builds it."""
+    aplicacion = importar_app()
+    columnas = topologia_columnar(grafo, atributos)
+    return aplicacion._comprimir(aplicacion._json_topologia('bench', columnas), 'gzip')
+
+
+def serializar_procesar(rutas, flujos, distancias, indice):
+    """Body of a compact /procesar response for these results, built and encoded as the endpoint does."""
+    aplicacion = importar_app()
+    from flask import jsonify
+
+    with aplicacion.app.app_context():
+        return jsonify({
+            "version_red": 'bench',
+            "rutas": rutas_por_indice(comprimir_rutas(rutas, flujos, distancias), indice),
+            "fuente": FUENTE,
+            "procesamiento_id": None,
+            "tiempo_procesamiento_ms": 0,
+            "cached": False,
+        }).get_data()
+
+
+def ejecutar(num_aristas, semilla, destinos, repeticiones, memoria=True):
+    """Generate one network and time every pipeline stage on it; returns its result entry.
+
+    Each stage is reported on stderr as soon as it is measured.
+    """
+    with tempfile.TemporaryDirectory() as directorio:
+        inicio = time.perf_counter()
+        num_nodos, num_aristas_reales = red_arequipa(num_aristas, semilla, directorio)
+        generacion = time.perf_counter() - inicio
+
+        etapas = {}
+
+        def etapa(nombre, funcion):
+            tiempo, pico, resultado = medir(funcion, repeticiones, memoria)
+            etapas[nombre] = {'tiempo_s': round(tiempo, 6),
+                              'memoria_pico_mb': round(pico, 3) if pico is not None else None}
+            print(f"{num_aristas_reales:>10} {nombre:<22} {tiempo:>11.3f} "
+                  f"{pico if pico is not None else float('nan'):>10.1f}", file=sys.stderr)
+            return resultado
+
+        anterior = os.getcwd()
+        os.chdir(directorio)
+        try:
+            datos = etapa('cargar_datos', cargar_datos)
+            etapa('construir_grafo', lambda: construir_grafo(*datos))
+            grafo, atributos = etapa('construir_grafo_csr', lambda: construir_grafo_csr_y_atributos(*datos))
+            seleccion = grafo.destinos(destinos or None)
+            rutas, distancias = etapa('rutas', lambda: calcular_rutas(grafo, FUENTE, seleccion))
+            alcanzables = [d for d in seleccion if rutas[d] is not None]
+            flujos = etapa('flujos', lambda: calcular_flujos(grafo, FUENTE, alcanzables))
+            flujos = {d: flujos.get(d, 0) for d in seleccion}
+            topologia = etapa('serializar_topologia', lambda: serializar_topologia(grafo, atributos))
+            cuerpo = etapa('serializar_procesar',
+                           lambda: serializar_procesar(rutas, flujos, distancias, grafo.indice))
+        finally:
+            os.chdir(anterior)
+
+    return {
+        'aristas_objetivo': num_aristas,
+        'nodos': num_nodos,
+        'aristas': num_aristas_reales,
+        'destinos': len(seleccion),
+        'destinos_alcanzables': len(alcanzables),
+        'generacion_s': round(generacion, 3),
+        'topologia_bytes': len(topologia),
+        'respuesta_bytes': len(cuerpo),
+        'etapas': etapas,
+    }
+
+
+def entorno():
+    """Versions and commit the numbers were measured with."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'networkx': nx.__version__,
+    }
+
+
+def comparar(actual, base, tolerancia):
+    """Print time and memory ratios against a previous run; returns True if any stage regressed."""
+    anteriores = {r['aristas_objetivo']: r for r in base['resultados']}
+    regresion = False
+    print(f"{'aristas':>10} {'etapa':<22} {'tiempo':>9} {'memoria':>9}", file=sys.stderr)
+    for resultado in actual['resultados']:
+        previo = anteriores.get(resultado['aristas_objetivo'])
+        if previo is None:
+            continue
+        for nombre, medida in resultado['etapas'].items():
+            if nombre not in previo['etapas']:
+                continue
+            # Runs with --sin-memoria have no peak to compare
+            cocientes = [medida[clave] / max(previo['etapas'][nombre][clave], 1e-9)
+                         if medida[clave] is not None and previo['etapas'][nombre][clave] is not None else float('nan')
+                         for clave in ('tiempo_s', 'memoria_pico_mb')]
+            peor = ((cocientes[0] > 1 + tolerancia and medida['tiempo_s'] >= TIEMPO_MINIMO_S) or
+                    (cocientes[1] > 1 + tolerancia and medida['memoria_pico_mb'] >= MEMORIA_MINIMA_MB))
+            marca = ' REGRESION' if peor else ''
+            regresion = regresion or bool(marca)
+            print(f"{resultado['aristas_objetivo']:>10} {nombre:<22} {cocientes[0]:>8.2f}x {cocientes[1]:>8.2f}x{marca}",
+                  file=sys.stderr)
+    return regresion
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tamanos', type=int, nargs='+', default=[1000, 10000, 100000, 1000000],
+                        help='aristas aproximadas de cada red')
+    parser.add_argument('--semilla', type=int, default=1)
+    parser.add_argument('--destinos', type=int, default=100,
+                        help='destinos de rutas y flujos (el limite de /procesar; 0 para todos)')
+    parser.add_argument('--repeticiones', type=int, default=1)
+    parser.add_argument('--sin-memoria', action='store_true', help='omitir la medición del pico de memoria')
+    parser.add_argument('--log-level', help='medir con el registro activo a este nivel (DEBUG, INFO...)')
+    parser.add_argument('--salida', help='archivo JSON de resultados (por defecto, la salida estándar)')
+    parser.add_argument('--comparar', help='JSON de una ejecución anterior con el que comparar')
+    parser.add_argument('--tolerancia', type=float, default=0.2,
+                        help='aumento relativo a partir del cual una etapa se marca como regresión')
+    args = parser.parse_args()
+
+    if args.log_level:
+        # The app configures logging from LOG_LEVEL when it is imported
+        os.environ['LOG_LEVEL'] = args.log_level.upper()
+        logging.basicConfig(level=args.log_level.upper(), format=FORMATO_LOG,
+                            handlers=[logging.StreamHandler(open(os.devnull, 'w'))], force=True)
+    else:
+        logging.disable(logging.CRITICAL)
+    # Import the app up front so its start-up is not timed as serialisation
+    importar_app()
+
+    resultados = {'formato': FORMATO_RESULTADOS, 'entorno': entorno(), 'semilla': args.semilla,
+                  'destinos': args.destinos, 'repeticiones': args.repeticiones,
+                  'log_level': args.log_level, 'resultados': []}
+    print(f"{'aristas':>10} {'etapa':<22} {'tiempo (s)':>11} {'pico (MB)':>10}", file=sys.stderr)
+    for tamano in args.tamanos:
+        resultados['resultados'].append(
+            ejecutar(tamano, args.semilla, args.destinos, args.repeticiones, not args.sin_memoria)
+        )
+
+    texto = json.dumps(resultados, indent=2)
+    if args.salida:
+        with open(args.salida, 'w') as f:
+            f.write(texto + '\n')
+    else:
+        print(texto)
+
+    if args.comparar:
+        with open(args.comparar) as f:
+            base = json.load(f)
+        if comparar(resultados, base, args.tolerancia):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Resumen del estado del sistema para /status.
+
+/status se consulta en cada carga de la página, así que no lee los archivos
+de datos ni cuenta filas: responde con un resumen en memoria. Las filas de
+la red las mantiene grafo_agua al cargarla y al aplicar cambios
+incrementales (ver ``resumen_red``). Las tablas de historial se cuentan al
+arrancar y se incrementan con cada procesamiento que guarda este proceso.
+
+Un hilo en segundo plano llama periódicamente a ``obtener_red()`` (que
+recarga la red si cambiaron los archivos o las tablas de origen) y vuelve a
+contar el historial, de modo que los cambios hechos por otros procesos
+también se reflejan, con un retraso de a lo sumo ``ESTADO_INTERVALO_S``.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import func, select
+
+from grafo_agua import obtener_red, resumen_red
+
+# Seconds between background refreshes; 0 disables the refresher thread
+INTERVALO_ESTADO_S = float(os.environ.get("ESTADO_INTERVALO_S", "30"))
+
+
+def _fecha(marca):
+    """ISO date of a Unix timestamp (None stays None)."""
+    return datetime.fromtimestamp(marca).isoformat() if marca is not None else None
+
+
+class EstadoSistema:
+    """In-memory status summary: network row counts, history table counts and cache statistics.
+
+    ``tablas`` maps a name to the model whose rows are counted (e.g.
+    ``{'procesamientos': Procesamiento}``).
+    """
+
+    def __init__(self, app, db, tablas, intervalo=INTERVALO_ESTADO_S):
+        self.app = app
+        self.db = db
+        self.tablas = tablas
+        self.intervalo = intervalo
+        self.iniciado_en = time.time()
+        self._lock = threading.Lock()
+        self._conteos_db = {}
+        self._conteos_db_en = None
+        self._error_db = None
+        self._error_red = None
+        self._resultados = Counter(memoria=0, base_datos=0, fallos=0)
+        self._hilo = None
+
+    def iniciar(self):
+        """Count the history tables and start the background refresher (once)."""
+        if self._hilo is not None:
+            return
+        if self.intervalo > 0:
+            # The first pass also loads the network, so the first page view does not wait for it
+            self._hilo = threading.Thread(target=self._bucle, name="estado", daemon=True)
+            self._hilo.start()
+        else:
+            self._hilo = False
+            self.contar_tablas()
+
+    def _bucle(self):
+        while True:
+            self.refrescar()
+            time.sleep(self.intervalo)
+
+    def refrescar(self):
+        """Recount the history tables and reload the network if its source changed."""
+        self.contar_tablas()
+        try:
+            obtener_red()
+            self._error_red = None
+        except Exception as e:
+            self._error_red = str(e)
+            logging.warning(f"Status refresh could not load the network: {e}")
+
+    def contar_tablas(self):
+        """Count the rows of the history tables (one query)."""
+        with self.app.app_context():
+            try:
+                fila = self.db.session.execute(select(*[
+                    select(func.count()).select_from(modelo).scalar_subquery() for modelo in self.tablas.values()
+                ])).one()
+            except Exception as e:
+                self.db.session.rollback()
+                with self._lock:
+                    self._error_db = str(e)
+                logging.warning(f"Status refresh could not count the history tables: {e}")
+                return
+        with self._lock:
+            self._conteos_db = dict(zip(self.tablas, fila))
+            self._conteos_db_en = time.time()
+            self._error_db = None
+
+    def sumar_filas(self, tabla, cantidad=1):
+        """Account for rows this process inserted into a history table."""
+        with self._lock:
+            if tabla in self._conteos_db:
+                self._conteos_db[tabla] += cantidad
+
+    def registrar_resultado(self, tipo):
+        """Count a result cache lookup: 'memoria', 'base_datos' or 'fallos'."""
+        with self._lock:
+            self._resultados[tipo] += 1
+
+    def resumen(self):
+        """The /status payload, built from memory only."""
+        red = resumen_red()
+        with self._lock:
+            conteos_db = dict(self._conteos_db)
+            conteos_db_en = self._conteos_db_en
+            error_db = self._error_db
+            resultados = dict(self._resultados)
+
+        if red["red"] is not None:
+            conteos = red["red"]["conteos"]
+            data_summary = {
+                "embalses": conteos.get("embalses"),
+                "puntos_criticos": conteos.get("puntos"),
+                "nodos": conteos.get("nodos"),
+                "aristas": conteos.get("aristas"),
+            }
+            estado = "ok"
+        else:
+            data_summary = None
+            estado = "error" if self._error_red else "cargando"
+
+        resumen = {
+            "status": estado,
+            "data_summary": data_summary,
+            "database_status": f"Database error: {error_db}" if error_db else "ok",
+            "database_counts": conteos_db,
+            "database_counts_at": _fecha(conteos_db_en),
+            "network": None,
+            "network_checked_at": _fecha(red["comprobada_en"]),
+            "cache": {"red": red["estadisticas"], "resultados": resultados},
+            "started_at": _fecha(self.iniciado_en),
+        }
+        if red["red"] is not None:
+            resumen["network"] = {
+                "version": red["red"]["version"],
+                "source": red["red"]["origen"],
+                "loaded_at": _fecha(red["red"]["cargada_en"]),
+                "load_time_ms": red["red"]["duracion_carga_ms"],
+            }
+        if self._error_red:
+            resumen["message"] = self._error_red
+        return resumen
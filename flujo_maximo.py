@@ -0,0 +1,274 @@
+"""
+Motor de flujo máximo para la red de distribución de agua.
+
+La red de capacidades se construye una sola vez como arreglos enteros en
+formato CSR (indptr/indices) indexados por nodo, y se reutiliza para responder
+muchas consultas embalse -> nodo sin reconstruir la red residual en cada una.
+Cuando todas las tuberías son pares simétricos (u->v y v->u con la misma
+capacidad) se precalcula un árbol de Gomory-Hu (algoritmo de Gusfield) y cada
+consulta se resuelve recorriendo el árbol.
+"""
+
+import logging
+import math
+import threading
+from collections import deque
+
+import numpy as np
+
+from grafo_csr import GrafoCSR
+
+# Name of the virtual node joined to every reservoir in multi-source mode
+SUPERFUENTE = '__superfuente__'
+
+
+class RedFlujo:
+    """Capacity network in CSR form that answers repeated max-flow queries.
+
+    ``G`` is a NetworkX graph or a GrafoCSR, whose active edges are used.
+
+    ``fuentes`` optionally maps reservoirs to a capacity; a virtual
+    SUPERFUENTE node is then added with an arc of that capacity to each one,
+    so flows queried from SUPERFUENTE are the total deliverable from all of
+    them. If the pipes are symmetric the super-source arcs are made symmetric
+    too, which keeps the Gomory-Hu tree valid for queries from SUPERFUENTE.
+    """
+
+    def __init__(self, G, capacity='capacidad', fuentes=None):
+        if isinstance(G, GrafoCSR):
+            # Only the active edges of the compact graph carry water
+            self.nodos = list(G.nombres)
+            origen, destino, capacidad = (a.tolist() for a in G.aristas_activas())
+        else:
+            self.nodos = list(G.nodes)
+        if fuentes:
+            self.nodos.append(SUPERFUENTE)
+        self.indice = {n: i for i, n in enumerate(self.nodos)}
+        n = len(self.nodos)
+
+        if not isinstance(G, GrafoCSR):
+            origen = []
+            destino = []
+            capacidad = []
+            for u, v, d in G.edges(data=True):
+                origen.append(self.indice[u])
+                destino.append(self.indice[v])
+                c = d.get(capacity, 0)
+                capacidad.append(c if c and not math.isnan(c) else 0)
+
+        simetrica = self._es_simetrica(origen, destino, capacidad)
+        for embalse, volumen in (fuentes or {}).items():
+            origen.append(self.indice[SUPERFUENTE])
+            destino.append(self.indice[embalse])
+            capacidad.append(volumen)
+            if simetrica:
+                origen.append(self.indice[embalse])
+                destino.append(self.indice[SUPERFUENTE])
+                capacidad.append(volumen)
+
+        m = len(origen)
+        origen = np.asarray(origen, dtype=np.int64)
+        destino = np.asarray(destino, dtype=np.int64)
+        capacidad = np.rint(np.asarray(capacidad, dtype=np.float64)).astype(np.int64)
+        capacidad = np.maximum(capacidad, 0)
+
+        # Every pipe gets a forward arc (k) and a zero-capacity reverse arc (m + k)
+        cola = np.concatenate([origen, destino])
+        cabeza = np.concatenate([destino, origen])
+        cap = np.concatenate([capacidad, np.zeros(m, dtype=np.int64)])
+        pareja = np.concatenate([np.arange(m, 2 * m), np.arange(0, m)])
+
+        # Sort arcs by tail to obtain the CSR layout; arc ids become CSR positions
+        orden = np.argsort(cola, kind='stable')
+        posicion = np.empty_like(orden)
+        posicion[orden] = np.arange(len(orden))
+
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cola, minlength=n), out=self.indptr[1:])
+        self.indices = cabeza[orden]
+        self.capacidad = cap[orden]
+        self.reverso = posicion[pareja[orden]]
+        self.simetrica = simetrica
+
+        # Plain lists for the inner loops (much faster than numpy scalar access)
+        self._indptr = self.indptr.tolist()
+        self._indices = self.indices.tolist()
+        self._capacidad = self.capacidad.tolist()
+        self._reverso = self.reverso.tolist()
+        self._residual = list(self._capacidad)
+        self._arbol = None
+        # The residual arrays are shared, so queries are serialised
+        self._lock = threading.Lock()
+
+        logging.info(f"Flow network built with {n} nodes and {m} arcs (symmetric: {self.simetrica})")
+
+    @staticmethod
+    def _es_simetrica(origen, destino, capacidad):
+        """True when every arc u->v has a reverse arc v->u with the same capacity."""
+        directos = set(zip(origen, destino, (round(c) for c in capacidad)))
+        return all((v, u, c) in directos for u, v, c in directos)
+
+    def _niveles(self, s, t):
+        """BFS over the residual network; returns node levels (-1 when unreached)."""
+        indptr, indices, residual = self._indptr, self._indices, self._residual
+        nivel = [-1] * len(self.nodos)
+        nivel[s] = 0
+        cola = deque([s])
+        while cola:
+            u = cola.popleft()
+            for a in range(indptr[u], indptr[u + 1]):
+                v = indices[a]
+                if residual[a] > 0 and nivel[v] < 0:
+                    nivel[v] = nivel[u] + 1
+                    if v == t:
+                        return nivel
+                    cola.append(v)
+        return nivel
+
+    def _dinic(self, s, t):
+        """Dinic's algorithm on the residual arrays (which must be reset by the caller)."""
+        if s == t:
+            return 0
+        indptr, indices, residual, reverso = self._indptr, self._indices, self._residual, self._reverso
+        total = 0
+        while True:
+            nivel = self._niveles(s, t)
+            if nivel[t] < 0:
+                return total
+            puntero = indptr[:-1]
+            pila = []
+            u = s
+            while True:
+                if u == t:
+                    # Augment along the stacked path and retreat to the first saturated arc
+                    f = min(residual[a] for a in pila)
+                    total += f
+                    corte = None
+                    for k, a in enumerate(pila):
+                        residual[a] -= f
+                        residual[reverso[a]] += f
+                        if corte is None and residual[a] == 0:
+                            corte = k
+                    del pila[corte:]
+                    u = s if not pila else indices[pila[-1]]
+                    continue
+                fin = indptr[u + 1]
+                a = puntero[u]
+                while a < fin and not (residual[a] > 0 and nivel[indices[a]] == nivel[u] + 1):
+                    a += 1
+                puntero[u] = a
+                if a < fin:
+                    pila.append(a)
+                    u = indices[a]
+                elif not pila:
+                    break
+                else:
+                    # Dead end: drop u from the level graph and retreat
+                    nivel[u] = -1
+                    pila.pop()
+                    u = s if not pila else indices[pila[-1]]
+                    puntero[u] += 1
+
+    def _alcanzables(self, s):
+        """Nodes reachable from s in the current residual network."""
+        indptr, indices, residual = self._indptr, self._indices, self._residual
+        visto = [False] * len(self.nodos)
+        visto[s] = True
+        pila = [s]
+        while pila:
+            u = pila.pop()
+            for a in range(indptr[u], indptr[u + 1]):
+                v = indices[a]
+                if residual[a] > 0 and not visto[v]:
+                    visto[v] = True
+                    pila.append(v)
+        return visto
+
+    def flujo_maximo(self, fuente, destino):
+        """Maximum flow value between two nodes, reusing the residual arrays."""
+        with self._lock:
+            self._residual[:] = self._capacidad
+            return self._dinic(self.indice[fuente], self.indice[destino])
+
+    def arbol_gomory_hu(self):
+        """Build (once) the flow-equivalent tree with Gusfield's algorithm.
+
+        Returns ``(padre, peso)`` arrays: the max flow between two nodes is the
+        minimum ``peso`` on the tree path joining them.
+        """
+        with self._lock:
+            if self._arbol is None:
+                if not self.simetrica:
+                    raise ValueError("Gomory-Hu tree requires symmetric capacities")
+                n = len(self.nodos)
+                padre = [0] * n
+                peso = [0] * n
+                for s in range(1, n):
+                    t = padre[s]
+                    self._residual[:] = self._capacidad
+                    peso[s] = self._dinic(s, t)
+                    lado_s = self._alcanzables(s)
+                    for i in range(s + 1, n):
+                        if lado_s[i] and padre[i] == t:
+                            padre[i] = s
+                self._arbol = (padre, peso)
+                logging.info(f"Gomory-Hu tree built with {max(n - 1, 0)} max-flow computations")
+            return self._arbol
+
+    def _flujos_arbol(self, s):
+        """Max flow from s to every node by walking the Gomory-Hu tree."""
+        padre, peso = self.arbol_gomory_hu()
+        n = len(self.nodos)
+        vecinos = [[] for _ in range(n)]
+        for v in range(1, n):
+            vecinos[v].append((padre[v], peso[v]))
+            vecinos[padre[v]].append((v, peso[v]))
+        flujo = [0] * n
+        visto = [False] * n
+        visto[s] = True
+        pila = [(s, None)]
+        while pila:
+            u, minimo = pila.pop()
+            for v, w in vecinos[u]:
+                if not visto[v]:
+                    visto[v] = True
+                    flujo[v] = w if minimo is None else min(minimo, w)
+                    pila.append((v, flujo[v]))
+        return flujo
+
+    def iterar_flujos_desde(self, fuente, destinos):
+        """Yield ``(destino, flujo)`` from one source to many destinations, in order.
+
+        Uses the Gomory-Hu tree when capacities are symmetric and enough
+        destinations are requested to amortise it; otherwise runs Dinic per
+        reachable destination on the shared residual arrays, yielding each
+        value as soon as it is computed.
+        """
+        if fuente not in self.indice:
+            for destino in destinos:
+                yield destino, 0
+            return
+        s = self.indice[fuente]
+
+        if self.simetrica and (self._arbol is not None or 2 * len(destinos) >= len(self.nodos)):
+            flujo = self._flujos_arbol(s)
+            for d in destinos:
+                yield d, flujo[self.indice[d]] if d in self.indice else 0
+            return
+
+        with self._lock:
+            self._residual[:] = self._capacidad
+            alcanzables = self._alcanzables(s)
+        for destino in destinos:
+            t = self.indice.get(destino)
+            if t is None or t == s or not alcanzables[t]:
+                yield destino, 0
+                continue
+            with self._lock:
+                self._residual[:] = self._capacidad
+                flujo = self._dinic(s, t)
+            yield destino, flujo
+
+    def flujos_desde(self, fuente, destinos):
+        """Maximum flow from one source to many destinations, as a dict."""
+        return dict(self.iterar_flujos_desde(fuente, destinos))
@@ -0,0 +1,111 @@
+"""
+Carga de la red de distribución desde la base de datos.
+
+Con ``FUENTE_DATOS=db`` las tablas ``embalses``, ``puntos_criticos``,
+``nodos`` y ``aristas`` son la fuente de verdad en lugar de ``data/*.csv``.
+Cada tabla se lee con un único SELECT de las columnas necesarias, recorrido
+por lotes con ``yield_per``, y las filas van directamente a listas por
+columna: no se crean objetos ORM. Los DataFrames resultantes usan los mismos
+nombres de columna que los CSV, así que grafo_agua los trata igual.
+"""
+
+import hashlib
+import json
+
+import pandas as pd
+from sqlalchemy import func, select
+
+# Rows fetched per round trip when streaming a table
+TAMANO_LOTE_DB = 10000
+
+
+class FuenteDB:
+    """Database source of truth for the network, for grafo_agua.configurar_fuente_db."""
+
+    def __init__(self, engine, Embalse, PuntoCritico, Nodo, Arista):
+        self.engine = engine
+        # Table name -> (model, {CSV column: model column})
+        self.tablas = {
+            'embalses': (Embalse, {
+                'Nombre': Embalse.nombre,
+                'Latitud': Embalse.latitud,
+                'Longitud': Embalse.longitud,
+                'Volumen_Almacenado_m3': Embalse.volumen_almacenado_m3,
+            }),
+            'puntos': (PuntoCritico, {
+                'nombre': PuntoCritico.nombre,
+                'latitud': PuntoCritico.latitud,
+                'longitud': PuntoCritico.longitud,
+                'tipo': PuntoCritico.tipo,
+                'prioridad': PuntoCritico.prioridad,
+                'poblacion_afectada': PuntoCritico.poblacion_afectada,
+            }),
+            'nodos': (Nodo, {
+                'id_nodo': Nodo.id_nodo,
+                'latitud': Nodo.latitud,
+                'longitud': Nodo.longitud,
+                'tipo': Nodo.tipo,
+                'estado': Nodo.estado,
+            }),
+            'aristas': (Arista, {
+                'origen': Arista.origen,
+                'destino': Arista.destino,
+                'distancia': Arista.distancia,
+                'estado': Arista.estado,
+                'capacidad': Arista.capacidad,
+            }),
+        }
+
+    def _conectar(self):
+        """Connection whose reads see one consistent state of the tables where the database allows it."""
+        conexion = self.engine.connect()
+        if self.engine.dialect.name == 'postgresql':
+            conexion = conexion.execution_options(isolation_level='REPEATABLE READ')
+        return conexion
+
+    def _leer(self, conexion, nombre):
+        """Stream one projected SELECT into a DataFrame with the CSV column names."""
+        modelo, columnas = self.tablas[nombre]
+        # Insertion order, so nodes keep the order they would have in the CSV files
+        consulta = select(*columnas.values()).order_by(modelo.id)
+        datos = [[] for _ in columnas]
+        resultado = conexion.execution_options(yield_per=TAMANO_LOTE_DB).execute(consulta)
+        for lote in resultado.partitions():
+            for valores, columna in zip(zip(*lote), datos):
+                columna.extend(valores)
+        return pd.DataFrame(dict(zip(columnas, datos)), columns=list(columnas))
+
+    def cargar_tabla(self, nombre):
+        """One of the tables ('embalses', 'puntos', 'nodos', 'aristas') as a DataFrame."""
+        with self._conectar() as conexion:
+            return self._leer(conexion, nombre)
+
+    def cargar(self):
+        """The four tables, read in a single transaction, in the order returned by cargar_datos."""
+        with self._conectar() as conexion, conexion.begin():
+            return tuple(self._leer(conexion, nombre) for nombre in ('embalses', 'puntos', 'nodos', 'aristas'))
+
+    def huella(self):
+        """Cheap fingerprint of the tables: row count, last id and last update time of each.
+
+        Computed with a single SELECT of scalar subqueries; each part uses the
+        primary key or the fecha_actualizacion index.
+        """
+        subconsultas = []
+        for modelo, _ in self.tablas.values():
+            subconsultas += [
+                select(func.count(modelo.id)).scalar_subquery(),
+                select(func.max(modelo.id)).scalar_subquery(),
+                select(func.max(modelo.fecha_actualizacion)).scalar_subquery(),
+            ]
+        with self._conectar() as conexion:
+            fila = conexion.execute(select(*subconsultas)).one()
+        # Plain JSON-friendly values, as the snapshot stores the fingerprint
+        return tuple(
+            (nombre, fila[3 * k], fila[3 * k + 1], str(fila[3 * k + 2]) if fila[3 * k + 2] is not None else None)
+            for k, nombre in enumerate(self.tablas)
+        )
+
+    def version(self, huella):
+        """Network version derived from the fingerprint."""
+        return hashlib.sha256(json.dumps(huella).encode()).hexdigest()[:16]
@@ -1,12 +1,28 @@
 """
 Generador de red completa de distribución de agua para Arequipa
-Crea 100 nodos de distribución, puntos críticos como obstáculos, y aristas conectando la red
+Crea 100 nodos de distribución (configurable con --nodos), puntos críticos como obstáculos, y aristas conectando la red
 """
 
+import argparse
 import pandas as pd
 import numpy as np
 import random
-from geopy.distance import geodesic
+from distancias import distancia_km, cerca_de_puntos, proyectar_km
+
+# Solo se conectan nodos a menos de esta distancia
+DISTANCIA_MAXIMA_KM = 5.0
+# Máximo de vecinos más cercanos considerados por nodo
+MAX_CONEXIONES = 4
+# No se crean tuberías con un extremo a menos de esta distancia de un punto crítico
+RADIO_PUNTO_CRITICO_KM = 0.5
+# Embalses a los que se conecta la red (solo como destino de las aristas)
+EMBALSES = [
+    {'id': 'Embalse_Chilina', 'coords': (-16.3969, -71.5375)},
+    {'id': 'Embalse_Aguada_Blanca', 'coords': (-16.4091, -71.5875)},
+    {'id': 'Embalse_Aguada_Pillones', 'coords': (-16.3969, -71.5175)},
+    {'id': 'Embalse_Aguada_Chalhuanca', 'coords': (-16.4291, -71.5275)},
+    {'id': 'Embalse_El_Frayle', 'coords': (-16.4191, -71.5675)}
+]
 
 def generar_coordenadas_arequipa():
     """Genera coordenadas dentro del área urbana de Arequipa"""
@@ -16,9 +32,63 @@ def generar_coordenadas_arequipa():
     
     return random.uniform(lat_min, lat_max), random.uniform(lng_min, lng_max)
 
-def calcular_distancia(coord1, coord2):
-    """Calcula distancia en km entre dos coordenadas"""
-    return geodesic(coord1, coord2).kilometers
+def vecinos_cercanos(latitudes, longitudes, k, radio_km):
+    """Up to k nearest neighbours of every point within radio_km, using a uniform grid index.
+    
+    Returns an ``(n, k)`` array of neighbour indices (-1 where fewer than k
+    exist) sorted by distance. Each grid cell is processed as a block: its
+    points are compared against the surrounding ring of cells, which is
+    widened only until the k-th neighbour is provably inside it.
+    """
+    x, y = proyectar_km(latitudes, longitudes)
+    n = len(x)
+    vecinos = np.full((n, k), -1, dtype=np.int64)
+    if n < 2:
+        return vecinos
+    
+    # Cell size aiming at a few points per cell; the extents are floored so that
+    # points lying on a line still get cells holding a few of them
+    ancho, alto = np.ptp(x), np.ptp(y)
+    minimo = max(ancho, alto) / n
+    area = max(max(ancho, minimo) * max(alto, minimo), 1e-9)
+    lado = min(max(np.sqrt(area * 4 / n), 1e-3), radio_km)
+    cx = np.floor((x - x.min()) / lado).astype(np.int64)
+    cy = np.floor((y - y.min()) / lado).astype(np.int64)
+    ultima_x, ultima_y = int(cx.max()), int(cy.max())
+    
+    # Points grouped by cell: celdas[(cx, cy)] -> indices
+    orden = np.lexsort((cy, cx))
+    claves = np.stack([cx[orden], cy[orden]], axis=1)
+    cortes = np.flatnonzero(np.any(np.diff(claves, axis=0) != 0, axis=1)) + 1
+    celdas = {(int(g[0, 0]), int(g[0, 1])): orden[i:j]
+              for g, i, j in zip(np.split(claves, cortes), np.r_[0, cortes], np.r_[cortes, n])}
+    max_anillo = int(np.ceil(radio_km / lado))
+    
+    for (i, j), propios in celdas.items():
+        anillo = 1
+        while True:
+            # The ring is clipped to the grid, so widening it never visits empty space
+            candidatos = np.concatenate([
+                celdas[c] for c in (
+                    (a, b) for a in range(max(i - anillo, 0), min(i + anillo, ultima_x) + 1)
+                    for b in range(max(j - anillo, 0), min(j + anillo, ultima_y) + 1)
+                ) if c in celdas
+            ])
+            d = np.hypot(x[propios, None] - x[candidatos], y[propios, None] - y[candidatos])
+            d[propios[:, None] == candidatos[None, :]] = np.inf
+            d[d >= radio_km] = np.inf
+            m = min(k, len(candidatos))
+            cercanos = np.argsort(d, axis=1)[:, :m]
+            dist_k = np.take_along_axis(d, cercanos, axis=1)
+            # Anything outside the ring is at least anillo * lado away
+            toda_la_malla = i - anillo <= 0 and j - anillo <= 0 and i + anillo >= ultima_x and j + anillo >= ultima_y
+            if toda_la_malla or anillo >= max_anillo or (m == k and np.all(dist_k[:, -1] <= anillo * lado)):
+                break
+            anillo += 1
+        seleccion = np.where(np.isfinite(dist_k), candidatos[cercanos], -1)
+        vecinos[propios, :m] = seleccion
+    
+    return vecinos
 
 def generar_nodos_distribucion(num_nodos=100):
     """Genera nodos de distribución de agua por toda Arequipa"""
@@ -64,101 +134,73 @@ def generar_puntos_criticos_obstaculos(num_puntos=15):
     
     return puntos
 
-def generar_aristas_red(nodos_existentes, nodos_nuevos, puntos_criticos):
+def generar_aristas_red(nodos_existentes, nodos_nuevos, puntos_criticos, max_conexiones=MAX_CONEXIONES):
     """Genera aristas conectando toda la red, evitando puntos críticos"""
-    aristas = []
     todos_nodos = nodos_existentes + nodos_nuevos
     
-    # Crear un mapa de coordenadas para búsqueda rápida
-    coords_nodos = {}
-    for nodo in todos_nodos:
-        coords_nodos[nodo['id_nodo']] = (nodo['latitud'], nodo['longitud'])
-    
     # Agregar embalses también
-    embalses = [
-        {'id': 'Embalse_Chilina', 'coords': (-16.3969, -71.5375)},
-        {'id': 'Embalse_Aguada_Blanca', 'coords': (-16.4091, -71.5875)},
-        {'id': 'Embalse_Aguada_Pillones', 'coords': (-16.3969, -71.5175)},
-        {'id': 'Embalse_Aguada_Chalhuanca', 'coords': (-16.4291, -71.5275)},
-        {'id': 'Embalse_El_Frayle', 'coords': (-16.4191, -71.5675)}
-    ]
-    
-    for embalse in embalses:
-        coords_nodos[embalse['id']] = embalse['coords']
-    
-    # Conectar cada nodo a sus vecinos más cercanos
-    for nodo in todos_nodos:
-        if nodo['estado'] == 'obstaculo':
-            continue  # Los nodos obstáculo no se conectan
-            
-        nodo_coords = (nodo['latitud'], nodo['longitud'])
-        nodo_id = nodo['id_nodo']
-        
-        # Buscar los 3-5 nodos más cercanos
-        distancias = []
-        for otro_id, otras_coords in coords_nodos.items():
-            if otro_id == nodo_id:
-                continue
-                
-            dist = calcular_distancia(nodo_coords, otras_coords)
-            if dist < 5.0:  # Solo conectar si está a menos de 5km
-                distancias.append((otro_id, dist))
-        
-        # Ordenar por distancia y tomar los más cercanos
-        distancias.sort(key=lambda x: x[1])
-        num_conexiones = min(random.randint(2, 4), len(distancias))
-        
-        for i in range(num_conexiones):
-            destino_id, distancia = distancias[i]
-            
-            # Verificar que el destino no sea un obstáculo
-            destino_es_obstaculo = False
-            for n in todos_nodos:
-                if n['id_nodo'] == destino_id and n['estado'] == 'obstaculo':
-                    destino_es_obstaculo = True
-                    break
-            
-            if destino_es_obstaculo:
-                continue
-            
-            # Verificar que no pase cerca de puntos críticos
-            pasa_por_critico = False
-            for pc in puntos_criticos:
-                pc_coords = (pc['latitud'], pc['longitud'])
-                dist_origen = calcular_distancia(nodo_coords, pc_coords)
-                dist_destino = calcular_distancia(coords_nodos[destino_id], pc_coords)
-                
-                if min(dist_origen, dist_destino) < 0.5:  # A menos de 500m del punto crítico
-                    pasa_por_critico = True
-                    break
-            
-            if pasa_por_critico:
-                continue
-            
-            # Crear la arista
-            estado_arista = 'transitable'
-            capacidad = 1000
-            
-            # Algunas aristas pueden estar bloqueadas por mantenimiento
-            if random.random() < 0.1:  # 10% de probabilidad
-                estado_arista = 'bloqueado'
-                capacidad = 0
-            
-            arista = {
-                'origen': nodo_id,
-                'destino': destino_id,
-                'distancia': round(distancia, 2),
-                'estado': estado_arista,
-                'capacidad': capacidad
-            }
-            aristas.append(arista)
-    
-    return aristas
+    embalses = EMBALSES
+    
+    if len(todos_nodos) == 0:
+        return []
+    
+    # Un id repetido (data/nodos.csv acumula los nodos de cada ejecución) cuenta una vez, con su
+    # última definición; si no, un nodo podría conectarse con otra fila de sí mismo
+    nodos = pd.DataFrame(todos_nodos).drop_duplicates('id_nodo', keep='last')
+    
+    # Arreglos de coordenadas: nodos primero, luego embalses (los embalses solo son destino)
+    ids = np.concatenate([nodos['id_nodo'].to_numpy(dtype=object), [e['id'] for e in embalses]])
+    latitudes = np.concatenate([nodos['latitud'].to_numpy(dtype=float), [e['coords'][0] for e in embalses]])
+    longitudes = np.concatenate([nodos['longitud'].to_numpy(dtype=float), [e['coords'][1] for e in embalses]])
+    
+    # Estado de obstáculo por índice (en lugar de recorrer todos_nodos por arista)
+    es_obstaculo = np.concatenate([(nodos['estado'] == 'obstaculo').to_numpy(), np.zeros(len(embalses), dtype=bool)])
+    
+    # Nodos a menos de 500m de un punto crítico, calculado una sola vez para todos
+    cerca_critico = cerca_de_puntos(
+        latitudes, longitudes,
+        [pc['latitud'] for pc in puntos_criticos], [pc['longitud'] for pc in puntos_criticos],
+        RADIO_PUNTO_CRITICO_KM
+    )
+    
+    # Los 2-4 vecinos más cercanos (a menos de 5km) con un índice espacial
+    vecinos = vecinos_cercanos(latitudes, longitudes, max_conexiones, DISTANCIA_MAXIMA_KM)
+    
+    # Los nodos obstáculo no se conectan; cada nodo toma entre 2 y max_conexiones vecinos
+    origenes = np.flatnonzero(~es_obstaculo[:len(nodos)])
+    num_conexiones = np.array([random.randint(2, max_conexiones) for _ in origenes], dtype=np.int64)
+    rango = np.arange(max_conexiones)
+    tomar = (rango[None, :] < num_conexiones[:, None]) & (vecinos[origenes] >= 0)
+    
+    origen = np.repeat(origenes, tomar.sum(axis=1))
+    destino = vecinos[origenes][tomar]
+    
+    # Descartar destinos obstáculo y conexiones que pasan cerca de puntos críticos
+    validas = ~es_obstaculo[destino] & ~cerca_critico[origen] & ~cerca_critico[destino]
+    origen, destino = origen[validas], destino[validas]
+    
+    distancia = distancia_km(latitudes[origen], longitudes[origen], latitudes[destino], longitudes[destino])
+    
+    # Algunas aristas pueden estar bloqueadas por mantenimiento (10% de probabilidad)
+    bloqueada = np.array([random.random() < 0.1 for _ in range(len(origen))], dtype=bool)
+    
+    aristas = pd.DataFrame({
+        'origen': ids[origen],
+        'destino': ids[destino],
+        'distancia': np.round(distancia, 2),
+        'estado': np.where(bloqueada, 'bloqueado', 'transitable'),
+        'capacidad': np.where(bloqueada, 0, 1000)
+    })
+    return aristas.to_dict('records')
 
-def main():
+def main(num_nodos=100, num_puntos=15, semilla=None):
     """Función principal para generar toda la red"""
     print("🚰 Generando red completa de distribución de agua para Arequipa...")
     
+    # Semilla opcional para generar redes reproducibles
+    if semilla is not None:
+        random.seed(semilla)
+    
     # Cargar nodos existentes
     try:
         nodos_existentes = pd.read_csv('data/nodos.csv').to_dict('records')
@@ -168,15 +210,15 @@ def main():
         print("✓ No hay nodos existentes, empezando desde cero")
     
     # Generar nuevos nodos de distribución
-    print("📍 Generando 100 nodos de distribución...")
-    nodos_nuevos = generar_nodos_distribucion(100)
+    print(f"📍 Generando {num_nodos} nodos de distribución...")
+    nodos_nuevos = generar_nodos_distribucion(num_nodos)
     
     # Combinar todos los nodos
     todos_nodos = nodos_existentes + nodos_nuevos
     
     # Generar puntos críticos como obstáculos
-    print("⚠️ Generando 15 puntos críticos (obstáculos)...")
-    puntos_criticos = generar_puntos_criticos_obstaculos(15)
+    print(f"⚠️ Generando {num_puntos} puntos críticos (obstáculos)...")
+    puntos_criticos = generar_puntos_criticos_obstaculos(num_puntos)
     
     # Generar aristas conectando toda la red
     print("🔗 Generando conexiones de la red...")
@@ -208,4 +250,9 @@ def main():
     print(f"   • ~{len([n for n in todos_nodos if n['estado'] == 'obstaculo'])} nodos obstáculo")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Genera la red completa de distribución de Arequipa")
+    parser.add_argument("--nodos", type=int, default=100, help="nodos de distribución a generar")
+    parser.add_argument("--puntos", type=int, default=15, help="puntos críticos a generar")
+    parser.add_argument("--semilla", type=int, default=None, help="semilla aleatoria")
+    args = parser.parse_args()
+    main(args.nodos, args.puntos, args.semilla)
\ No newline at end of file
@@ -1,8 +1,27 @@
+import numpy as np
 import pandas as pd
 import networkx as nx
-from geopy.distance import geodesic
+import csv
+import hashlib
+import io
 import logging
 import os
+import heapq
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialised within the process
+    fcntl = None
+from flujo_maximo import RedFlujo, SUPERFUENTE
+from distancias import distancia_km, cerca_de_puntos
+from grafo_csr import GrafoCSR
+from instantanea import cargar_instantanea, guardar_instantanea
+from instrumentacion import etapa, medicion_actual
+from registro import Muestreo, Ruta
+from simplificacion import VistasRed
 
 def cargar_datos():
     """Load water infrastructure data from CSV files."""
@@ -29,152 +48,1388 @@ def cargar_datos():
         logging.error(f"Error loading data: {e}")
         raise
 
+# Pipes with an end closer than this to a critical point are taken out of service
+# (RADIO_PUNTO_CRITICO_KM, e.g. 0.5); 0, the default, disables the rule and only
+# the critical point itself blocks the flow
+RADIO_PUNTO_CRITICO_KM = float(os.environ.get("RADIO_PUNTO_CRITICO_KM", "0"))
+
+def _cerca_punto_critico(latitudes, longitudes, puntos_lat, puntos_lon):
+    """Mask of the coordinates within RADIO_PUNTO_CRITICO_KM of a critical point (none when the rule is off)."""
+    if RADIO_PUNTO_CRITICO_KM <= 0:
+        return np.zeros(len(latitudes), dtype=bool)
+    return cerca_de_puntos(latitudes, longitudes, puntos_lat, puntos_lon, RADIO_PUNTO_CRITICO_KM)
+
+def _atributos_arista(distancia, estado, capacidad):
+    """Edge attributes; only transitable edges are added, so all are drawn blue."""
+    return {'weight': distancia, 'estado': estado, 'color': 'blue',
+            'capacidad': capacidad, 'distancia': distancia}
+
+def _normalizar_columnas(df):
+    """Lowercase column names so old (Nombre) and new (nombre) CSV formats look alike."""
+    return df.rename(columns=str.lower)
+
+def _columna(df, nombre, defecto):
+    """Return a column, or a constant column when the CSV does not provide it."""
+    if nombre in df.columns:
+        return df[nombre]
+    return pd.Series(defecto, index=df.index)
+
+def _nombres(df, prefijo):
+    """Node names from the 'nombre' column, falling back to '<prefijo>_<row>'."""
+    if 'nombre' in df.columns:
+        return df['nombre']
+    return pd.Series([f'{prefijo}_{i}' for i in df.index], index=df.index, dtype=object)
+
 def construir_grafo(embalses, puntos, nodos, aristas):
-    """Construct a directed graph from water infrastructure data."""
+    """Construct a directed graph from water infrastructure data.
+    
+    The columns are normalised once and the graph is bulk-loaded: obstacle and
+    blocked edges, and edges touching a node within RADIO_PUNTO_CRITICO_KM of a
+    critical point when that rule is on, are filtered with vectorized masks and missing distances
+    are computed with the vectorized kernel in distancias.
+    """
     G = nx.DiGraph()
     
+    embalses = _normalizar_columnas(embalses)
+    puntos = _normalizar_columnas(puntos)
+    aristas = _normalizar_columnas(aristas)
+    
     # Add reservoir nodes
-    for _, e in embalses.iterrows():
-        # Handle both old and new column formats
-        nombre = e.get('Nombre', e.get('nombre', f'Embalse_{_}'))
-        latitud = e.get('Latitud', e.get('latitud', 0))
-        longitud = e.get('Longitud', e.get('longitud', 0))
-        capacidad = e.get('Volumen_Almacenado_m3', e.get('volumen_almacenado_m3', 1000000))
-        
-        G.add_node(
-            nombre, 
-            pos=(latitud, longitud), 
-            tipo='embalse', 
-            capacidad=capacidad,
-            estado='transitable'
+    nombres_embalses = _nombres(embalses, 'Embalse')
+    G.add_nodes_from(
+        (nombre, {'pos': (lat, lon), 'tipo': 'embalse', 'capacidad': cap, 'estado': 'transitable'})
+        for nombre, lat, lon, cap in zip(
+            nombres_embalses.tolist(),
+            _columna(embalses, 'latitud', 0).tolist(),
+            _columna(embalses, 'longitud', 0).tolist(),
+            _columna(embalses, 'volumen_almacenado_m3', 1000000).tolist(),
         )
-        logging.debug(f"Added reservoir: {nombre}")
+    )
     
     # Add critical point nodes as obstacles (water cannot pass through)
-    for _, p in puntos.iterrows():
-        # Handle both old and new column formats
-        nombre = p.get('Nombre', p.get('nombre', f'PC_{_}'))
-        latitud = p.get('Latitud', p.get('latitud', 0))
-        longitud = p.get('Longitud', p.get('longitud', 0))
-        tipo = p.get('Tipo', p.get('tipo', 'critico'))
-        
-        G.add_node(
-            nombre, 
-            pos=(latitud, longitud), 
-            tipo='punto_critico',
-            subtipo=tipo,
-            estado='obstaculo'  # Critical points are obstacles
+    nombres_puntos = _nombres(puntos, 'PC')
+    G.add_nodes_from(
+        (nombre, {'pos': (lat, lon), 'tipo': 'punto_critico', 'subtipo': subtipo, 'estado': 'obstaculo'})
+        for nombre, lat, lon, subtipo in zip(
+            nombres_puntos.tolist(),
+            _columna(puntos, 'latitud', 0).tolist(),
+            _columna(puntos, 'longitud', 0).tolist(),
+            _columna(puntos, 'tipo', 'critico').tolist(),
         )
-        logging.debug(f"Added critical point: {nombre}")
+    )
     
     # Add infrastructure nodes
-    for _, n in nodos.iterrows():
-        G.add_node(
-            n['id_nodo'], 
-            pos=(n['latitud'], n['longitud']), 
-            tipo=n['tipo'], 
-            estado=n['estado']
+    G.add_nodes_from(
+        (nombre, {'pos': (lat, lon), 'tipo': tipo, 'estado': estado})
+        for nombre, lat, lon, tipo, estado in zip(
+            nodos['id_nodo'].tolist(),
+            nodos['latitud'].tolist(),
+            nodos['longitud'].tolist(),
+            nodos['tipo'].tolist(),
+            nodos['estado'].tolist(),
         )
-        logging.debug(f"Added node: {n['id_nodo']}")
-    
-    # Add edges with calculated distances
-    edges_added = 0
-    for _, a in aristas.iterrows():
-        if a['origen'] in G.nodes and a['destino'] in G.nodes:
-            # Check if either node is an obstacle - if so, NO connection is allowed
-            origen_estado = G.nodes[a['origen']].get('estado', 'transitable')
-            destino_estado = G.nodes[a['destino']].get('estado', 'transitable')
-            
-            # Skip edge if either node is an obstacle or blocked
-            if (origen_estado == 'obstaculo' or destino_estado == 'obstaculo' or 
-                a['estado'] == 'bloqueado'):
-                logging.debug(f"Skipping edge {a['origen']} -> {a['destino']} (obstacle/blocked)")
-                continue
-            
-            pos1 = G.nodes[a['origen']]['pos']
-            pos2 = G.nodes[a['destino']]['pos']
-            
-            # Calculate distance if not provided
-            if 'distancia' in a and pd.notna(a['distancia']) and a['distancia'] > 0:
-                dist = float(a['distancia'])
-            else:
-                dist = geodesic(pos1, pos2).kilometers
-            
-            # Only transitable edges get capacity - obstacles get 0
-            color = 'blue'  # All added edges are transitable
-            capacidad = float(a.get('capacidad', 1000))  # L/h capacity
-            
-            G.add_edge(
-                a['origen'], 
-                a['destino'], 
-                weight=dist, 
-                estado=a['estado'], 
-                color=color,
-                capacidad=capacidad,
-                distancia=dist
-            )
-            edges_added += 1
-            logging.debug(f"Added edge: {a['origen']} -> {a['destino']} (distance: {dist:.2f}km)")
-    
-    logging.info(f"Graph constructed with {len(G.nodes)} nodes and {edges_added} edges")
+    )
+    
+    tabla = _tabla_nodos(embalses, puntos, nodos)
+    conocidas = _aristas_conocidas(aristas, tabla)
+    total_aristas = conocidas.attrs['total']
+    aristas = conocidas[conocidas['valida']]
+    
+    # Only transitable edges get capacity (L/h)
+    G.add_edges_from(
+        (u, v, _atributos_arista(dist, estado, cap))
+        for u, v, dist, estado, cap in zip(
+            aristas['origen'].tolist(), aristas['destino'].tolist(), aristas['distancia'].tolist(),
+            aristas['estado'].tolist(), aristas['capacidad'].tolist(),
+        )
+    )
+    edges_added = len(aristas)
+    
+    logging.info(f"Graph constructed with {len(G.nodes)} nodes and {edges_added} edges "
+                 f"({total_aristas - edges_added} edges skipped)")
+    return G
+
+def _tabla_nodos(embalses, puntos, nodos):
+    """Node table indexed by name with position, type, state, reservoir volume, critical-point subtype and proximity.
+    
+    ``embalses`` and ``puntos`` must have normalised column names. Nodes keep
+    the order of their first definition and the attributes of the last one,
+    as with repeated add_node calls.
+    """
+    nombres_embalses = _nombres(embalses, 'Embalse')
+    nombres_puntos = _nombres(puntos, 'PC')
+    tabla = pd.DataFrame({
+        'nombre': pd.concat([nombres_embalses, nombres_puntos, nodos['id_nodo']], ignore_index=True),
+        'latitud': pd.concat([_columna(embalses, 'latitud', 0), _columna(puntos, 'latitud', 0),
+                              nodos['latitud']], ignore_index=True),
+        'longitud': pd.concat([_columna(embalses, 'longitud', 0), _columna(puntos, 'longitud', 0),
+                               nodos['longitud']], ignore_index=True),
+        'tipo': pd.concat([pd.Series('embalse', index=embalses.index, dtype=object),
+                           pd.Series('punto_critico', index=puntos.index, dtype=object),
+                           nodos['tipo']], ignore_index=True),
+        'estado': pd.concat([pd.Series('transitable', index=embalses.index, dtype=object),
+                             pd.Series('obstaculo', index=puntos.index, dtype=object),
+                             nodos['estado']], ignore_index=True),
+        'capacidad': pd.concat([_columna(embalses, 'volumen_almacenado_m3', 1000000),
+                                pd.Series(0, index=puntos.index), pd.Series(0, index=nodos.index)],
+                               ignore_index=True),
+        'subtipo': pd.concat([pd.Series('', index=embalses.index, dtype=object),
+                              _columna(puntos, 'tipo', 'critico').astype(object),
+                              pd.Series('', index=nodos.index, dtype=object)], ignore_index=True),
+    })
+    orden = pd.unique(tabla['nombre'])
+    tabla = tabla.drop_duplicates('nombre', keep='last').set_index('nombre').loc[orden]
+    tabla['cerca_punto_critico'] = _cerca_punto_critico(
+        tabla['latitud'], tabla['longitud'],
+        _columna(puntos, 'latitud', 0).tolist(), _columna(puntos, 'longitud', 0).tolist()
+    )
+    return tabla
+
+def _aristas_conocidas(aristas, tabla):
+    """Edges between known nodes with their distance filled in and a ``valida`` flag.
+    
+    ``aristas`` must have normalised column names. An edge is not valid when
+    either node is an obstacle or lies next to a critical point, or when the
+    edge is blocked. The frame's ``attrs['total']`` holds the input edge count.
+    """
+    origen = aristas['origen']
+    destino = aristas['destino']
+    conocidas = origen.isin(tabla.index) & destino.isin(tabla.index)
+    aristas = aristas[conocidas]
+    origen = origen[conocidas]
+    destino = destino[conocidas]
+    
+    # Skip edges if either node is an obstacle or lies next to a critical point, or if blocked
+    estado = _columna(aristas, 'estado', 'transitable')
+    valida = ((origen.map(tabla['estado']) != 'obstaculo') & (destino.map(tabla['estado']) != 'obstaculo')
+              & ~origen.map(tabla['cerca_punto_critico']).astype(bool)
+              & ~destino.map(tabla['cerca_punto_critico']).astype(bool)
+              & (estado != 'bloqueado'))
+    
+    # Calculate distance where it is not provided
+    distancia = pd.to_numeric(_columna(aristas, 'distancia', np.nan), errors='coerce').to_numpy(dtype=float, copy=True)
+    faltantes = ~(distancia > 0)
+    if faltantes.any():
+        distancia[faltantes] = distancia_km(
+            origen[faltantes].map(tabla['latitud']).to_numpy(dtype=float),
+            origen[faltantes].map(tabla['longitud']).to_numpy(dtype=float),
+            destino[faltantes].map(tabla['latitud']).to_numpy(dtype=float),
+            destino[faltantes].map(tabla['longitud']).to_numpy(dtype=float),
+        )
+    
+    resultado = pd.DataFrame({
+        'origen': origen.to_numpy(),
+        'destino': destino.to_numpy(),
+        'distancia': distancia,
+        'estado': estado.to_numpy(),
+        'capacidad': _columna(aristas, 'capacidad', 1000).astype(float).to_numpy(),
+        'valida': valida.to_numpy(dtype=bool),
+    })
+    resultado.attrs['total'] = int(len(conocidas))
+    return resultado
+
+def construir_grafo_csr(embalses, puntos, nodos, aristas):
+    """Build the compact routing graph (GrafoCSR) straight from the data tables.
+    
+    Unlike construir_grafo, obstacle, blocked and critical-point edges are
+    kept and switched off with masks, so state changes never copy the graph.
+    A repeated (origen, destino) pair keeps its last valid definition, as in
+    the DiGraph.
+    """
+    return construir_grafo_csr_y_atributos(embalses, puntos, nodos, aristas)[0]
+
+def construir_grafo_csr_y_atributos(embalses, puntos, nodos, aristas):
+    """construir_grafo_csr plus the attributes only the DiGraph needs.
+    
+    The attributes are arrays aligned with the graph: ``estado`` and
+    ``subtipo`` by node id, ``estado_arista`` and ``distancia`` (float64,
+    unlike the float32 ``peso``) by edge id. They are what
+    construir_grafo_desde_csr and topologia_columnar read besides the graph.
+    """
+    embalses = _normalizar_columnas(embalses)
+    puntos = _normalizar_columnas(puntos)
+    aristas = _normalizar_columnas(aristas)
+    
+    tabla = _tabla_nodos(embalses, puntos, nodos)
+    conocidas = _aristas_conocidas(aristas, tabla)
+    
+    # One edge per pair: the last valid row, or the last row when none is valid
+    validas = conocidas[conocidas['valida']].drop_duplicates(['origen', 'destino'], keep='last')
+    pares_validos = pd.MultiIndex.from_frame(validas[['origen', 'destino']])
+    invalidas = conocidas[~conocidas['valida']]
+    invalidas = invalidas[~pd.MultiIndex.from_frame(invalidas[['origen', 'destino']]).isin(pares_validos)]
+    aristas = pd.concat([validas, invalidas.drop_duplicates(['origen', 'destino'], keep='last')])
+    
+    posicion = pd.Series(np.arange(len(tabla)), index=tabla.index)
+    origen = aristas['origen'].map(posicion).to_numpy()
+    inhabilitado = (tabla['estado'] == 'obstaculo').to_numpy()
+    grafo = GrafoCSR(
+        tabla.index.tolist(),
+        tabla['latitud'].to_numpy(dtype=float),
+        tabla['longitud'].to_numpy(dtype=float),
+        tabla['tipo'].to_numpy(),
+        inhabilitado | (tabla['tipo'] == 'punto_critico').to_numpy(),
+        tabla['capacidad'].to_numpy(dtype=float),
+        origen,
+        aristas['destino'].map(posicion).to_numpy(),
+        aristas['distancia'].to_numpy(),
+        aristas['capacidad'].to_numpy(),
+        (aristas['estado'] == 'bloqueado').to_numpy(),
+        aislado=tabla['cerca_punto_critico'].to_numpy(dtype=bool)
+    )
+    logging.info(f"Compact graph built with {grafo.numero_nodos} nodes and {grafo.numero_aristas} edges "
+                 f"({int(grafo.activa.sum())} active, "
+                 f"{grafo.memoria_bytes(incluir_nombres=False) / 1e6:.1f} MB of arrays)")
+    
+    # GrafoCSR sorts the edges by origin with a stable sort; apply the same order
+    orden = np.argsort(origen.astype(np.int32), kind='stable')
+    atributos = {
+        'estado': tabla['estado'].to_numpy(dtype=object),
+        'subtipo': tabla['subtipo'].to_numpy(dtype=object),
+        'estado_arista': aristas['estado'].to_numpy(dtype=object)[orden],
+        'distancia': aristas['distancia'].to_numpy(dtype=float)[orden],
+    }
+    return grafo, atributos
+
+def construir_grafo_desde_csr(grafo, atributos):
+    """Build the DiGraph of construir_grafo from a compact graph and its DiGraph attributes.
+    
+    Used with a binary snapshot, so the DiGraph can be built without parsing
+    the CSV files. Only the active edges are added, as construir_grafo does.
+    """
+    G = nx.DiGraph()
+    capacidad_nodo = grafo.capacidad_nodo.tolist()
+    estados = atributos['estado']
+    subtipos = atributos['subtipo']
+    nodos = []
+    for i, (nombre, lat, lon) in enumerate(zip(grafo.nombres, grafo.latitud.tolist(), grafo.longitud.tolist())):
+        tipo = grafo.tipo(i)
+        datos = {'pos': (lat, lon), 'tipo': tipo, 'estado': estados[i]}
+        if tipo == 'embalse':
+            datos['capacidad'] = capacidad_nodo[i]
+        elif tipo == 'punto_critico':
+            datos['subtipo'] = subtipos[i]
+        nodos.append((nombre, datos))
+    G.add_nodes_from(nodos)
+    
+    activas = np.flatnonzero(grafo.activa)
+    nombres = grafo.nombres
+    G.add_edges_from(
+        (nombres[u], nombres[v], _atributos_arista(dist, estado, cap))
+        for u, v, dist, estado, cap in zip(
+            grafo.origen[activas].tolist(), grafo.indices[activas].tolist(),
+            atributos['distancia'][activas].tolist(), atributos['estado_arista'][activas].tolist(),
+            grafo.capacidad[activas].tolist(),
+        )
+    )
+    logging.info(f"Graph rebuilt from the compact graph with {len(G.nodes)} nodes and {len(activas)} edges")
     return G
 
-def calcular_rutas_y_flujos(G, fuente):
-    """Calculate optimal routes and maximum flows from source to distribution nodes."""
+def destinos_distribucion(G):
+    """List the distribution nodes that can receive water (no obstacles, critical points or reservoirs)."""
+    return [n for n, d in G.nodes(data=True)
+            if d.get("tipo") not in ["punto_critico", "embalse"]
+            and d.get("estado") != "obstaculo"]
+
+def grafo_transitable(G):
+    """Read-only view of the graph without obstacle nodes and blocked edges.
+    
+    The view is filtered lazily instead of copying the graph, so it always
+    reflects the current state of G.
+    """
+    def nodo_transitable(n):
+        datos = G.nodes[n]
+        return datos.get("estado") != "obstaculo" and datos.get("tipo") != "punto_critico"
+    
+    def arista_transitable(u, v):
+        return G[u][v].get('estado') != 'bloqueado'
+    
+    return nx.subgraph_view(G, filter_node=nodo_transitable, filter_edge=arista_transitable)
+
+def _como_grafo_csr(grafo):
+    """Accept either a GrafoCSR or a NetworkX graph (converted once)."""
+    return grafo if isinstance(grafo, GrafoCSR) else GrafoCSR.desde_networkx(grafo)
+
+def _capacidades_embalses(grafo, embalses):
+    """Stored volume of each reservoir present in the graph, used as super-source capacity."""
+    return {e: float(grafo.capacidad_nodo[grafo.indice[e]]) for e in embalses if grafo.transitable(e)}
+
+class ArbolRutas:
+    """Shortest-path tree from one or several sources, repairable after edge changes.
+    
+    It is built with a single Dijkstra pass over a GrafoCSR (a NetworkX graph
+    is converted first), reading only its active edges. When edges are taken
+    out of service only the subtree hanging from them is recomputed, and when
+    edges are added only the nodes whose distance improves are relaxed
+    (dynamic shortest-path repair). With several sources each node hangs from
+    its nearest one, as if a virtual super-source were joined to all of them
+    at zero cost.
+    """
+    
+    def __init__(self, grafo, fuente):
+        if not isinstance(grafo, GrafoCSR):
+            grafo = GrafoCSR.desde_networkx(grafo)
+        self.grafo = grafo
+        self.fuente = fuente
+        self.fuentes = list(fuente) if isinstance(fuente, (list, tuple)) else [fuente]
+        self.distancia_nodo = np.full(grafo.numero_nodos, np.inf)
+        self.padre = np.full(grafo.numero_nodos, -1, dtype=np.int64)
+        
+        heap = [(0.0, grafo.indice[f], -1) for f in self.fuentes if grafo.transitable(f)]
+        heapq.heapify(heap)
+        self._propagar(heap)
+    
+    def _ajustar_tamano(self):
+        """Grow the per-node arrays after nodes were appended to the graph."""
+        faltan = self.grafo.numero_nodos - len(self.padre)
+        if faltan > 0:
+            self.distancia_nodo = np.append(self.distancia_nodo, np.full(faltan, np.inf))
+            self.padre = np.append(self.padre, np.full(faltan, -1, dtype=np.int64))
+    
+    def copia(self):
+        """Snapshot of the tree that later repairs of this one do not change.
+        
+        The graph is shared: node names and ids are only ever appended, so
+        routes read from the copy stay valid.
+        """
+        copia = ArbolRutas.__new__(ArbolRutas)
+        copia.grafo = self.grafo
+        copia.fuente = self.fuente
+        copia.fuentes = self.fuentes
+        copia.distancia_nodo = self.distancia_nodo.copy()
+        copia.padre = self.padre.copy()
+        return copia
+    
+    def distancia(self, destino):
+        """Route length in km to destino, or None when unreachable."""
+        i = self.grafo.indice.get(destino)
+        if i is None or i >= len(self.padre) or not np.isfinite(self.distancia_nodo[i]):
+            return None
+        return float(self.distancia_nodo[i])
+    
+    def ruta(self, destino):
+        """Route from the source to destino, or None when unreachable."""
+        if self.distancia(destino) is None:
+            return None
+        i = self.grafo.indice[destino]
+        ruta = [i]
+        while self.padre[ruta[-1]] >= 0:
+            ruta.append(int(self.padre[ruta[-1]]))
+        nombres = self.grafo.nombres
+        return [nombres[j] for j in reversed(ruta)]
+    
+    def _propagar(self, heap):
+        """Dijkstra from a heap of tentative (distance, node, parent) improvements."""
+        g = self.grafo
+        # memoryviews give fast scalar access without copying the arrays into lists
+        indptr, indices, peso, activa = (memoryview(a) for a in (g.indptr, g.indices, g.peso, g.activa))
+        distancia, padre = memoryview(self.distancia_nodo), memoryview(self.padre)
+        actualizados = 0
+        while heap:
+            d, u, p = heapq.heappop(heap)
+            if d >= distancia[u]:
+                continue
+            distancia[u] = d
+            padre[u] = p
+            actualizados += 1
+            for a in range(indptr[u], indptr[u + 1]):
+                if activa[a]:
+                    v = indices[a]
+                    nueva = d + peso[a]
+                    if nueva < distancia[v]:
+                        heapq.heappush(heap, (nueva, v, u))
+        return actualizados
+    
+    def eliminar_aristas(self, aristas):
+        """Repair the tree after the edge ids ``aristas`` were taken out of service.
+        
+        Returns the number of nodes whose route had to be recomputed.
+        """
+        self._ajustar_tamano()
+        g = self.grafo
+        aristas = np.asarray(aristas, dtype=np.int64)
+        destinos = g.indices[aristas]
+        raices = np.unique(destinos[self.padre[destinos] == g.origen[aristas]])
+        if len(raices) == 0:
+            return 0
+        
+        # Collect the affected subtree using a children index built from the parent array
+        alcanzados = np.flatnonzero(self.padre >= 0)
+        hijos_orden = alcanzados[np.argsort(self.padre[alcanzados], kind='stable')]
+        inicio_hijos = np.searchsorted(self.padre[hijos_orden], np.arange(g.numero_nodos + 1))
+        subarbol = []
+        pila = raices.tolist()
+        while pila:
+            nodo = pila.pop()
+            subarbol.append(nodo)
+            pila.extend(hijos_orden[inicio_hijos[nodo]:inicio_hijos[nodo + 1]].tolist())
+        
+        # Detach the affected subtree; its distances can only grow
+        subarbol = np.asarray(subarbol, dtype=np.int64)
+        self.distancia_nodo[subarbol] = np.inf
+        self.padre[subarbol] = -1
+        
+        # Reconnect it from the best unaffected in-neighbours
+        heap = []
+        for nodo in subarbol.tolist():
+            entrantes = g.aristas_inv[g.indptr_inv[nodo]:g.indptr_inv[nodo + 1]]
+            entrantes = entrantes[g.activa[entrantes]]
+            vecinos = g.origen[entrantes]
+            candidatas = self.distancia_nodo[vecinos] + g.peso[entrantes]
+            for d, vecino in zip(candidatas.tolist(), vecinos.tolist()):
+                if d != np.inf:
+                    heap.append((d, nodo, vecino))
+        heapq.heapify(heap)
+        self._propagar(heap)
+        return len(subarbol)
+    
+    def insertar_aristas(self, aristas):
+        """Update the tree after the edge ids ``aristas`` were added to the graph.
+        
+        Returns the number of nodes whose route improved.
+        """
+        self._ajustar_tamano()
+        g = self.grafo
+        heap = []
+        for a in aristas:
+            u = g.origen[a]
+            if g.activa[a] and np.isfinite(self.distancia_nodo[u]):
+                heap.append((float(self.distancia_nodo[u] + g.peso[a]), int(g.indices[a]), int(u)))
+        heapq.heapify(heap)
+        return self._propagar(heap)
+
+def calcular_rutas(grafo, fuente, destinos, arbol=None):
+    """Calculate shortest routes to all destinations with a single Dijkstra pass from the source.
+    
+    ``grafo`` is a GrafoCSR or a NetworkX graph. ``fuente`` may also be a
+    list of reservoirs; each route then starts at the nearest one. A cached
+    ``arbol`` (ArbolRutas) for the same source can be passed to skip the
+    Dijkstra pass. Returns the routes (None when unreachable) and the route
+    lengths in km.
+    
+    Unreachable destinations are reported in one warning at the end; the
+    individual routes and misses are only logged at DEBUG, and sampled (see
+    registro.Muestreo).
+    """
     rutas = {}
-    flujos = {}
+    distancias = {}
     
-    # Find all distribution nodes as destinations (exclude obstacles and critical points)
-    destinos = [n for n, d in G.nodes(data=True) 
-               if d.get("tipo") not in ["punto_critico", "embalse"] 
-               and d.get("estado") != "obstaculo"]
+    grafo = arbol.grafo if arbol is not None else _como_grafo_csr(grafo)
+    fuentes = fuente if isinstance(fuente, (list, tuple)) else [fuente]
+    if not any(grafo.transitable(f) for f in fuentes):
+        logging.warning("Source %s is not part of the transitable network", fuente)
+        return {destino: None for destino in destinos}, distancias
+    
+    # One pass gives the shortest-path tree and the distance to every reachable node
+    if arbol is None:
+        arbol = ArbolRutas(grafo, fuente)
+    
+    detalle = Muestreo()
+    sin_ruta = Muestreo()
+    for destino in destinos:
+        ruta = arbol.ruta(destino)
+        rutas[destino] = ruta
+        if ruta is not None:
+            distancias[destino] = arbol.distancia(destino)
+            detalle.registrar("Route to %s: %s", destino, Ruta(ruta))
+        else:
+            sin_ruta.registrar("No path found to %s from %s", destino, fuente)
+    
+    _resumir_rutas(fuente, len(destinos), sin_ruta)
+    return rutas, distancias
+
+def _resumir_rutas(fuente, total, sin_ruta):
+    """Log a route calculation summary: one warning for all unreachable destinations."""
+    if sin_ruta.total:
+        logging.warning("No path found from %s to %d of %d destinations (%s)",
+                        fuente, sin_ruta.total, total, sin_ruta.texto_ejemplos())
+    logging.debug("Routes from %s: %d of %d destinations reachable", fuente, total - sin_ruta.total, total)
+
+def _red_flujo_para(grafo, fuente):
+    """Build the max-flow engine for a reservoir or, with a super-source, a list of reservoirs."""
+    if isinstance(fuente, (list, tuple)):
+        return RedFlujo(grafo, capacity='capacidad', fuentes=_capacidades_embalses(grafo, fuente))
+    return RedFlujo(grafo, capacity='capacidad')
+
+def calcular_flujos(grafo, fuente, destinos, red=None):
+    """Calculate maximum flows (L/h) from the source to each destination.
+    
+    The capacity network is built once (or taken from ``red``) and reused for
+    every destination instead of running a full max-flow from scratch each time.
+    When ``fuente`` is a list of reservoirs the flows are the total deliverable
+    from all of them, through a virtual super-source whose arcs to each
+    reservoir carry its stored volume.
+    """
+    if red is None:
+        red = _red_flujo_para(_como_grafo_csr(grafo), fuente)
+    
+    try:
+        flujos = red.flujos_desde(SUPERFUENTE if isinstance(fuente, (list, tuple)) else fuente, destinos)
+    except Exception as e:
+        logging.error("Error calculating flows from %s: %s", fuente, e)
+        return {destino: 0 for destino in destinos}
+    
+    logging.debug("Max flows from %s to %d destinations", fuente, len(flujos))
+    return flujos
+
+def iterar_rutas_y_flujos(G, fuente, limite=None, grafo=None, red_flujo=None, arbol=None, destinos=None):
+    """Yield ``(destino, ruta, flujo)`` for each distribution node as soon as it is computed.
+    
+    Takes the same arguments as calcular_rutas_y_flujos; the shortest-path tree
+    is built in one pass up front, then each route is rebuilt and its flow
+    computed lazily, so callers can stream results without holding them all.
+    """
+    # Compact graph with obstacle and blocked masks for pathfinding (no copy of G)
+    if grafo is None:
+        grafo = arbol.grafo if arbol is not None else GrafoCSR.desde_networkx(G)
+    
+    # Distribution nodes as destinations (obstacles, critical points and reservoirs excluded),
+    # taken from the graph's precomputed index
+    if destinos is None:
+        destinos = grafo.destinos(limite)
     
     if not destinos:
         logging.warning("No accessible distribution nodes found for route calculation")
-        return rutas, flujos
+        return
     
-    # Limit to first 10 destinations for performance
-    destinos = destinos[:10]
-    logging.info(f"Calculating routes from {fuente} to {len(destinos)} distribution nodes")
+    logging.info("Calculating routes from %s to %d distribution nodes", fuente, len(destinos))
     
-    # Create a graph excluding obstacles for pathfinding
-    G_transitable = G.copy()
+    if arbol is None:
+        with etapa('dijkstra'):
+            arbol = ArbolRutas(grafo, fuente)
+    if red_flujo is None:
+        with etapa('construir_red_flujo'):
+            red_flujo = _red_flujo_para(grafo, fuente)
     
-    # Remove obstacle nodes and their edges
-    nodos_obstaculo = [n for n, d in G_transitable.nodes(data=True) 
-                      if d.get("estado") == "obstaculo" or d.get("tipo") == "punto_critico"]
-    G_transitable.remove_nodes_from(nodos_obstaculo)
-    
-    # Remove blocked edges
-    edges_to_remove = [(u, v) for u, v, d in G_transitable.edges(data=True) 
-                      if d.get('estado') == 'bloqueado']
-    G_transitable.remove_edges_from(edges_to_remove)
+    # Only reachable destinations need a max-flow computation
+    alcanzables = [d for d in destinos if arbol.distancia(d) is not None]
+    fuente_flujo = SUPERFUENTE if isinstance(fuente, (list, tuple)) else fuente
+    flujos = red_flujo.iterar_flujos_desde(fuente_flujo, alcanzables)
     
+    medicion = medicion_actual()
+    medicion.contar('destinos', len(destinos))
+    medicion.contar('destinos_alcanzables', len(alcanzables))
+    detalle = Muestreo()
+    sin_ruta = Muestreo()
     for destino in destinos:
-        # Calculate shortest path avoiding obstacles
-        try:
-            if nx.has_path(G_transitable, fuente, destino):
-                ruta = nx.dijkstra_path(G_transitable, fuente, destino, weight='weight')
-                rutas[destino] = ruta
-                logging.debug(f"Route to {destino}: {' -> '.join(ruta)}")
-            else:
-                rutas[destino] = None
-                logging.warning(f"No path found from {fuente} to {destino}")
-        except Exception as e:
-            logging.error(f"Error calculating route to {destino}: {e}")
+        # Timed by hand: a context manager per destination would cost as much as rebuilding a short route
+        inicio = time.perf_counter()
+        ruta = arbol.ruta(destino)
+        medicion.sumar('rutas', time.perf_counter() - inicio)
+        if ruta is None:
+            sin_ruta.registrar("No path found to %s from %s", destino, fuente)
+            yield destino, None, 0
+            continue
+        
+        detalle.registrar("Route to %s: %s", destino, Ruta(ruta))
+        inicio = time.perf_counter()
+        # Flows come in the order of ``alcanzables``; an error in the flow engine ends
+        # the run rather than reporting 0 for this and every later destination
+        siguiente = next(flujos, None)
+        if siguiente is None or siguiente[0] != destino:
+            raise RuntimeError(f"Max-flow results from {fuente} out of step at {destino}: got {siguiente}")
+        flujo = siguiente[1]
+        medicion.sumar('flujo_maximo', time.perf_counter() - inicio)
+        medicion.contar('llamadas_flujo_maximo')
+        yield destino, ruta, flujo
+    
+    _resumir_rutas(fuente, len(destinos), sin_ruta)
+
+def calcular_rutas_y_flujos(G, fuente, limite=None, grafo=None, red_flujo=None, arbol=None, destinos=None):
+    """Calculate optimal routes and maximum flows from source to distribution nodes.
+    
+    ``fuente`` is a reservoir name or a list of reservoirs (all-reservoirs
+    mode: best reservoir and route per node, total flow from all of them).
+    ``limite`` optionally caps the number of destinations; by default every
+    distribution node is processed. ``G`` is only needed when no compact
+    ``grafo`` (GrafoCSR) is given. The compact graph, a
+    ``red_flujo`` and a shortest-path ``arbol`` (e.g. from the network cache)
+    can be passed to skip rebuilding them, and ``destinos`` to give the
+    destination names instead of reading them from the graph (see
+    RedCargada.vista_calculo).
+    """
+    rutas = {}
+    flujos = {}
+    for destino, ruta, flujo in iterar_rutas_y_flujos(
+        G, fuente, limite=limite, grafo=grafo, red_flujo=red_flujo, arbol=arbol, destinos=destinos
+    ):
+        rutas[destino] = ruta
+        flujos[destino] = flujo
+    
+    return rutas, flujos
+
+def comprimir_rutas(rutas, flujos, distancias):
+    """Encode routes taken from one shortest-path tree as that tree, for storage.
+    
+    Every node on any route is listed once in ``nodos`` with the position of
+    its predecessor in ``padres`` (-1 where a route starts), so the prefixes
+    the routes share are stored once. ``destinos`` holds the position of each
+    destination, in order, with ``flujos`` and ``distancias`` aligned to it;
+    a destination without a route has ``padres`` -2. The routes must come
+    from a single tree, as calcular_rutas_y_flujos returns them.
+    """
+    posicion = {}
+    nodos = []
+    padres = []
+    destinos = []
+    for destino, ruta in rutas.items():
+        if ruta is None:
+            posicion[destino] = len(nodos)
+            nodos.append(destino)
+            padres.append(-2)
+        else:
+            # The part of the route already stored is a prefix; only the rest is new
+            k = len(ruta) - 1
+            while k >= 0 and ruta[k] not in posicion:
+                k -= 1
+            anterior = posicion[ruta[k]] if k >= 0 else -1
+            for nodo in ruta[k + 1:]:
+                posicion[nodo] = len(nodos)
+                nodos.append(nodo)
+                padres.append(anterior)
+                anterior = posicion[nodo]
+        destinos.append(posicion[destino])
+    return {
+        "nodos": nodos,
+        "padres": padres,
+        "destinos": destinos,
+        "flujos": [flujos.get(destino, 0) for destino in rutas],
+        "distancias": [distancias.get(destino) for destino in rutas],
+    }
+
+def expandir_rutas(compacto, destinos=None):
+    """Decode comprimir_rutas output into ``(rutas, flujos, distancias)`` dicts.
+    
+    With ``destinos`` only the routes to those destinations are rebuilt.
+    """
+    nodos, padres = compacto["nodos"], compacto["padres"]
+    elegidos = zip(compacto["destinos"], compacto["flujos"], compacto["distancias"])
+    if destinos is not None:
+        destinos = set(destinos)
+        elegidos = [e for e in elegidos if nodos[e[0]] in destinos]
+    rutas = {}
+    flujos = {}
+    distancias = {}
+    for i, flujo, distancia in elegidos:
+        destino = nodos[i]
+        flujos[destino] = flujo
+        if padres[i] == -2:
             rutas[destino] = None
+            continue
+        ruta = []
+        while i >= 0:
+            ruta.append(nodos[i])
+            i = padres[i]
+        rutas[destino] = ruta[::-1]
+        distancias[destino] = distancia
+    return rutas, flujos, distancias
+
+def rutas_por_indice(compacto, indice):
+    """comprimir_rutas output with node names replaced by their position in ``indice`` (name -> int)."""
+    return dict(compacto, nodos=[indice[nodo] for nodo in compacto["nodos"]])
+
+class CodificadorRutas:
+    """Delta-encode routes of one shortest-path tree as node positions, one route at a time.
+    
+    ``codificar(ruta)`` returns ``(padre, nuevos)``: the position of the last
+    node already sent in an earlier route (-1 when none was) and the
+    positions of the nodes after it. The client knows the path to ``padre``
+    from earlier routes, so each shared prefix is sent once. An unreachable
+    destination gives ``(None, None)``.
+    """
+    
+    def __init__(self, indice):
+        self.indice = indice
+        self.enviados = set()
+    
+    def codificar(self, ruta):
+        if ruta is None:
+            return None, None
+        k = len(ruta) - 1
+        while k >= 0 and ruta[k] not in self.enviados:
+            k -= 1
+        nuevos = ruta[k + 1:]
+        self.enviados.update(nuevos)
+        return (self.indice[ruta[k]] if k >= 0 else -1), [self.indice[nodo] for nodo in nuevos]
+
+def topologia_columnar(grafo, atributos):
+    """Nodes and active edges of a compact graph as columns for the map, edges referring to nodes by position.
+    
+    ``atributos`` are the DiGraph attributes of construir_grafo_csr_y_atributos,
+    so the columns describe the DiGraph construir_grafo_desde_csr would build,
+    with nodes at their GrafoCSR ids. ``nodos`` has ``id``, ``lat``, ``lng``
+    and the ``tipo``/``estado`` codes (into ``tipos``/``estados``), plus the
+    reservoir ``capacidad`` and the critical point ``subtipo`` keyed by
+    position. ``aristas`` has the ``origen``/``destino`` positions,
+    ``distancia`` (km), ``capacidad`` (L/h) and ``estado`` codes; the
+    constant colour and the weight (equal to the distance) are left out.
+    Coordinates are rounded to 6 decimals (about 0.1 m) and distances to 4.
+    """
+    n = grafo.numero_nodos
+    activas = np.flatnonzero(grafo.activa)
+    codigos_estado, estados = pd.factorize(np.concatenate([
+        np.asarray(atributos['estado'], dtype=object),
+        np.asarray(atributos['estado_arista'], dtype=object)[activas],
+    ]))
+    embalses = np.flatnonzero(grafo.es_tipo('embalse'))
+    puntos = np.flatnonzero(grafo.es_tipo('punto_critico'))
+    subtipos = atributos['subtipo']
+    
+    return {
+        "nodos": {
+            "id": list(grafo.nombres),
+            "lat": np.round(grafo.latitud, 6).tolist(),
+            "lng": np.round(grafo.longitud, 6).tolist(),
+            "tipo": grafo.codigo_tipo.tolist(),
+            "estado": codigos_estado[:n].tolist(),
+            "capacidad": dict(zip(embalses.tolist(), grafo.capacidad_nodo[embalses].tolist())),
+            "subtipo": {i: subtipos[i] for i in puntos.tolist()},
+        },
+        "aristas": {
+            "origen": grafo.origen[activas].tolist(),
+            "destino": grafo.indices[activas].tolist(),
+            "distancia": np.round(np.nan_to_num(np.asarray(atributos['distancia'], dtype=np.float64)[activas]),
+                                  4).tolist(),
+            "capacidad": np.nan_to_num(grafo.capacidad[activas].astype(np.float64)).tolist(),
+            "estado": codigos_estado[n:].tolist(),
+        },
+        "tipos": list(grafo.tipos),
+        "estados": estados.tolist(),
+    }
+
+# ---------------------------------------------------------------------------
+# Process-wide network cache
+# ---------------------------------------------------------------------------
+
+ARCHIVOS_DATOS = [
+    'data/embalses.csv',
+    'data/puntos_criticos.csv',
+    'data/nodos.csv',
+    'data/aristas.csv',
+]
+
+# Compile the binary snapshot (instantanea.py) after parsing the CSV files; INSTANTANEA_RED=0 disables it
+USAR_INSTANTANEA = os.environ.get("INSTANTANEA_RED", "1") != "0"
+
+def _tabla_datos(nombre, ruta):
+    """Property for one of the data tables, read from its source (CSV file or database) on first use."""
+    def leer(self):
+        with self.lock:
+            if self._tablas[nombre] is None:
+                with etapa('cargar_datos'):
+                    if self._fuente is not None:
+                        self._tablas[nombre] = self._fuente.cargar_tabla(nombre)
+                    else:
+                        self._tablas[nombre] = pd.read_csv(ruta)
+            elif self._pendientes[nombre]:
+                # Rows appended by incremental updates are concatenated once, on the next read
+                self._tablas[nombre] = pd.concat([self._tablas[nombre], pd.DataFrame(self._pendientes[nombre])],
+                                                 ignore_index=True)
+                self._pendientes[nombre] = []
+                if nombre == 'aristas':
+                    self._extremos_aristas = None
+            return self._tablas[nombre]
+    
+    def escribir(self, tabla):
+        self._tablas[nombre] = tabla
+        self._pendientes[nombre] = []
+        self.conteos[nombre] = len(tabla)
+        if nombre == 'aristas':
+            self._extremos_aristas = None
+    
+    return property(leer, escribir, doc=f"The {nombre} table (read on first use).")
+
+class RedCargada:
+    """Parsed data files plus the graphs derived from them, built lazily and shared.
+    
+    When loaded from a binary snapshot the compact graph is given already
+    built, with the ``atributos`` needed to rebuild the DiGraph, and the data
+    tables are only read from their source if something asks for them:
+    ``fuente`` (e.g. a FuenteDB) or, when None, the CSV files.
+    
+    ``lock`` must be held while reading the graphs if they may be updated in
+    place (see actualizar_red); it is reentrant so the lazy properties can be
+    used under it.
+    
+    ``conteos`` keeps the row count of each table (taken from the snapshot
+    when the tables are not read) and ``origen``, ``cargada_en`` and
+    ``duracion_carga_ms`` describe the load, for resumen_red().
+    """
+    
+    embalses = _tabla_datos('embalses', 'data/embalses.csv')
+    puntos = _tabla_datos('puntos', 'data/puntos_criticos.csv')
+    nodos = _tabla_datos('nodos', 'data/nodos.csv')
+    aristas = _tabla_datos('aristas', 'data/aristas.csv')
+    
+    def __init__(self, huella, version, embalses=None, puntos=None, nodos=None, aristas=None,
+                 grafo=None, atributos=None, fuente=None, conteos=None):
+        self.huella = huella
+        self.version = version
+        self._fuente = fuente
+        self._tablas = {'embalses': embalses, 'puntos': puntos, 'nodos': nodos, 'aristas': aristas}
+        self.conteos = dict(conteos or {})
+        for nombre, tabla in self._tablas.items():
+            if tabla is not None:
+                self.conteos[nombre] = len(tabla)
+        self.origen = None
+        self.cargada_en = time.time()
+        self.duracion_carga_ms = None
+        self._pendientes = {nombre: [] for nombre in self._tablas}
+        self._extremos_aristas = None
+        self._atributos = atributos
+        self._G = None
+        self._grafo = grafo
+        self._red_flujo = None
+        self._red_flujo_multi = {}
+        self._arboles = {}
+        self._topologia = None
+        self._vistas = None
+        self.lock = threading.RLock()
+    
+    @property
+    def G(self):
+        """The full DiGraph built by construir_grafo (treat as read-only)."""
+        with self.lock:
+            if self._G is None:
+                if self._atributos is not None:
+                    grafo = self.grafo
+                    with etapa('construir_grafo'):
+                        self._G = construir_grafo_desde_csr(grafo, self._atributos)
+                else:
+                    tablas = (self.embalses, self.puntos, self.nodos, self.aristas)
+                    with etapa('construir_grafo'):
+                        self._G = construir_grafo(*tablas)
+            return self._G
+    
+    @property
+    def G_transitable(self):
+        """Zero-copy view of the DiGraph without obstacles and blocked edges."""
+        return grafo_transitable(self.G)
+    
+    @property
+    def grafo(self):
+        """The compact routing graph (GrafoCSR) with obstacle and blocked masks."""
+        with self.lock:
+            if self._grafo is None:
+                tablas = (self.embalses, self.puntos, self.nodos, self.aristas)
+                with etapa('construir_grafo_csr'):
+                    self._grafo, self._atributos = construir_grafo_csr_y_atributos(*tablas)
+            return self._grafo
+    
+    def guardar_instantanea(self):
+        """Compile the network from the data tables and write it as the binary snapshot."""
+        with self.lock:
+            with etapa('construir_grafo_csr'):
+                grafo, atributos = construir_grafo_csr_y_atributos(self.embalses, self.puntos,
+                                                                    self.nodos, self.aristas)
+            if self._grafo is None:
+                self._grafo, self._atributos = grafo, atributos
+            with etapa('guardar_instantanea'):
+                guardar_instantanea(self.version, self.huella, grafo, atributos, self.conteos)
+    
+    def _anexar_filas(self, nombre, filas):
+        """Append rows to a data table already in memory (concatenated on its next read).
+        
+        A table not read yet is left alone: it will be read from its source,
+        which already holds the change.
+        """
+        if self._tablas[nombre] is not None:
+            self._pendientes[nombre].extend(filas)
+        self.conteos[nombre] = self.conteos.get(nombre, 0) + len(filas)
+    
+    def _anexar_atributos_nodos(self, estados, subtipos):
+        """Extend the DiGraph attributes with nodes just appended to the compact graph."""
+        self._atributos = dict(
+            self._atributos,
+            estado=np.concatenate([self._atributos['estado'], np.array(estados, dtype=object)]),
+            subtipo=np.concatenate([self._atributos['subtipo'], np.array(subtipos, dtype=object)]),
+        )
+    
+    def _insertar_atributos_aristas(self, ids, estados, distancias):
+        """Extend the DiGraph attributes with edges just added to the compact graph at ids.
+        
+        GrafoCSR.agregar_aristas keeps the existing edges in their relative
+        order, so their attributes fill the other positions in order.
+        """
+        previas = np.ones(self._grafo.numero_aristas, dtype=bool)
+        previas[ids] = False
+        atributos = dict(self._atributos)
+        for clave, valores, tipo in (('estado_arista', estados, object), ('distancia', distancias, float)):
+            columna = np.empty(len(previas), dtype=tipo)
+            columna[previas] = self._atributos[clave]
+            columna[ids] = np.array(valores, dtype=tipo)
+            atributos[clave] = columna
+        self._atributos = atributos
+    
+    @property
+    def red_flujo(self):
+        """Max-flow engine over the active edges of the compact graph."""
+        with self.lock:
+            if self._red_flujo is None:
+                grafo = self.grafo
+                with etapa('construir_red_flujo'):
+                    self._red_flujo = RedFlujo(grafo, capacity='capacidad')
+            return self._red_flujo
+    
+    def red_flujo_multifuente(self, fuentes):
+        """Max-flow engine with a super-source feeding every reservoir in fuentes."""
+        clave = tuple(fuentes)
+        with self.lock:
+            if clave not in self._red_flujo_multi:
+                grafo = self.grafo
+                with etapa('construir_red_flujo'):
+                    self._red_flujo_multi[clave] = RedFlujo(
+                        grafo, capacity='capacidad',
+                        fuentes=_capacidades_embalses(grafo, fuentes)
+                    )
+            return self._red_flujo_multi[clave]
+    
+    def red_flujo_para(self, fuente):
+        """Max-flow engine for a reservoir name or a list of reservoirs."""
+        if isinstance(fuente, (list, tuple)):
+            return self.red_flujo_multifuente(fuente)
+        return self.red_flujo
+    
+    def arbol_rutas(self, fuente):
+        """Shortest-path tree from fuente (a node or a list of reservoirs), kept up to date by incremental updates."""
+        clave = tuple(fuente) if isinstance(fuente, (list, tuple)) else fuente
+        with self.lock:
+            if clave not in self._arboles:
+                grafo = self.grafo
+                with etapa('dijkstra'):
+                    self._arboles[clave] = ArbolRutas(grafo, fuente)
+            return self._arboles[clave]
+    
+    def vista_calculo(self, fuente, limite=None):
+        """``(version, arbol, red_flujo, destinos)`` for a route and flow run from fuente.
+        
+        Taken under the lock so the parts match one network version: a copy
+        of the cached shortest-path tree (see ArbolRutas.copia), the max-flow
+        engine (incremental updates replace it rather than change it, and it
+        serialises its own queries) and the destination names. The run then
+        needs no lock, so it does not hold up incremental updates.
+        """
+        with self.lock:
+            arbol = self.arbol_rutas(fuente).copia()
+            red_flujo = self.red_flujo_para(fuente)
+            return self.version, arbol, red_flujo, self.grafo.destinos(limite)
+    
+    def topologia(self):
+        """topologia_columnar of the compact graph: node positions are GrafoCSR ids (``grafo.indice``).
+        
+        Needs no DiGraph. Built once per network version; incremental
+        updates change the version, so the next call rebuilds it.
+        """
+        with self.lock:
+            if self._topologia is None or self._topologia[0] != self.version:
+                grafo = self.grafo
+                with etapa('construir_topologia'):
+                    columnas = topologia_columnar(grafo, self._atributos)
+                self._topologia = (self.version, columnas)
+            return self._topologia[1]
+    
+    def vistas(self):
+        """VistasRed (zoom-dependent clustering for the map) of the topology, one per version."""
+        with self.lock:
+            if self._vistas is None or self._vistas[0] != self.version:
+                columnas = self.topologia()
+                self._vistas = (self.version, VistasRed(columnas))
+            return self._vistas[1]
+    
+    def _puntos_criticos_coords(self):
+        """Latitudes and longitudes of the critical points."""
+        puntos = _normalizar_columnas(self.puntos)
+        return _columna(puntos, 'latitud', 0).tolist(), _columna(puntos, 'longitud', 0).tolist()
+    
+    def agregar_punto_critico(self, punto):
+        """Mark a new critical point and drop only the edges it invalidates.
         
-        # Calculate maximum flow using Ford-Fulkerson algorithm (capacity in L/h)
+        Nodes within RADIO_PUNTO_CRITICO_KM of the point (if that rule is on) are isolated in the
+        compact graph (their edges are masked out), the same edges are removed
+        from the DiGraph, and the cached shortest-path trees are repaired in place.
+        """
+        with self.lock:
+            if self._grafo is None and self._G is None:
+                self._anexar_filas('puntos', [punto])
+                return {"aristas_eliminadas": 0, "nodos_recalculados": 0}
+            
+            # Taken before the row is appended, so a graph built now does not already hold the point
+            grafo = self.grafo
+            self._anexar_filas('puntos', [punto])
+            cerca = _cerca_punto_critico(grafo.latitud, grafo.longitud, [punto['latitud']], [punto['longitud']])
+            cerca &= ~grafo.es_tipo('punto_critico')
+            eliminadas = grafo.aislar_nodos(np.flatnonzero(cerca))
+            grafo.agregar_nodo(punto['nombre'], punto['latitud'], punto['longitud'], 'punto_critico',
+                               obstaculo=True)
+            self._anexar_atributos_nodos(['obstaculo'], [punto.get('tipo', 'critico')])
+            
+            recalculados = 0
+            for arbol in self._arboles.values():
+                recalculados += arbol.eliminar_aristas(eliminadas)
+            
+            nombres = grafo.nombres
+            pares = [(nombres[u], nombres[v]) for u, v in zip(grafo.origen[eliminadas].tolist(),
+                                                             grafo.indices[eliminadas].tolist())]
+            if self._G is not None:
+                self._G.add_node(
+                    punto['nombre'],
+                    pos=(punto['latitud'], punto['longitud']),
+                    tipo='punto_critico',
+                    subtipo=punto.get('tipo', 'critico'),
+                    estado='obstaculo'
+                )
+                self._G.remove_edges_from(pares)
+            
+            # Capacities changed: the max-flow engines are rebuilt on next use
+            self._red_flujo = None
+            self._red_flujo_multi = {}
+            
+            logging.info(f"Critical point {punto['nombre']} applied incrementally: "
+                         f"{len(pares)} edges removed, {recalculados} route nodes recomputed")
+            return {"aristas_eliminadas": len(pares), "nodos_recalculados": recalculados}
+    
+    def _aristas_de(self, nombres):
+        """Rows of the edge table touching any of the given nodes.
+        
+        Uses an index of the table by endpoint (CSR-like: row positions
+        grouped by node name) built on first use, so each update costs the
+        number of edges found rather than a scan of the table.
+        """
+        aristas = self.aristas
+        if self._extremos_aristas is None:
+            columnas = {c.lower(): c for c in aristas.columns}
+            extremos = pd.concat([aristas[columnas['origen']], aristas[columnas['destino']]], ignore_index=True)
+            codigos, unicos = pd.factorize(extremos)
+            filas = np.arange(len(extremos)) % max(len(aristas), 1)
+            filas, codigos = filas[codigos >= 0], codigos[codigos >= 0]
+            orden = np.argsort(codigos, kind='stable')
+            indptr = np.zeros(len(unicos) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(codigos, minlength=len(unicos)), out=indptr[1:])
+            self._extremos_aristas = (pd.Index(unicos), indptr, filas[orden])
+        
+        indice, indptr, filas = self._extremos_aristas
+        codigos = indice.get_indexer(list(nombres))
+        seleccion = [filas[indptr[c]:indptr[c + 1]] for c in codigos[codigos >= 0].tolist()]
+        seleccion = np.unique(np.concatenate(seleccion)) if seleccion else np.empty(0, dtype=np.int64)
+        return _normalizar_columnas(aristas.iloc[seleccion])
+    
+    def agregar_nodo(self, nodo):
+        """Add a node and connect it with the edges in the data that reference it."""
+        return self.agregar_nodos([nodo])
+    
+    def agregar_nodos(self, nodos):
+        """Add a batch of nodes and connect them with the edges in the data that reference them.
+        
+        The compact graph grows once for the whole batch, so registering many
+        nodes costs about the same as registering one.
+        """
+        with self.lock:
+            if self._grafo is None and self._G is None:
+                self._anexar_filas('nodos', nodos)
+                return {"aristas_agregadas": 0, "nodos_recalculados": 0}
+            
+            grafo = self.grafo
+            self._anexar_filas('nodos', nodos)
+            nombres_nuevos = [nodo['id_nodo'] for nodo in nodos]
+            latitudes = [nodo['latitud'] for nodo in nodos]
+            longitudes = [nodo['longitud'] for nodo in nodos]
+            puntos_lat, puntos_lon = self._puntos_criticos_coords()
+            aislados = _cerca_punto_critico(latitudes, longitudes, puntos_lat, puntos_lon)
+            ids = grafo.agregar_nodos(nombres_nuevos, latitudes, longitudes, [nodo['tipo'] for nodo in nodos],
+                                      obstaculo=[nodo['estado'] == 'obstaculo' for nodo in nodos])
+            self._anexar_atributos_nodos([nodo['estado'] for nodo in nodos], [''] * len(nodos))
+            if aislados.any():
+                grafo.aislar_nodos(ids[aislados])
+            
+            # Edges already listed in the data that were waiting for these nodes (one per pair, the last one)
+            candidatas = self._aristas_de(nombres_nuevos)
+            candidatas = candidatas[candidatas['estado'] != 'bloqueado'].drop_duplicates(['origen', 'destino'],
+                                                                                         keep='last')
+            
+            nuevas = []
+            for a in candidatas.to_dict('records'):
+                u, v = grafo.indice.get(a['origen']), grafo.indice.get(a['destino'])
+                if u is None or v is None or grafo.obstaculo[[u, v]].any() or grafo.aislado[[u, v]].any():
+                    continue
+                dist = a.get('distancia')
+                if dist is None or pd.isna(dist) or dist <= 0:
+                    dist = float(distancia_km(grafo.latitud[u], grafo.longitud[u],
+                                              grafo.latitud[v], grafo.longitud[v]))
+                nuevas.append((u, v, float(dist), float(a.get('capacidad', 1000)), a['estado']))
+            
+            ids_nuevas = []
+            if nuevas:
+                ids_nuevas = grafo.agregar_aristas([u for u, *_ in nuevas], [v for _, v, *_ in nuevas],
+                                                   [d for _, _, d, *_ in nuevas], [c for *_, c, _ in nuevas])
+                self._insertar_atributos_aristas(ids_nuevas, [estado for *_, estado in nuevas],
+                                                 [d for _, _, d, *_ in nuevas])
+            recalculados = 0
+            for arbol in self._arboles.values():
+                recalculados += arbol.insertar_aristas(ids_nuevas)
+            
+            nombres = grafo.nombres
+            if self._G is not None:
+                self._G.add_nodes_from((nodo['id_nodo'], {'pos': (nodo['latitud'], nodo['longitud']),
+                                                          'tipo': nodo['tipo'], 'estado': nodo['estado']})
+                                       for nodo in nodos)
+                self._G.add_edges_from((nombres[u], nombres[v], _atributos_arista(d, estado, c))
+                                       for u, v, d, c, estado in nuevas)
+            
+            if nuevas:
+                self._red_flujo = None
+                self._red_flujo_multi = {}
+            
+            logging.info(f"{len(nodos)} node(s) applied incrementally: {len(nuevas)} edges added, "
+                         f"{recalculados} route nodes improved")
+            return {"aristas_agregadas": len(nuevas), "nodos_recalculados": recalculados}
+
+_red_cache = None
+_red_cache_lock = threading.Lock()
+
+# How obtener_red() calls were served, and when the source was last checked, for resumen_red().
+# Updated under _red_cache_lock; the keys are fixed so they can be copied without it.
+_estadisticas_red = Counter(aciertos=0, cargas_instantanea=0, cargas_completas=0, actualizaciones=0)
+_red_comprobada_en = None
+
+# Database source set by configurar_fuente_db(); None means the CSV files are the source of truth
+_fuente_db = None
+
+def configurar_fuente_db(fuente):
+    """Load the network from a database source (FuenteDB in fuente_db.py) instead of the CSV files.
+    
+    The source must provide ``huella()``, ``version(huella)``, ``cargar()``
+    and ``cargar_tabla(nombre)``. Passing None goes back to the CSV files.
+    """
+    global _fuente_db, _red_cache
+    with _red_cache_lock:
+        _fuente_db = fuente
+        _red_cache = None
+    logging.info(f"Network source: {'database' if fuente is not None else 'CSV files'}")
+
+def _huella_archivos():
+    """Cheap fingerprint (path, mtime, size) of the data files."""
+    huella = []
+    for ruta in ARCHIVOS_DATOS:
         try:
-            if nx.has_path(G_transitable, fuente, destino):
-                # Use maximum flow algorithm to find bottleneck capacity in L/h
-                flujo = nx.maximum_flow_value(G_transitable, fuente, destino, capacity='capacidad')
-                flujos[destino] = round(flujo, 2)
-                logging.debug(f"Max flow to {destino}: {flujo}")
+            st = os.stat(ruta)
+            huella.append((ruta, st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            huella.append((ruta, None, None))
+    return tuple(huella)
+
+# Running SHA-256 of each data file with the (mtime, size) it was computed for, so that
+# appends made through anexar_filas_csv only hash the new bytes
+_hashes_archivos = {}
+_hashes_lock = threading.Lock()
+
+def _hash_archivo(ruta):
+    """SHA-256 of one data file, reusing the cached hash while the file is unchanged."""
+    st = os.stat(ruta)
+    with _hashes_lock:
+        entrada = _hashes_archivos.get(ruta)
+        if entrada is not None and entrada[0] == (st.st_mtime_ns, st.st_size):
+            return entrada[1].hexdigest()
+    
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(1 << 20), b''):
+            h.update(bloque)
+    final = os.stat(ruta)
+    if (final.st_mtime_ns, final.st_size) == (st.st_mtime_ns, st.st_size):
+        with _hashes_lock:
+            _hashes_archivos[ruta] = ((st.st_mtime_ns, st.st_size), h)
+    return h.hexdigest()
+
+def _hash_archivos():
+    """Content hash of the data files, used as the network version."""
+    h = hashlib.sha256()
+    for ruta in ARCHIVOS_DATOS:
+        h.update(ruta.encode())
+        h.update(_hash_archivo(ruta).encode())
+    return h.hexdigest()[:16]
+
+# Lock file that serialises writers of the data files across processes (POSIX only)
+ARCHIVO_BLOQUEO = 'data/.escritura.lock'
+_escritura_lock = threading.Lock()
+
+@contextmanager
+def bloqueo_escritura():
+    """Hold the data-file write lock: a thread lock plus, where fcntl exists, an flock shared by all processes."""
+    with _escritura_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(ARCHIVO_BLOQUEO, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+def anexar_filas_csv(ruta, filas, columnas):
+    """Append rows (dicts) to a CSV file without rewriting it; call under bloqueo_escritura().
+    
+    Values are written in the order of the file's own header, matching
+    column names case-insensitively; a missing file is created with
+    ``columnas`` as header. The file is fsync'ed before returning.
+    """
+    encabezado = None
+    falta_salto = False
+    if os.path.exists(ruta) and os.path.getsize(ruta) > 0:
+        with open(ruta, newline='', encoding='utf-8') as f:
+            encabezado = next(csv.reader(f))
+        with open(ruta, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            falta_salto = f.read(1) not in (b'\n', b'\r')
+    
+    texto = io.StringIO()
+    if falta_salto:
+        texto.write('\n')
+    escritor = csv.writer(texto, lineterminator='\n')
+    if encabezado is None:
+        encabezado = list(columnas)
+        escritor.writerow(encabezado)
+    for fila in filas:
+        valores = {clave.lower(): valor for clave, valor in fila.items()}
+        escritor.writerow([valores.get(columna.lower(), '') for columna in encabezado])
+    datos = texto.getvalue().encode('utf-8')
+    
+    st = os.stat(ruta) if os.path.exists(ruta) else None
+    with _hashes_lock:
+        entrada = _hashes_archivos.get(ruta)
+        vigente = st is not None and entrada is not None and entrada[0] == (st.st_mtime_ns, st.st_size)
+    with open(ruta, 'ab') as f:
+        f.write(datos)
+        f.flush()
+        os.fsync(f.fileno())
+    
+    # Extend the running content hash with the appended bytes instead of re-reading the file
+    if vigente:
+        st = os.stat(ruta)
+        h = entrada[1].copy()
+        h.update(datos)
+        with _hashes_lock:
+            _hashes_archivos[ruta] = ((st.st_mtime_ns, st.st_size), h)
+
+def _huella():
+    """Fingerprint of the current source of truth and of the critical-point radius."""
+    huella = _fuente_db.huella() if _fuente_db is not None else _huella_archivos()
+    # The radius changes the network, so a snapshot built with another one must not be reused
+    return huella + (('radio_punto_critico_km', RADIO_PUNTO_CRITICO_KM),)
+
+def _version(huella):
+    """Network version of the current source of truth and of the critical-point radius."""
+    if _fuente_db is not None:
+        return _fuente_db.version(huella)
+    return hashlib.sha256(f"{_hash_archivos()}:{RADIO_PUNTO_CRITICO_KM}".encode()).hexdigest()[:16]
+
+def obtener_red():
+    """Return the cached network, reloading it only when the data changed.
+    
+    The source's fingerprint (file mtimes/sizes, or row counts and update
+    times in the database) is checked on every call; the data is versioned
+    and re-read only when it differs from the cached one. A binary snapshot
+    compiled from data with the same fingerprint is memory-mapped instead of
+    parsing it, and one is written after parsing.
+    """
+    global _red_cache, _red_comprobada_en
+    huella = _huella()
+    with _red_cache_lock:
+        _red_comprobada_en = time.time()
+        if _red_cache is not None and _red_cache.huella == huella:
+            _estadisticas_red['aciertos'] += 1
+            return _red_cache
+        
+        inicio = time.perf_counter()
+        if USAR_INSTANTANEA:
+            with etapa('cargar_instantanea'):
+                instantanea = cargar_instantanea(huella)
+            if instantanea is not None:
+                version, grafo, atributos, conteos = instantanea
+                _red_cache = RedCargada(huella, version, grafo=grafo, atributos=atributos, fuente=_fuente_db,
+                                        conteos=conteos)
+                _red_cache.origen = 'instantanea'
+                _red_cache.duracion_carga_ms = int((time.perf_counter() - inicio) * 1000)
+                _estadisticas_red['cargas_instantanea'] += 1
+                logging.info(f"Network cache loaded from snapshot (version {version})")
+                return _red_cache
+        
+        version = _version(huella)
+        if _red_cache is not None and _red_cache.version == version:
+            # Files were touched but their content did not change
+            _red_cache.huella = huella
+            _estadisticas_red['aciertos'] += 1
+            return _red_cache
+        
+        with etapa('cargar_datos'):
+            if _fuente_db is not None:
+                embalses, puntos, nodos, aristas = _fuente_db.cargar()
             else:
-                flujos[destino] = 0
-        except Exception as e:
-            logging.error(f"Error calculating flow to {destino}: {e}")
-            flujos[destino] = 0
+                embalses, puntos, nodos, aristas = cargar_datos()
+        _red_cache = RedCargada(huella, version, embalses, puntos, nodos, aristas, fuente=_fuente_db)
+        _red_cache.origen = 'db' if _fuente_db is not None else 'csv'
+        _red_cache.duracion_carga_ms = int((time.perf_counter() - inicio) * 1000)
+        _estadisticas_red['cargas_completas'] += 1
+        logging.info(f"Network cache loaded (version {version})")
+        if USAR_INSTANTANEA:
+            try:
+                _red_cache.guardar_instantanea()
+            except OSError as e:
+                logging.warning(f"Could not write the network snapshot: {e}")
+        return _red_cache
+
+def invalidar_cache():
+    """Drop the cached network so the next obtener_red() reloads the data."""
+    global _red_cache
+    with _red_cache_lock:
+        _red_cache = None
+    logging.info("Network cache invalidated")
+
+def actualizar_red(persistir, aplicar):
+    """Persist a change and apply it to the live cached network.
     
-    return rutas, flujos
+    ``persistir()`` writes the change to the source of truth (data files or
+    database) and ``aplicar(red)`` applies the same change to the cached
+    RedCargada, whose fingerprint and version are then refreshed so it is not
+    reloaded. When nothing is cached, or the cache was already stale, the
+    cache is invalidated instead and None is returned.
+    """
+    global _red_cache
+    with _red_cache_lock:
+        red = _red_cache
+        vigente = red is not None and red.huella == _huella()
+        persistir()
+        if not vigente:
+            _red_cache = None
+            return None
+        
+        with red.lock:
+            resultado = aplicar(red)
+            red.huella = _huella()
+            red.version = _version(red.huella)
+        _estadisticas_red['actualizaciones'] += 1
+        return resultado
+
+def resumen_red():
+    """Summary of the cached network for health checks; never reads the data source.
+    
+    It does not take the cache lock, so it answers at once even while the
+    network is being loaded. ``red`` is None until a network has been
+    loaded. Times are Unix timestamps.
+    """
+    red = _red_cache
+    estadisticas = dict(_estadisticas_red)
+    comprobada_en = _red_comprobada_en
+    if red is None:
+        return {"red": None, "comprobada_en": comprobada_en, "estadisticas": estadisticas}
+    return {
+        "red": {
+            "version": red.version,
+            "origen": red.origen,
+            "cargada_en": red.cargada_en,
+            "duracion_carga_ms": red.duracion_carga_ms,
+            "conteos": dict(red.conteos),
+        },
+        "comprobada_en": comprobada_en,
+        "estadisticas": estadisticas,
+    }
@@ -0,0 +1,238 @@
+"""
+Representación compacta de la red de distribución para el cálculo de rutas.
+
+Los nodos se identifican con enteros (con una tabla id <-> nombre) y las
+aristas se guardan en formato CSR (indptr/indices) con pesos y capacidades
+float32. Los obstáculos, las tuberías bloqueadas y los nodos aislados por un
+punto crítico se representan con máscaras booleanas, de modo que la red
+transitable nunca se copia: basta con consultar ``activa``.
+"""
+
+import sys
+
+import numpy as np
+
+
+class GrafoCSR:
+    """Directed graph with integer node ids, CSR adjacency and state masks.
+
+    Node arrays (indexed by id): ``latitud``, ``longitud``, ``codigo_tipo``
+    (into ``tipos``), ``obstaculo`` (obstacle or critical point),
+    ``aislado`` (within the critical-point radius, so its pipes are out of
+    service) and ``capacidad_nodo`` (stored volume of reservoirs).
+
+    Edge arrays (indexed by CSR position): ``origen``, ``indices``
+    (destination), ``peso`` (km), ``capacidad`` (L/h), ``bloqueada`` and the
+    derived ``activa``. Edge ids are stable until edges are added, which
+    rebuilds the CSR layout. ``indptr_inv``/``aristas_inv`` index the edges by
+    destination for predecessor scans.
+    """
+
+    # Arrays that fully describe the graph (``activa`` is derived from them)
+    ARREGLOS = ('latitud', 'longitud', 'codigo_tipo', 'obstaculo', 'aislado', 'capacidad_nodo',
+                'origen', 'indices', 'peso', 'capacidad', 'bloqueada', 'indptr', 'aristas_inv', 'indptr_inv')
+
+    def __init__(self, nombres, latitud, longitud, tipo, obstaculo, capacidad_nodo,
+                 origen, destino, peso, capacidad, bloqueada, aislado=None):
+        self.nombres = list(nombres)
+        self.indice = {nombre: i for i, nombre in enumerate(self.nombres)}
+        n = len(self.nombres)
+
+        self.latitud = np.asarray(latitud, dtype=np.float64)
+        self.longitud = np.asarray(longitud, dtype=np.float64)
+        self.tipos, codigos = np.unique(np.asarray(tipo, dtype=object).astype(str), return_inverse=True)
+        self.tipos = self.tipos.tolist()
+        self.codigo_tipo = codigos.astype(np.int16).reshape(n)
+        self.obstaculo = np.asarray(obstaculo, dtype=bool).copy()
+        self.aislado = np.zeros(n, dtype=bool) if aislado is None else np.asarray(aislado, dtype=bool).copy()
+        self.capacidad_nodo = np.asarray(capacidad_nodo, dtype=np.float32)
+        self._destinos = None
+
+        self._construir_csr(
+            np.asarray(origen, dtype=np.int32), np.asarray(destino, dtype=np.int32),
+            np.asarray(peso, dtype=np.float32), np.asarray(capacidad, dtype=np.float32),
+            np.asarray(bloqueada, dtype=bool)
+        )
+
+    @classmethod
+    def desde_networkx(cls, G):
+        """Build from a NetworkX graph using the attributes set by construir_grafo."""
+        nombres = list(G.nodes)
+        indice = {nombre: i for i, nombre in enumerate(nombres)}
+        datos = [G.nodes[n] for n in nombres]
+        origen = []
+        destino = []
+        peso = []
+        capacidad = []
+        bloqueada = []
+        for u, v, d in G.edges(data=True):
+            origen.append(indice[u])
+            destino.append(indice[v])
+            peso.append(d.get('weight', 1))
+            c = d.get('capacidad', 0)
+            capacidad.append(c if c and c == c else 0)
+            bloqueada.append(d.get('estado') == 'bloqueado')
+        return cls(
+            nombres,
+            [d.get('pos', (0, 0))[0] for d in datos],
+            [d.get('pos', (0, 0))[1] for d in datos],
+            [d.get('tipo', '') for d in datos],
+            [d.get('estado') == 'obstaculo' or d.get('tipo') == 'punto_critico' for d in datos],
+            [d.get('capacidad', 0) if d.get('tipo') == 'embalse' else 0 for d in datos],
+            origen, destino, peso, capacidad, bloqueada
+        )
+
+    @classmethod
+    def desde_arreglos(cls, nombres, tipos, arreglos):
+        """Rebuild from the arrays returned by ``arreglos()`` without sorting the edges again.
+
+        The arrays may be read-only memory maps: the node masks that are
+        updated in place are copied, the others are only ever replaced.
+        """
+        grafo = cls.__new__(cls)
+        grafo.nombres = list(nombres)
+        grafo.indice = dict(zip(grafo.nombres, range(len(grafo.nombres))))
+        grafo.tipos = list(tipos)
+        for nombre in cls.ARREGLOS:
+            setattr(grafo, nombre, arreglos[nombre])
+        grafo.obstaculo = np.array(grafo.obstaculo, dtype=bool)
+        grafo.aislado = np.array(grafo.aislado, dtype=bool)
+        grafo._destinos = None
+        grafo._actualizar_activas()
+        return grafo
+
+    def arreglos(self):
+        """The arrays that describe the graph, by attribute name (see ARREGLOS)."""
+        return {nombre: getattr(self, nombre) for nombre in self.ARREGLOS}
+
+    def _construir_csr(self, origen, destino, peso, capacidad, bloqueada):
+        """Sort edges by origin into the CSR layout and rebuild the derived indexes."""
+        n = len(self.nombres)
+        orden = np.argsort(origen, kind='stable')
+        self.origen = origen[orden]
+        self.indices = destino[orden]
+        self.peso = peso[orden]
+        self.capacidad = np.nan_to_num(capacidad[orden], nan=0.0)
+        self.bloqueada = bloqueada[orden]
+
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.origen, minlength=n), out=self.indptr[1:])
+        self.aristas_inv = np.argsort(self.indices, kind='stable').astype(np.int32)
+        self.indptr_inv = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.indices, minlength=n), out=self.indptr_inv[1:])
+        self._actualizar_activas()
+
+    def _actualizar_activas(self):
+        """Recompute the edge mask from the blocked, obstacle and isolated masks."""
+        inhabilitado = self.obstaculo | self.aislado
+        self.activa = ~self.bloqueada & ~inhabilitado[self.origen] & ~inhabilitado[self.indices]
+
+    @property
+    def numero_nodos(self):
+        return len(self.nombres)
+
+    @property
+    def numero_aristas(self):
+        return len(self.indices)
+
+    @property
+    def numero_aristas_activas(self):
+        """Edges water can use (the edges of the DiGraph built by construir_grafo)."""
+        return int(np.count_nonzero(self.activa))
+
+    def tipo(self, i):
+        """Node type of id i."""
+        return self.tipos[self.codigo_tipo[i]]
+
+    def es_tipo(self, tipo):
+        """Boolean node mask of the given type."""
+        if tipo not in self.tipos:
+            return np.zeros(self.numero_nodos, dtype=bool)
+        return self.codigo_tipo == self.tipos.index(tipo)
+
+    def transitable(self, nombre):
+        """True when the node exists and water may pass through it."""
+        i = self.indice.get(nombre)
+        return i is not None and not self.obstaculo[i]
+
+    def destinos(self, limite=None):
+        """Names of the distribution nodes (not obstacles, critical points or reservoirs), in node order.
+
+        The id index is computed once and kept until nodes are added, so a
+        request only pays for the names it asks for.
+        """
+        if self._destinos is None:
+            self._destinos = np.flatnonzero(~self.obstaculo & ~self.es_tipo('embalse'))
+        ids = self._destinos if limite is None else self._destinos[:limite]
+        return [self.nombres[i] for i in ids.tolist()]
+
+    def aristas_activas(self):
+        """``(origen, destino, capacidad)`` arrays of the edges water can use."""
+        return self.origen[self.activa], self.indices[self.activa], self.capacidad[self.activa]
+
+    def aislar_nodos(self, ids):
+        """Take the pipes of the given nodes out of service; returns the ids of edges that became inactive."""
+        antes = self.activa
+        self.aislado[np.asarray(ids, dtype=np.int64)] = True
+        self._actualizar_activas()
+        return np.flatnonzero(antes & ~self.activa)
+
+    def agregar_nodo(self, nombre, latitud, longitud, tipo, obstaculo=False, capacidad=0):
+        """Append an isolated node and return its id."""
+        return int(self.agregar_nodos([nombre], [latitud], [longitud], [tipo], [obstaculo], [capacidad])[0])
+
+    def agregar_nodos(self, nombres, latitud, longitud, tipos, obstaculo=None, capacidad=None):
+        """Append isolated nodes in one pass over the node arrays; returns their ids."""
+        k = len(nombres)
+        inicio = len(self.nombres)
+        for nombre in nombres:
+            self.indice[nombre] = len(self.nombres)
+            self.nombres.append(nombre)
+        for tipo in tipos:
+            if tipo not in self.tipos:
+                self.tipos.append(tipo)
+        self.latitud = np.append(self.latitud, np.asarray(latitud, dtype=np.float64))
+        self.longitud = np.append(self.longitud, np.asarray(longitud, dtype=np.float64))
+        self.codigo_tipo = np.append(self.codigo_tipo, np.array([self.tipos.index(t) for t in tipos], dtype=np.int16))
+        self.obstaculo = np.append(self.obstaculo, np.zeros(k, dtype=bool) if obstaculo is None
+                                   else np.asarray(obstaculo, dtype=bool))
+        self.aislado = np.append(self.aislado, np.zeros(k, dtype=bool))
+        self.capacidad_nodo = np.append(self.capacidad_nodo, np.zeros(k, dtype=np.float32) if capacidad is None
+                                        else np.asarray(capacidad, dtype=np.float32))
+        self.indptr = np.append(self.indptr, np.full(k, self.indptr[-1]))
+        self.indptr_inv = np.append(self.indptr_inv, np.full(k, self.indptr_inv[-1]))
+        self._destinos = None
+        return np.arange(inicio, inicio + k)
+
+    def agregar_aristas(self, origen, destino, peso, capacidad):
+        """Add transitable edges (rebuilding the CSR layout); returns their new edge ids, in input order.
+
+        The existing edges keep their relative order, so their new ids are
+        the ids not returned, in increasing order.
+        """
+        m = self.numero_aristas
+        origen = np.asarray(origen, dtype=np.int32)
+
+        orden = np.argsort(np.concatenate([self.origen, origen]), kind='stable')
+        posicion = np.empty(len(orden), dtype=np.int64)
+        posicion[orden] = np.arange(len(orden))
+        self._construir_csr(
+            np.concatenate([self.origen, origen]),
+            np.concatenate([self.indices, np.asarray(destino, dtype=np.int32)]),
+            np.concatenate([self.peso, np.asarray(peso, dtype=np.float32)]),
+            np.concatenate([self.capacidad, np.asarray(capacidad, dtype=np.float32)]),
+            np.concatenate([self.bloqueada, np.zeros(len(origen), dtype=bool)])
+        )
+        return posicion[m:]
+
+    def memoria_bytes(self, incluir_nombres=True):
+        """Approximate size in bytes of the numpy arrays plus, by default, the names table.
+
+        The names table is the ``nombres`` list, its strings and the
+        ``indice`` dict.
+        """
+        total = self.activa.nbytes + sum(a.nbytes for a in self.arreglos().values())
+        if incluir_nombres:
+            total += (sys.getsizeof(self.nombres) + sys.getsizeof(self.indice)
+                      + sum(sys.getsizeof(nombre) for nombre in self.nombres))
+        return total
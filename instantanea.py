@@ -0,0 +1,145 @@
+"""
+Instantánea binaria de la red procesada.
+
+La red compilada (GrafoCSR con sus máscaras y los atributos que solo necesita
+el DiGraph) se escribe una vez como un directorio de arreglos ``.npy`` con
+tipos fijos, y los procesos siguientes la abren con ``np.load(mmap_mode='r')``
+en lugar de volver a leer los CSV: cargar la red cuesta lo que cuesta mapear
+los archivos y crear la tabla de nombres.
+
+Estructura del directorio::
+
+    data/instantanea/
+        actual.json            versión vigente y huella de los CSV de origen
+        <version>/
+            meta.json          formato, tipos, categorías de los textos y filas por tabla
+            nombres.npy        nombres de los nodos (texto de ancho fijo)
+            <arreglo>.npy      un archivo por arreglo de GrafoCSR.ARREGLOS
+            atr_<nombre>.npy   atributos del DiGraph (los textos como códigos)
+
+Cada versión se escribe en un directorio temporal que se renombra al final, y
+``actual.json`` se reemplaza atómicamente, así que varios procesos pueden
+compilar o leer la instantánea a la vez sin ver archivos a medio escribir.
+"""
+
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+
+from grafo_csr import GrafoCSR
+
+DIRECTORIO_INSTANTANEA = 'data/instantanea'
+
+# Bumped whenever the layout of the files changes; older snapshots are ignored
+FORMATO_INSTANTANEA = 2
+
+
+def _codificar(valores):
+    """Encode a text array as int16 codes plus the list of categories."""
+    categorias, codigos = np.unique(np.asarray(valores, dtype=object).astype(str), return_inverse=True)
+    return codigos.astype(np.int16).reshape(len(valores)), categorias.tolist()
+
+
+def guardar_instantanea(version, huella, grafo, atributos, conteos=None, directorio=DIRECTORIO_INSTANTANEA):
+    """Write the compact graph and its DiGraph attributes as the snapshot of ``version``.
+
+    ``huella`` is the fingerprint of the source files; the snapshot is only
+    used while it still matches. ``conteos`` holds the row count of each
+    source table. Older versions are removed afterwards.
+    """
+    os.makedirs(directorio, exist_ok=True)
+    destino = os.path.join(directorio, version)
+    temporal = f"{destino}.tmp{os.getpid()}"
+    shutil.rmtree(temporal, ignore_errors=True)
+    os.makedirs(temporal)
+
+    nombres = np.asarray(grafo.nombres)
+    if nombres.dtype == object:
+        nombres = nombres.astype(str)
+    np.save(os.path.join(temporal, 'nombres.npy'), nombres)
+    for nombre, arreglo in grafo.arreglos().items():
+        np.save(os.path.join(temporal, f'{nombre}.npy'), np.ascontiguousarray(arreglo))
+
+    categorias = {}
+    for nombre, valores in atributos.items():
+        valores = np.asarray(valores)
+        if valores.dtype == object:
+            valores, categorias[nombre] = _codificar(valores)
+        np.save(os.path.join(temporal, f'atr_{nombre}.npy'), valores)
+
+    with open(os.path.join(temporal, 'meta.json'), 'w') as f:
+        json.dump({
+            'formato': FORMATO_INSTANTANEA,
+            'version': version,
+            'tipos': grafo.tipos,
+            'categorias': categorias,
+            'numero_nodos': grafo.numero_nodos,
+            'numero_aristas': grafo.numero_aristas,
+            'conteos': conteos or {},
+        }, f)
+
+    try:
+        os.rename(temporal, destino)
+    except OSError:
+        # Another process already wrote this version
+        shutil.rmtree(temporal, ignore_errors=True)
+
+    actual = os.path.join(directorio, 'actual.json')
+    with open(f"{actual}.tmp{os.getpid()}", 'w') as f:
+        json.dump({'version': version, 'huella': huella}, f)
+    os.replace(f"{actual}.tmp{os.getpid()}", actual)
+
+    # Drop older versions (directories still being written by other processes are left alone)
+    for entrada in os.listdir(directorio):
+        ruta = os.path.join(directorio, entrada)
+        if entrada != version and '.tmp' not in entrada and os.path.isdir(ruta):
+            shutil.rmtree(ruta, ignore_errors=True)
+
+    logging.info(f"Network snapshot {version} written to {destino}")
+
+
+def cargar_instantanea(huella, directorio=DIRECTORIO_INSTANTANEA):
+    """Memory-map the current snapshot if it was compiled from files with this fingerprint.
+
+    Returns ``(version, grafo, atributos, conteos)``, or None when there is
+    no snapshot or it is stale.
+    """
+    try:
+        with open(os.path.join(directorio, 'actual.json')) as f:
+            actual = json.load(f)
+        if [list(h) for h in huella] != actual['huella']:
+            return None
+
+        ruta = os.path.join(directorio, actual['version'])
+        with open(os.path.join(ruta, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['formato'] != FORMATO_INSTANTANEA:
+            return None
+
+        def leer(nombre):
+            return np.load(os.path.join(ruta, f'{nombre}.npy'), mmap_mode='r')
+
+        grafo = GrafoCSR.desde_arreglos(
+            leer('nombres').tolist(), meta['tipos'],
+            {nombre: leer(nombre) for nombre in GrafoCSR.ARREGLOS}
+        )
+        atributos = {}
+        for archivo in os.listdir(ruta):
+            if archivo.startswith('atr_'):
+                nombre = archivo[len('atr_'):-len('.npy')]
+                valores = leer(f'atr_{nombre}')
+                if nombre in meta['categorias']:
+                    valores = np.asarray(meta['categorias'][nombre], dtype=object)[valores]
+                atributos[nombre] = valores
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as e:
+        logging.warning(f"Network snapshot not usable: {e}")
+        return None
+
+    logging.info(f"Network snapshot {actual['version']} mapped: {grafo.numero_nodos} nodes, "
+                 f"{grafo.numero_aristas} edges")
+    return actual['version'], grafo, atributos, meta['conteos']
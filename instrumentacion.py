@@ -0,0 +1,202 @@
+"""
+Instrumentación del cálculo de rutas y flujos.
+
+Una ``Medicion`` acumula, para una petición, la duración de cada etapa
+(lectura de datos, construcción de los grafos, Dijkstra, flujo máximo,
+JSON, base de datos...) y contadores como nodos, destinos o bytes
+enviados. La medición activa se guarda en una ContextVar, así que
+grafo_agua registra sus etapas con ``etapa()`` sin recibirla como
+parámetro; fuera de ``medir()`` las etapas se miden en una medición que
+nadie lee.
+
+``Metricas`` agrega las mediciones terminadas en histogramas por etapa y
+las expone en el formato de texto de Prometheus (``/metrics``). Cada
+proceso lleva sus propias métricas: con varios workers de gunicorn, cada
+uno responde con las suyas.
+"""
+
+import cProfile
+import pstats
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Upper bounds (seconds) of the histogram buckets; +Inf is implicit
+LIMITES_HISTOGRAMA_S = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# Functions listed in a ?profile=1 summary
+FUNCIONES_PERFIL = 30
+
+_medicion_activa = ContextVar('medicion_activa', default=None)
+
+
+class Medicion:
+    """Accumulated stage durations (s) and counters of one processing run.
+
+    A stage entered several times (e.g. one max-flow per destination) adds
+    up; stages do not nest, so their sum is at most the total.
+    """
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.etapas = {}
+        self.contadores = Counter()
+
+    @contextmanager
+    def etapa(self, nombre):
+        """Time the enclosed block as stage ``nombre``."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.sumar(nombre, time.perf_counter() - inicio)
+
+    def sumar(self, nombre, segundos):
+        """Add time to a stage (for loops too hot for a context manager per iteration)."""
+        self.etapas[nombre] = self.etapas.get(nombre, 0.0) + segundos
+
+    def contar(self, nombre, cantidad=1):
+        self.contadores[nombre] += cantidad
+
+    def total(self):
+        """Seconds since the measurement started."""
+        return time.perf_counter() - self.inicio
+
+    def resumen(self):
+        """JSON-ready breakdown: ``{"total_ms", "etapas_ms", "contadores"}``."""
+        return {
+            "total_ms": round(self.total() * 1000, 3),
+            "etapas_ms": {nombre: round(segundos * 1000, 3) for nombre, segundos in self.etapas.items()},
+            "contadores": dict(self.contadores),
+        }
+
+    def server_timing(self):
+        """Value of a Server-Timing header with every stage and the total (ms)."""
+        partes = [f"{nombre};dur={segundos * 1000:.1f}" for nombre, segundos in self.etapas.items()]
+        partes.append(f"total;dur={self.total() * 1000:.1f}")
+        return ", ".join(partes)
+
+
+def medicion_actual():
+    """The active Medicion, or a throwaway one when nothing is being measured."""
+    return _medicion_activa.get() or Medicion()
+
+
+@contextmanager
+def medir(medicion=None):
+    """Make ``medicion`` (a new one by default) the active measurement within the block."""
+    medicion = medicion if medicion is not None else Medicion()
+    token = _medicion_activa.set(medicion)
+    try:
+        yield medicion
+    finally:
+        _medicion_activa.reset(token)
+
+
+def etapa(nombre):
+    """Time the enclosed block as a stage of the active measurement."""
+    return medicion_actual().etapa(nombre)
+
+
+def contar(nombre, cantidad=1):
+    """Add to a counter of the active measurement."""
+    medicion_actual().contar(nombre, cantidad)
+
+
+@contextmanager
+def perfilar(activo=True):
+    """cProfile the enclosed block; yields the profiler (None when not ``activo``)."""
+    if not activo:
+        yield None
+        return
+    perfil = cProfile.Profile()
+    perfil.enable()
+    try:
+        yield perfil
+    finally:
+        perfil.disable()
+
+
+def resumen_perfil(perfil, limite=FUNCIONES_PERFIL):
+    """The ``limite`` functions with the most cumulative time in a cProfile run."""
+    estadisticas = pstats.Stats(perfil)
+    filas = []
+    for (archivo, linea, funcion), (_, llamadas, propio, acumulado, _) in estadisticas.stats.items():
+        filas.append({
+            "funcion": f"{archivo}:{linea}({funcion})",
+            "llamadas": llamadas,
+            "tiempo_propio_ms": round(propio * 1000, 3),
+            "tiempo_acumulado_ms": round(acumulado * 1000, 3),
+        })
+    filas.sort(key=lambda f: f["tiempo_acumulado_ms"], reverse=True)
+    return filas[:limite]
+
+
+def _etiquetas(etiquetas):
+    return ",".join(f'{clave}="{valor}"' for clave, valor in etiquetas)
+
+
+class Metricas:
+    """Process-wide histograms of processing and stage durations, plus counter totals."""
+
+    def __init__(self, prefijo="agua", limites=LIMITES_HISTOGRAMA_S):
+        self.prefijo = prefijo
+        self.limites = tuple(limites)
+        self._lock = threading.Lock()
+        # (metric, labels) -> [count per bucket (last is +Inf), sum]
+        self._histogramas = {}
+        self._contadores = Counter()
+
+    def _observar(self, nombre, etiquetas, segundos):
+        histograma = self._histogramas.get((nombre, etiquetas))
+        if histograma is None:
+            histograma = self._histogramas[(nombre, etiquetas)] = [[0] * (len(self.limites) + 1), 0.0]
+        histograma[0][bisect_left(self.limites, segundos)] += 1
+        histograma[1] += segundos
+
+    def registrar(self, modo, medicion):
+        """Record a finished measurement; ``modo`` labels how the run was requested.
+
+        Runs answered from the result cache (an ``aciertos_cache`` count) are
+        labelled ``cache="true"``.
+        """
+        total = medicion.total()
+        cache = "true" if medicion.contadores.get("aciertos_cache") else "false"
+        with self._lock:
+            self._contadores[("procesamientos_total", (("modo", modo), ("cache", cache)))] += 1
+            self._observar("procesamiento_duracion_segundos", (("modo", modo),), total)
+            for nombre, segundos in medicion.etapas.items():
+                self._observar("etapa_duracion_segundos", (("etapa", nombre),), segundos)
+            for nombre, cantidad in medicion.contadores.items():
+                self._contadores[(f"{nombre}_total", ())] += cantidad
+
+    def exponer(self):
+        """The metrics in the Prometheus text exposition format."""
+        with self._lock:
+            histogramas = {clave: (list(cuentas), suma) for clave, (cuentas, suma) in self._histogramas.items()}
+            contadores = dict(self._contadores)
+
+        lineas = []
+        vistos = set()
+        for (nombre, etiquetas), cantidad in sorted(contadores.items()):
+            metrica = f"{self.prefijo}_{nombre}"
+            if metrica not in vistos:
+                vistos.add(metrica)
+                lineas.append(f"# TYPE {metrica} counter")
+            lineas.append(f"{metrica}{{{_etiquetas(etiquetas)}}} {cantidad}" if etiquetas else f"{metrica} {cantidad}")
+
+        for (nombre, etiquetas), (cuentas, suma) in sorted(histogramas.items()):
+            metrica = f"{self.prefijo}_{nombre}"
+            if metrica not in vistos:
+                vistos.add(metrica)
+                lineas.append(f"# TYPE {metrica} histogram")
+            acumulado = 0
+            for limite, cuenta in zip(self.limites + ("+Inf",), cuentas):
+                acumulado += cuenta
+                lineas.append(f'{metrica}_bucket{{{_etiquetas(etiquetas + (("le", limite),))}}} {acumulado}')
+            lineas.append(f"{metrica}_sum{{{_etiquetas(etiquetas)}}} {suma:.6f}")
+            lineas.append(f"{metrica}_count{{{_etiquetas(etiquetas)}}} {acumulado}")
+        return "\n".join(lineas) + "\n"
@@ -1,3 +1,4 @@
+import json
 from sqlalchemy.sql import func
 from datetime import datetime
 
@@ -15,7 +16,8 @@ def create_models(db):
         capacidad_maxima_m3 = db.Column(db.BigInteger, nullable=True)
         estado = db.Column(db.String(20), default='operativo')
         fecha_creacion = db.Column(db.DateTime, default=func.now())
-        fecha_actualizacion = db.Column(db.DateTime, default=func.now(), onupdate=func.now())
+        # Indexed: the database network source reads max(fecha_actualizacion) on every request
+        fecha_actualizacion = db.Column(db.DateTime, default=func.now(), onupdate=func.now(), index=True)
         
         def to_dict(self):
             return {
@@ -40,7 +42,8 @@ def create_models(db):
         poblacion_afectada = db.Column(db.Integer, nullable=True)
         estado = db.Column(db.String(20), default='activo')
         fecha_creacion = db.Column(db.DateTime, default=func.now())
-        fecha_actualizacion = db.Column(db.DateTime, default=func.now(), onupdate=func.now())
+        # Indexed: the database network source reads max(fecha_actualizacion) on every request
+        fecha_actualizacion = db.Column(db.DateTime, default=func.now(), onupdate=func.now(), index=True)
         
         def to_dict(self):
             return {
@@ -65,7 +68,8 @@ def create_models(db):
         estado = db.Column(db.String(20), default='transitable')  # transitable, obstaculo, mantenimiento
         capacidad = db.Column(db.Float, nullable=True)
         fecha_creacion = db.Column(db.DateTime, default=func.now())
-        fecha_actualizacion = db.Column(db.DateTime, default=func.now(), onupdate=func.now())
+        # Indexed: the database network source reads max(fecha_actualizacion) on every request
+        fecha_actualizacion = db.Column(db.DateTime, default=func.now(), onupdate=func.now(), index=True)
         
         def to_dict(self):
             return {
@@ -80,6 +84,9 @@ def create_models(db):
 
     class Arista(db.Model):
         __tablename__ = 'aristas'
+        __table_args__ = (
+            db.Index('ix_aristas_origen_destino', 'origen', 'destino', unique=True),
+        )
         
         id = db.Column(db.Integer, primary_key=True)
         origen = db.Column(db.String(100), nullable=False)
@@ -90,7 +97,8 @@ def create_models(db):
         tipo_tuberia = db.Column(db.String(50), nullable=True)
         diametro_mm = db.Column(db.Float, nullable=True)
         fecha_creacion = db.Column(db.DateTime, default=func.now())
-        fecha_actualizacion = db.Column(db.DateTime, default=func.now(), onupdate=func.now())
+        # Indexed: the database network source reads max(fecha_actualizacion) on every request
+        fecha_actualizacion = db.Column(db.DateTime, default=func.now(), onupdate=func.now(), index=True)
         
         def to_dict(self):
             return {
@@ -106,6 +114,12 @@ def create_models(db):
 
     class Procesamiento(db.Model):
         __tablename__ = 'procesamientos'
+        # History pages are read newest first, optionally for one source or a date range
+        __table_args__ = (
+            db.Index('ix_procesamientos_fuente_id', 'fuente_principal', 'id'),
+            db.Index('ix_procesamientos_fecha', 'fecha_procesamiento'),
+            db.Index('ix_procesamientos_clave_cache', 'clave_cache', 'id'),
+        )
         
         id = db.Column(db.Integer, primary_key=True)
         fecha_procesamiento = db.Column(db.DateTime, default=func.now())
@@ -115,6 +129,8 @@ def create_models(db):
         tiempo_procesamiento_ms = db.Column(db.Integer, nullable=True)
         estado = db.Column(db.String(20), default='exitoso')
         detalles_json = db.Column(db.Text, nullable=True)  # JSON string with full results
+        # Result cache key (network version, source, limit); results are looked up by it
+        clave_cache = db.Column(db.String(200), nullable=True)
         
         def to_dict(self):
             return {
@@ -129,12 +145,17 @@ def create_models(db):
 
     class HistorialRuta(db.Model):
         __tablename__ = 'historial_rutas'
+        # Route pages are read per processing run, optionally for one destination
+        __table_args__ = (
+            db.Index('ix_historial_rutas_procesamiento_id', 'procesamiento_id', 'id'),
+            db.Index('ix_historial_rutas_procesamiento_destino', 'procesamiento_id', 'destino'),
+        )
         
         id = db.Column(db.Integer, primary_key=True)
         procesamiento_id = db.Column(db.Integer, db.ForeignKey('procesamientos.id'), nullable=False)
         origen = db.Column(db.String(100), nullable=False)
         destino = db.Column(db.String(100), nullable=False)
-        ruta_json = db.Column(db.Text, nullable=True)  # JSON array of route nodes
+        ruta_json = db.Column(db.Text, nullable=True)  # JSON array of route nodes (unset when the run stores them as a tree)
         flujo_maximo = db.Column(db.Float, nullable=False, default=0.0)
         distancia_total = db.Column(db.Float, nullable=True)
         tiempo_estimado_h = db.Column(db.Float, nullable=True)
@@ -142,17 +163,49 @@ def create_models(db):
         # Relationship
         procesamiento = db.relationship('Procesamiento', backref=db.backref('rutas', lazy=True))
         
-        def to_dict(self):
-            return {
+        def to_dict(self, incluir_ruta=True):
+            datos = {
                 'id': self.id,
                 'procesamiento_id': self.procesamiento_id,
                 'origen': self.origen,
                 'destino': self.destino,
-                'ruta_json': self.ruta_json,
                 'flujo_maximo': self.flujo_maximo,
                 'distancia_total': self.distancia_total,
                 'tiempo_estimado_h': self.tiempo_estimado_h
             }
+            if incluir_ruta:
+                datos['ruta_json'] = self.ruta_json
+            return datos
+
+    class Trabajo(db.Model):
+        __tablename__ = 'trabajos'
+        
+        id = db.Column(db.Integer, primary_key=True)
+        tipo = db.Column(db.String(50), nullable=False)  # procesar, generar_red
+        estado = db.Column(db.String(20), default='pendiente')  # pendiente, en_progreso, completado, error
+        progreso = db.Column(db.Float, nullable=False, default=0.0)  # 0.0 - 1.0
+        mensaje = db.Column(db.String(255), nullable=True)
+        parametros_json = db.Column(db.Text, nullable=True)
+        resultado_json = db.Column(db.Text, nullable=True)
+        error = db.Column(db.Text, nullable=True)
+        fecha_creacion = db.Column(db.DateTime, default=func.now())
+        fecha_inicio = db.Column(db.DateTime, nullable=True)
+        fecha_fin = db.Column(db.DateTime, nullable=True)
+        
+        def to_dict(self):
+            return {
+                'id': self.id,
+                'tipo': self.tipo,
+                'estado': self.estado,
+                'progreso': self.progreso,
+                'mensaje': self.mensaje,
+                'parametros': json.loads(self.parametros_json) if self.parametros_json else None,
+                'resultado': json.loads(self.resultado_json) if self.resultado_json else None,
+                'error': self.error,
+                'fecha_creacion': self.fecha_creacion.isoformat() if self.fecha_creacion else None,
+                'fecha_inicio': self.fecha_inicio.isoformat() if self.fecha_inicio else None,
+                'fecha_fin': self.fecha_fin.isoformat() if self.fecha_fin else None
+            }
     
     return {
         'Embalse': Embalse,
@@ -160,5 +213,6 @@ def create_models(db):
         'Nodo': Nodo,
         'Arista': Arista,
         'Procesamiento': Procesamiento,
-        'HistorialRuta': HistorialRuta
+        'HistorialRuta': HistorialRuta,
+        'Trabajo': Trabajo
     }
\ No newline at end of file
@@ -0,0 +1,76 @@
+"""
+Configuración del registro (logging) y registro muestreado para los bucles calientes.
+
+El nivel se elige por entorno con ``LOG_LEVEL`` (INFO por defecto; DEBUG en
+desarrollo). En los bucles que recorren miles de destinos no se registra
+un mensaje por elemento: se acumula un resumen que se registra una vez al
+final y, como detalle, solo una muestra de los elementos (los primeros
+``LOG_MUESTRA_PRIMEROS`` y después uno de cada ``LOG_MUESTRA_CADA``).
+Los mensajes usan el formato perezoso de logging (``%s``), de modo que no
+se construyen si su nivel está desactivado.
+"""
+
+import logging
+import os
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+FORMATO_LOG = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# Per-element detail logged by a Muestreo: the first few, then one in this many
+LOG_MUESTRA_PRIMEROS = int(os.environ.get("LOG_MUESTRA_PRIMEROS", "5"))
+LOG_MUESTRA_CADA = int(os.environ.get("LOG_MUESTRA_CADA", "1000"))
+
+# Element names quoted in a summary message
+EJEMPLOS_RESUMEN = 5
+
+
+def configurar_registro(nivel=None):
+    """Configure the root logger at ``nivel`` (LOG_LEVEL by default)."""
+    nivel = (nivel or LOG_LEVEL).upper()
+    if not isinstance(logging.getLevelName(nivel), int):
+        raise ValueError(f"Nivel de registro desconocido: {nivel}")
+    logging.basicConfig(level=nivel, format=FORMATO_LOG)
+    logging.getLogger().setLevel(nivel)
+
+
+class Ruta:
+    """Lazy ``a -> b -> c`` rendering of a route, joined only if the record is emitted."""
+
+    __slots__ = ('nodos',)
+
+    def __init__(self, nodos):
+        self.nodos = nodos
+
+    def __str__(self):
+        return ' -> '.join(map(str, self.nodos))
+
+
+class Muestreo:
+    """Sampled per-element logging plus a count of every element seen.
+
+    ``registrar(mensaje, *args)`` counts the element and logs it only when
+    the level is enabled and the element falls in the sample; ``ejemplos``
+    keeps the first few arguments for the final summary.
+    """
+
+    def __init__(self, nivel=logging.DEBUG, primeros=LOG_MUESTRA_PRIMEROS, cada=LOG_MUESTRA_CADA,
+                 logger=logging.root):
+        self.nivel = nivel
+        self.primeros = primeros
+        self.cada = max(cada, 1)
+        self.logger = logger
+        self.activo = logger.isEnabledFor(nivel)
+        self.total = 0
+        self.ejemplos = []
+
+    def registrar(self, mensaje, *args):
+        self.total += 1
+        if len(self.ejemplos) < EJEMPLOS_RESUMEN:
+            self.ejemplos.append(args[0] if args else None)
+        if self.activo and (self.total <= self.primeros or self.total % self.cada == 0):
+            self.logger.log(self.nivel, mensaje + " [%d]", *args, self.total)
+
+    def texto_ejemplos(self):
+        """The first elements seen, for a summary message."""
+        texto = ", ".join(map(str, self.ejemplos))
+        return texto + ", ..." if self.total > len(self.ejemplos) else texto
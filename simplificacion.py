@@ -0,0 +1,173 @@
+"""
+Simplificación de la red para el mapa según el nivel de zoom.
+
+Con la red de la ciudad (decenas de miles de nodos) el navegador no puede
+dibujar cada nodo y tubería. ``VistasRed`` agrupa los nodos de distribución
+en celdas de ``TAMANO_CELDA_PX`` píxeles de la proyección Web Mercator del
+mapa (la de Leaflet) para un zoom dado: cada grupo se dibuja como un solo
+círculo en el centroide de sus nodos, y las tuberías entre dos grupos como
+una sola línea. Las tuberías internas de un grupo no se envían. Los
+embalses y puntos críticos nunca se agrupan.
+
+A partir de ``ZOOM_DETALLE``, o cuando el área visible tiene a lo sumo
+``MAX_NODOS_DETALLE`` nodos, la vista es la red sin agrupar. En ambos casos
+solo se envían los grupos dentro del área visible y los extremos de las
+tuberías que llegan a ellos.
+
+Las agrupaciones se calculan con numpy sobre las columnas de
+``topologia_columnar`` y se guardan por zoom; una ``VistasRed`` corresponde
+a una versión de la red.
+"""
+
+import threading
+
+import numpy as np
+
+# Side of a clustering cell, in screen pixels
+TAMANO_CELDA_PX = 48
+# From this zoom on, nodes are not clustered
+ZOOM_DETALLE = 17
+ZOOM_MAXIMO = 22
+# A view holding at most this many nodes is sent without clustering
+MAX_NODOS_DETALLE = 2000
+
+# Node types that are never clustered, and node/edge states drawn as blocked
+TIPOS_FIJOS = ('embalse', 'punto_critico')
+ESTADOS_BLOQUEADOS = ('obstaculo', 'bloqueado')
+
+# Latitude limit of the Web Mercator projection
+LATITUD_MAXIMA = 85.05112878
+
+
+def mercator(lat, lng):
+    """Web Mercator coordinates in [0, 1] (x to the east, y to the south) of arrays in degrees."""
+    lat = np.radians(np.clip(lat, -LATITUD_MAXIMA, LATITUD_MAXIMA))
+    x = (np.asarray(lng, dtype=np.float64) + 180.0) / 360.0
+    y = (1.0 - np.arcsinh(np.tan(lat)) / np.pi) / 2.0
+    return x, y
+
+
+class VistasRed:
+    """Zoom-dependent clustering of one network version, from its topologia_columnar columns."""
+
+    def __init__(self, columnas):
+        nodos = columnas["nodos"]
+        aristas = columnas["aristas"]
+        codigos_fijos = [i for i, tipo in enumerate(columnas["tipos"]) if tipo in TIPOS_FIJOS]
+        codigos_bloqueados = [i for i, estado in enumerate(columnas["estados"]) if estado in ESTADOS_BLOQUEADOS]
+
+        self.lat = np.asarray(nodos["lat"], dtype=np.float64)
+        self.lng = np.asarray(nodos["lng"], dtype=np.float64)
+        self.x, self.y = mercator(self.lat, self.lng)
+        self.agrupable = ~np.isin(np.asarray(nodos["tipo"], dtype=np.int64), codigos_fijos)
+        self.obstaculo = np.isin(np.asarray(nodos["estado"], dtype=np.int64), codigos_bloqueados)
+        self.origen = np.asarray(aristas["origen"], dtype=np.int64)
+        self.destino = np.asarray(aristas["destino"], dtype=np.int64)
+        self.bloqueada = np.isin(np.asarray(aristas["estado"], dtype=np.int64), codigos_bloqueados)
+        self._agrupaciones = {}
+        self._lock = threading.Lock()
+
+    @property
+    def num_nodos(self):
+        return len(self.lat)
+
+    def _grupos(self, zoom):
+        """Group of every node at ``zoom`` (None: every node on its own) and the number of groups."""
+        n = self.num_nodos
+        if zoom is None:
+            return np.arange(n), n
+        escala = 256 * 2 ** zoom / TAMANO_CELDA_PX
+        celda_x = np.floor(self.x[self.agrupable] * escala).astype(np.int64)
+        celda_y = np.floor(self.y[self.agrupable] * escala).astype(np.int64)
+        celdas, inversa = np.unique(celda_x * (1 << 32) + celda_y, return_inverse=True)
+        grupo = np.empty(n, dtype=np.int64)
+        grupo[self.agrupable] = inversa
+        fijos = np.flatnonzero(~self.agrupable)
+        grupo[fijos] = len(celdas) + np.arange(len(fijos))
+        return grupo, len(celdas) + len(fijos)
+
+    def agrupacion(self, zoom):
+        """Groups and the connections between them at ``zoom`` (None: no clustering), as arrays.
+
+        Groups: centroid ``lat``/``lng``, ``cantidad`` of nodes, ``nodo``
+        (the lowest node position in the group, the node itself when it is
+        alone) and ``obstaculos``. Connections: groups ``a`` < ``b``, the
+        ``cantidad`` of directed edges between them and how many are
+        ``bloqueadas``.
+        """
+        with self._lock:
+            if zoom in self._agrupaciones:
+                return self._agrupaciones[zoom]
+
+        grupo, total = self._grupos(zoom)
+        cantidad = np.bincount(grupo, minlength=total)
+        lat = np.bincount(grupo, weights=self.lat, minlength=total) / cantidad
+        lng = np.bincount(grupo, weights=self.lng, minlength=total) / cantidad
+        obstaculos = np.bincount(grupo, weights=self.obstaculo, minlength=total).astype(np.int64)
+        orden = np.argsort(grupo, kind='stable')
+        nodo = orden[np.searchsorted(grupo[orden], np.arange(total))]
+
+        a = grupo[self.origen]
+        b = grupo[self.destino]
+        distintos = a != b
+        a, b = np.minimum(a, b)[distintos], np.maximum(a, b)[distintos]
+        pares, inversa, conexiones = np.unique(a * total + b, return_inverse=True, return_counts=True)
+        bloqueadas = np.bincount(inversa, weights=self.bloqueada[distintos], minlength=len(pares))
+
+        agrupacion = {
+            "grupos": {"lat": lat, "lng": lng, "cantidad": cantidad, "nodo": nodo, "obstaculos": obstaculos},
+            "conexiones": {"a": pares // total, "b": pares % total, "cantidad": conexiones,
+                           "bloqueadas": bloqueadas.astype(np.int64)},
+        }
+        with self._lock:
+            self._agrupaciones[zoom] = agrupacion
+        return agrupacion
+
+    def vista(self, zoom, limites=None):
+        """The network to draw at ``zoom`` within ``limites`` ``(sur, oeste, norte, este)``, JSON-ready.
+
+        ``detalle`` tells whether the nodes were left unclustered. Groups
+        are renumbered to positions in the returned lists; ``nodo`` stays a
+        position in /api/topologia.
+        """
+        if limites is not None:
+            sur, oeste, norte, este = limites
+            visibles = ((self.lat >= sur) & (self.lat <= norte) &
+                        (self.lng >= oeste) & (self.lng <= este))
+            detalle = zoom >= ZOOM_DETALLE or np.count_nonzero(visibles) <= MAX_NODOS_DETALLE
+        else:
+            detalle = zoom >= ZOOM_DETALLE or self.num_nodos <= MAX_NODOS_DETALLE
+        agrupacion = self.agrupacion(None if detalle else zoom)
+        grupos = agrupacion["grupos"]
+        conexiones = agrupacion["conexiones"]
+
+        if limites is not None:
+            dentro = ((grupos["lat"] >= sur) & (grupos["lat"] <= norte) &
+                      (grupos["lng"] >= oeste) & (grupos["lng"] <= este))
+            # Connections leaving the area are kept, with their outer end
+            seleccion = dentro[conexiones["a"]] | dentro[conexiones["b"]]
+            incluidos = dentro.copy()
+            incluidos[conexiones["a"][seleccion]] = True
+            incluidos[conexiones["b"][seleccion]] = True
+        else:
+            seleccion = np.ones(len(conexiones["a"]), dtype=bool)
+            incluidos = np.ones(len(grupos["lat"]), dtype=bool)
+        posicion = np.cumsum(incluidos) - 1
+
+        return {
+            "zoom": zoom,
+            "detalle": bool(detalle),
+            "grupos": {
+                "lat": np.round(grupos["lat"][incluidos], 6).tolist(),
+                "lng": np.round(grupos["lng"][incluidos], 6).tolist(),
+                "cantidad": grupos["cantidad"][incluidos].tolist(),
+                "nodo": grupos["nodo"][incluidos].tolist(),
+                "obstaculos": grupos["obstaculos"][incluidos].tolist(),
+            },
+            "conexiones": {
+                "a": posicion[conexiones["a"][seleccion]].tolist(),
+                "b": posicion[conexiones["b"][seleccion]].tolist(),
+                "cantidad": conexiones["cantidad"][seleccion].tolist(),
+                "bloqueadas": conexiones["bloqueadas"][seleccion].tolist(),
+            },
+        }
@@ -5,6 +5,17 @@ let routesLayer;
 let connectionLayer;
 let loadingModal;
 
+// Network topology from /api/topologia: node and edge columns, plus an
+// id -> {lat, lng} map. Routes from /procesar refer to nodes by position.
+let topologia = null;
+
+// Networks with more nodes than this are drawn from /api/topologia/vista:
+// clustered by the server for the current zoom and cut to the visible area
+const MAX_NODOS_DIBUJO_COMPLETO = 5000;
+
+// Pending /api/topologia/vista request, aborted when the map moves again
+let peticionVista = null;
+
 // Initialize the map when the page loads
 document.addEventListener('DOMContentLoaded', function() {
     initializeMap();
@@ -16,8 +27,9 @@ document.addEventListener('DOMContentLoaded', function() {
 
 function initializeMap() {
     console.log("Initializing map");
-    // Initialize the map centered on Arequipa, Peru
-    map = L.map('map').setView([-16.4090, -71.5375], 12);
+    // Initialize the map centered on Arequipa, Peru; vector layers are
+    // drawn on one shared canvas instead of an SVG element each
+    map = L.map('map', { preferCanvas: true }).setView([-16.4090, -71.5375], 12);
     
     // Add OpenStreetMap tiles
     L.tileLayer('https://tile.openstreetmap.org/{z}/{x}/{y}.png', {
@@ -29,6 +41,9 @@ function initializeMap() {
     connectionLayer = L.layerGroup().addTo(map);
     routesLayer = L.layerGroup().addTo(map);
     
+    // Large networks are redrawn for every zoom level and visible area
+    map.on('moveend', actualizarVista);
+    
     // Hide loading overlay once map is ready
     map.whenReady(function() {
         document.getElementById('map-loading').style.display = 'none';
@@ -61,6 +76,12 @@ function verificarEstado() {
                         <div>🔗 Conexiones: ${data.data_summary.aristas}</div>
                     </div>
                 `;
+            } else if (data.status === 'cargando') {
+                // The server is still loading the network in the background
+                estadoElement.innerHTML = `
+                    <span class="badge bg-info">Cargando red...</span>
+                `;
+                setTimeout(verificarEstado, 2000);
             } else {
                 estadoElement.innerHTML = `
                     <span class="badge bg-danger">Error del Sistema</span>
@@ -86,12 +107,21 @@ function procesar() {
     btnProcesar.innerHTML = '<i class="fas fa-spinner fa-spin me-1"></i>Procesando...';
     loadingModal.show();
     
-    // Clear previous results
-    markersLayer.clearLayers();
+    // Clear previous results (the network stays drawn while its version is unchanged)
     routesLayer.clearLayers();
     resultadosDiv.innerHTML = '<p class="text-muted small">Procesando datos...</p>';
     
-    fetch('/procesar', {
+    // State accumulated while the NDJSON stream arrives; anterior maps a
+    // node position to the previous one on its route, to decode the deltas
+    const estado = {
+        fuente: null,
+        anterior: new Map(),
+        rutas: {},
+        flujos: {},
+        rutasDibujadas: 0
+    };
+    
+    fetch('/procesar?stream=1', {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json'
@@ -101,23 +131,13 @@ function procesar() {
         if (!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
-        return response.json();
+        return leerNDJSON(response, mensaje => procesarMensaje(mensaje, estado));
     })
-    .then(data => {
-        console.log('Processing successful:', data);
-        
-        if (data.error) {
-            throw new Error(data.error);
-        }
-        
-        // Visualize nodes on the map
-        visualizarNodos(data.nodos);
-        
-        // Visualize edges on the map
-        visualizarAristas(data.nodos, data.aristas);
+    .then(() => {
+        console.log('Processing successful:', estado);
         
-        // Display results in sidebar
-        mostrarResultados(data.rutas_optimas, data.flujos_maximos, data.fuente);
+        // Display results in sidebar (routes are already on the map)
+        mostrarResultados(estado.rutas, estado.flujos, estado.fuente, false);
         
         // Hide loading modal
         loadingModal.hide();
@@ -141,125 +161,299 @@ function procesar() {
     });
 }
 
-function visualizarNodos(nodos) {
-    nodos.forEach(nodo => {
-        const pos = nodo.pos || [nodo.latitud, nodo.longitud];
-        
-        // Determine marker color and icon based on node type
-        let color, icon, className;
-        
-        switch(nodo.tipo) {
-            case 'embalse':
-                color = '#198754'; // Bootstrap success
-                icon = '🏛️';
-                className = 'marker-embalse';
-                break;
-            case 'punto_critico':
-                color = '#fd7e14'; // Bootstrap warning
-                icon = '⚠️';
-                className = 'marker-critico';
-                break;
-            default:
-                if (nodo.estado === 'obstaculo' || nodo.estado === 'bloqueado') {
-                    color = '#dc3545'; // Bootstrap danger
-                    icon = '🚫';
-                    className = 'marker-obstaculo';
-                } else {
-                    color = '#0dcaf0'; // Bootstrap info
-                    icon = '🔵';
-                    className = 'marker-normal';
-                }
+// Read a newline-delimited JSON response, calling (and awaiting) alRecibir for every line
+async function leerNDJSON(response, alRecibir) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) {
+            break;
         }
-        
-        // Create custom marker
-        const marker = L.circleMarker([pos[0], pos[1]], {
-            radius: nodo.tipo === 'embalse' ? 10 : 6,
+        buffer += decoder.decode(value, { stream: true });
+        const lineas = buffer.split('\n');
+        buffer = lineas.pop();
+        for (const linea of lineas) {
+            if (linea.trim()) {
+                await alRecibir(JSON.parse(linea));
+            }
+        }
+    }
+    
+    if (buffer.trim()) {
+        await alRecibir(JSON.parse(buffer));
+    }
+}
+
+// Download the network topology and draw its nodes and edges. The response
+// carries the network version as ETag, so the browser revalidates it and
+// only downloads it again when the network changed.
+async function cargarTopologia() {
+    const response = await fetch('/api/topologia');
+    if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+    }
+    const datos = await response.json();
+    if (topologia && topologia.version === datos.version) {
+        return;
+    }
+    
+    const nodos = datos.nodos;
+    datos.coordenadas = new Map();
+    nodos.id.forEach((id, i) => datos.coordenadas.set(id, { lat: nodos.lat[i], lng: nodos.lng[i] }));
+    topologia = datos;
+    dibujarRed();
+}
+
+// Draw the network: all of it when it is small, otherwise the simplified
+// view of the visible area
+function dibujarRed() {
+    const nodos = topologia.nodos;
+    if (nodos.id.length > MAX_NODOS_DIBUJO_COMPLETO) {
+        actualizarVista();
+        return;
+    }
+    
+    visualizarNodos(nodos.id.map((id, i) => i));
+    
+    const aristas = topologia.aristas;
+    const bloqueado = topologia.estados.map(estado => estado === 'bloqueado');
+    const normales = [];
+    const bloqueadas = [];
+    const dibujadas = new Set();
+    aristas.origen.forEach((origen, j) => {
+        const destino = aristas.destino[j];
+        const segmento = [[nodos.lat[origen], nodos.lng[origen]], [nodos.lat[destino], nodos.lng[destino]]];
+        if (bloqueado[aristas.estado[j]]) {
+            bloqueadas.push(segmento);
+            return;
+        }
+        // Pipes are listed both ways; draw each once
+        const clave = origen < destino ? `${origen},${destino}` : `${destino},${origen}`;
+        if (!dibujadas.has(clave)) {
+            dibujadas.add(clave);
+            normales.push(segmento);
+        }
+    });
+    visualizarAristas(normales, bloqueadas);
+}
+
+// Fetch and draw the simplified network for the current zoom and visible
+// area (large networks only)
+async function actualizarVista() {
+    if (!topologia || topologia.nodos.id.length <= MAX_NODOS_DIBUJO_COMPLETO) {
+        return;
+    }
+    if (peticionVista) {
+        peticionVista.abort();
+    }
+    peticionVista = new AbortController();
+    
+    // A margin around the visible area keeps short pans from showing gaps
+    const limites = map.getBounds().pad(0.25);
+    const bbox = [limites.getSouth(), limites.getWest(), limites.getNorth(), limites.getEast()]
+        .map(valor => valor.toFixed(5)).join(',');
+    try {
+        const response = await fetch(`/api/topologia/vista?zoom=${map.getZoom()}&bbox=${bbox}`,
+                                     { signal: peticionVista.signal });
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const vista = await response.json();
+        if (vista.version !== topologia.version) {
+            // Node positions refer to another topology: reload it (it draws again)
+            await cargarTopologia();
+            return;
+        }
+        dibujarVista(vista);
+    } catch (error) {
+        if (error.name !== 'AbortError') {
+            console.error('Error loading the network view:', error);
+        }
+    }
+}
+
+// Draw a /api/topologia/vista response: single nodes as usual, clusters as
+// circles sized by their node count that zoom in when clicked
+function dibujarVista(vista) {
+    const grupos = vista.grupos;
+    markersLayer.clearLayers();
+    grupos.cantidad.forEach((cantidad, g) => {
+        if (cantidad === 1) {
+            markersLayer.addLayer(marcadorNodo(grupos.nodo[g]));
+            return;
+        }
+        const obstaculos = grupos.obstaculos[g];
+        const color = obstaculos === cantidad ? '#dc3545' : '#0dcaf0';
+        const marker = L.circleMarker([grupos.lat[g], grupos.lng[g]], {
+            radius: Math.min(6 + 4 * Math.log10(cantidad), 18),
             color: color,
             fillColor: color,
-            fillOpacity: 0.8,
-            weight: 2,
-            className: className,
-            title: nodo.id,
-            nodeId: nodo.id
+            fillOpacity: 0.5,
+            weight: 1
         });
-        
-        // Create popup content
+        marker.bindTooltip(`${formatNumber(cantidad)} nodos` + (obstaculos ? ` (${obstaculos} obstáculos)` : ''));
+        marker.on('click', () => map.setView(marker.getLatLng(), Math.min(map.getZoom() + 2, map.getMaxZoom())));
+        markersLayer.addLayer(marker);
+    });
+    
+    const conexiones = vista.conexiones;
+    const normales = [];
+    const bloqueadas = [];
+    conexiones.a.forEach((a, k) => {
+        const b = conexiones.b[k];
+        const segmento = [[grupos.lat[a], grupos.lng[a]], [grupos.lat[b], grupos.lng[b]]];
+        (conexiones.bloqueadas[k] === conexiones.cantidad[k] ? bloqueadas : normales).push(segmento);
+    });
+    visualizarAristas(normales, bloqueadas);
+    console.log(`Visualized ${grupos.cantidad.length} groups at zoom ${vista.zoom} (detalle: ${vista.detalle})`);
+}
+
+// Decode a delta-encoded route line: positions after padre (-1: none)
+// extend the routes already received; null means no route
+function decodificarRuta(mensaje, anterior) {
+    if (mensaje.padre === null) {
+        return null;
+    }
+    let previo = mensaje.padre;
+    for (const nodo of mensaje.nuevos) {
+        anterior.set(nodo, previo);
+        previo = nodo;
+    }
+    const ruta = [];
+    for (let nodo = mensaje.destino; nodo !== -1 && nodo !== undefined; nodo = anterior.get(nodo)) {
+        ruta.push(topologia.nodos.id[nodo]);
+    }
+    return ruta.reverse();
+}
+
+// Handle one message of the /procesar stream, drawing as data arrives
+async function procesarMensaje(mensaje, estado) {
+    const resultadosDiv = document.getElementById('resultados');
+    
+    switch (mensaje.tipo) {
+        case 'inicio':
+            estado.fuente = mensaje.fuente;
+            // Routes refer to this version of the topology
+            if (!topologia || topologia.version !== mensaje.version_red) {
+                await cargarTopologia();
+                if (topologia.version !== mensaje.version_red) {
+                    throw new Error('La red cambió durante el procesamiento; vuelva a procesar');
+                }
+            }
+            // Let the user watch the map being drawn
+            loadingModal.hide();
+            break;
+        case 'ruta': {
+            const destino = topologia.nodos.id[mensaje.destino];
+            const ruta = decodificarRuta(mensaje, estado.anterior);
+            estado.rutas[destino] = ruta;
+            estado.flujos[destino] = mensaje.flujo;
+            if (dibujarRuta(destino, ruta, mensaje.flujo, estado.rutasDibujadas, topologia.coordenadas)) {
+                estado.rutasDibujadas++;
+            }
+            resultadosDiv.innerHTML = `<p class="text-muted small">Rutas calculadas: ${Object.keys(estado.rutas).length}</p>`;
+            break;
+        }
+        case 'fin':
+            console.log(`Processing finished in ${mensaje.tiempo_procesamiento_ms} ms (cached: ${mensaje.cached})`);
+            break;
+        case 'error':
+            throw new Error(mensaje.error);
+    }
+}
+
+// Colour, icon and radius of a node marker
+function estiloNodo(tipo, estado) {
+    switch (tipo) {
+        case 'embalse':
+            return { color: '#198754', icon: '🏛️', radius: 10 }; // Bootstrap success
+        case 'punto_critico':
+            return { color: '#fd7e14', icon: '⚠️', radius: 6 }; // Bootstrap warning
+        default:
+            if (estado === 'obstaculo' || estado === 'bloqueado') {
+                return { color: '#dc3545', icon: '🚫', radius: 6 }; // Bootstrap danger
+            }
+            return { color: '#0dcaf0', icon: '🔵', radius: 6 }; // Bootstrap info
+    }
+}
+
+// Marker of the topology node at position i; its popup is built when opened
+function marcadorNodo(i) {
+    const nodos = topologia.nodos;
+    const tipo = topologia.tipos[nodos.tipo[i]];
+    const estado = topologia.estados[nodos.estado[i]];
+    const estilo = estiloNodo(tipo, estado);
+    
+    const marker = L.circleMarker([nodos.lat[i], nodos.lng[i]], {
+        radius: estilo.radius,
+        color: estilo.color,
+        fillColor: estilo.color,
+        fillOpacity: 0.8,
+        weight: 2
+    });
+    
+    marker.bindPopup(() => {
         let popupContent = `
             <div class="p-2">
-                <h6 class="mb-2">${icon} ${nodo.id}</h6>
+                <h6 class="mb-2">${estilo.icon} ${nodos.id[i]}</h6>
                 <div class="small">
-                    <div><strong>Tipo:</strong> ${nodo.tipo}</div>
-                    <div><strong>Estado:</strong> ${nodo.estado || 'transitable'}</div>
+                    <div><strong>Tipo:</strong> ${tipo}</div>
+                    <div><strong>Estado:</strong> ${estado || 'transitable'}</div>
         `;
         
-        if (nodo.capacidad) {
-            popupContent += `<div><strong>Capacidad:</strong> ${nodo.capacidad.toLocaleString()} m³</div>`;
+        if (nodos.capacidad[i]) {
+            popupContent += `<div><strong>Capacidad:</strong> ${nodos.capacidad[i].toLocaleString()} m³</div>`;
         }
         
-        if (nodo.subtipo) {
-            popupContent += `<div><strong>Subtipo:</strong> ${nodo.subtipo}</div>`;
+        if (nodos.subtipo[i]) {
+            popupContent += `<div><strong>Subtipo:</strong> ${nodos.subtipo[i]}</div>`;
         }
         
         popupContent += `
-                    <div><strong>Coordenadas:</strong> ${pos[0].toFixed(4)}, ${pos[1].toFixed(4)}</div>
+                    <div><strong>Coordenadas:</strong> ${nodos.lat[i].toFixed(4)}, ${nodos.lng[i].toFixed(4)}</div>
                 </div>
             </div>
         `;
-        
-        marker.bindPopup(popupContent);
-        markersLayer.addLayer(marker);
+        return popupContent;
     });
-    
-    console.log(`Visualized ${nodos.length} nodes on the map`);
+    return marker;
 }
 
-function visualizarAristas(nodos, aristas) {
-    // Limpiar conexiones anteriores
+// Draw the topology nodes at the given positions
+function visualizarNodos(indices) {
+    markersLayer.clearLayers();
+    indices.forEach(i => markersLayer.addLayer(marcadorNodo(i)));
+    console.log(`Visualized ${indices.length} nodes on the map`);
+}
+
+// Draw pipes as two layers, each a single multi-segment polyline: the
+// normal ones and the blocked ones (dashed). Segments are [[lat, lng], [lat, lng]].
+function visualizarAristas(normales, bloqueadas) {
     connectionLayer.clearLayers();
-    
-    aristas.forEach(arista => {
-        const nodoOrigen = nodos.find(n => n.id === arista.origen);
-        const nodoDestino = nodos.find(n => n.id === arista.destino);
-        
-        if (nodoOrigen && nodoDestino) {
-            const posOrigen = nodoOrigen.pos || [nodoOrigen.latitud, nodoOrigen.longitud];
-            const posDestino = nodoDestino.pos || [nodoDestino.latitud, nodoDestino.longitud];
-            
-            // Determine line color based on edge status
-            const color = arista.estado === 'bloqueado' ? '#dc3545' : '#6c757d';
-            const weight = arista.estado === 'bloqueado' ? 3 : 2;
-            const opacity = arista.estado === 'bloqueado' ? 0.8 : 0.5;
-            
-            const polyline = L.polyline([posOrigen, posDestino], {
-                color: color,
-                weight: weight,
-                opacity: opacity,
-                dashArray: arista.estado === 'bloqueado' ? '10, 5' : null
-            });
-            
-            // Popup for edge information
-            const popupContent = `
-                <div class="p-2">
-                    <h6 class="mb-2">🔗 Conexión</h6>
-                    <div class="small">
-                        <div><strong>Origen:</strong> ${arista.origen}</div>
-                        <div><strong>Destino:</strong> ${arista.destino}</div>
-                        <div><strong>Distancia:</strong> ${arista.distancia?.toFixed(2) || 'N/A'} km</div>
-                        <div><strong>Estado:</strong> ${arista.estado}</div>
-                        <div><strong>Capacidad:</strong> ${arista.capacidad || 'N/A'}</div>
-                    </div>
-                </div>
-            `;
-            
-            polyline.bindPopup(popupContent);
-            connectionLayer.addLayer(polyline);
-        }
-    });
-    
-    console.log(`Visualized ${aristas.length} connections on the map`);
+    if (normales.length > 0) {
+        L.polyline(normales, {
+            color: '#6c757d',
+            weight: 2,
+            opacity: 0.5,
+            interactive: false
+        }).addTo(connectionLayer);
+    }
+    if (bloqueadas.length > 0) {
+        L.polyline(bloqueadas, {
+            color: '#dc3545',
+            weight: 3,
+            opacity: 0.8,
+            dashArray: '10, 5',
+            interactive: false
+        }).addTo(connectionLayer);
+    }
+    console.log(`Visualized ${normales.length + bloqueadas.length} connections on the map`);
 }
 
-function mostrarResultados(rutas, flujos, fuente) {
+function mostrarResultados(rutas, flujos, fuente, dibujarRutas = true) {
     const resultadosDiv = document.getElementById('resultados');
     
     let html = `
@@ -333,88 +527,66 @@ function mostrarResultados(rutas, flujos, fuente) {
     resultadosDiv.innerHTML = html;
     
     // Visualizar rutas en el mapa
-    visualizarRutasEnMapa(rutas, flujos);
+    if (dibujarRutas) {
+        visualizarRutasEnMapa(rutas, flujos);
+    }
 }
 
+// Colores para diferentes rutas
+const COLORES_RUTAS = ['#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4', '#FFEAA7', '#DDA0DD'];
+
 function visualizarRutasEnMapa(rutas, flujos) {
     // Limpiar rutas anteriores
     routesLayer.clearLayers();
     
-    // Colores para diferentes rutas
-    const colores = ['#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4', '#FFEAA7', '#DDA0DD'];
     let colorIndex = 0;
     
-    // Obtener las coordenadas de todos los nodos del mapa
-    const nodos = obtenerCoordenadasNodos();
-    
     for (const [destino, ruta] of Object.entries(rutas)) {
-        if (ruta && ruta.length > 1) {
-            const color = colores[colorIndex % colores.length];
-            const flujo = flujos[destino] || 0;
-            
-            // Crear la línea de la ruta
-            const coordenadas = [];
-            for (const nodo of ruta) {
-                if (nodos[nodo]) {
-                    coordenadas.push([nodos[nodo].lat, nodos[nodo].lng]);
-                }
-            }
-            
-            if (coordenadas.length > 1) {
-                const polyline = L.polyline(coordenadas, {
-                    color: color,
-                    weight: Math.max(3, Math.min(8, flujo / 200)), // Grosor basado en flujo
-                    opacity: 0.8,
-                    dashArray: flujo === 0 ? '5, 5' : null // Línea punteada si no hay flujo
-                }).addTo(routesLayer);
-                
-                // Agregar popup con información de la ruta
-                polyline.bindPopup(`
-                    <div class="route-popup">
-                        <h6 class="mb-2">${destino}</h6>
-                        <p class="small mb-1"><strong>Ruta:</strong> ${ruta.join(' → ')}</p>
-                        <p class="small mb-0"><strong>Flujo máximo:</strong> ${formatNumber(flujo)} unidades/h</p>
-                    </div>
-                `);
-                
-                colorIndex++;
-            }
+        if (dibujarRuta(destino, ruta, flujos[destino] || 0, colorIndex, topologia.coordenadas)) {
+            colorIndex++;
         }
     }
 }
 
-function obtenerCoordenadasNodos() {
-    const nodos = {};
-    
-    // Obtener coordenadas de los marcadores en el mapa
-    markersLayer.eachLayer(function(layer) {
-        if (layer.options && layer.options.nodeId) {
-            const nombre = layer.options.nodeId;
-            nodos[nombre] = {
-                lat: layer.getLatLng().lat,
-                lng: layer.getLatLng().lng
-            };
-        } else if (layer.options && layer.options.title) {
-            const nombre = layer.options.title;
-            nodos[nombre] = {
-                lat: layer.getLatLng().lat,
-                lng: layer.getLatLng().lng
-            };
-        } else if (layer._popup && layer._popup._content) {
-            // Extraer nombre del popup si está disponible
-            const content = layer._popup._content;
-            const match = content.match(/<h6[^>]*>([^<]+)<\/h6>/);
-            if (match) {
-                const nombre = match[1].replace(/[🏛️⚠️🔵🚫]/g, '').trim();
-                nodos[nombre] = {
-                    lat: layer.getLatLng().lat,
-                    lng: layer.getLatLng().lng
-                };
-            }
+// Draw a single route (nodos: Map of id -> {lat, lng}); returns true when something was drawn
+function dibujarRuta(destino, ruta, flujo, colorIndex, nodos) {
+    if (!ruta || ruta.length <= 1) {
+        return false;
+    }
+    
+    const color = COLORES_RUTAS[colorIndex % COLORES_RUTAS.length];
+    flujo = flujo || 0;
+    
+    // Crear la línea de la ruta
+    const coordenadas = [];
+    for (const nodo of ruta) {
+        const coord = nodos.get(nodo);
+        if (coord) {
+            coordenadas.push([coord.lat, coord.lng]);
         }
-    });
+    }
+    
+    if (coordenadas.length <= 1) {
+        return false;
+    }
+    
+    const polyline = L.polyline(coordenadas, {
+        color: color,
+        weight: Math.max(3, Math.min(8, flujo / 200)), // Grosor basado en flujo
+        opacity: 0.8,
+        dashArray: flujo === 0 ? '5, 5' : null // Línea punteada si no hay flujo
+    }).addTo(routesLayer);
+    
+    // Agregar popup con información de la ruta
+    polyline.bindPopup(`
+        <div class="route-popup">
+            <h6 class="mb-2">${destino}</h6>
+            <p class="small mb-1"><strong>Ruta:</strong> ${ruta.join(' → ')}</p>
+            <p class="small mb-0"><strong>Flujo máximo:</strong> ${formatNumber(flujo)} unidades/h</p>
+        </div>
+    `);
     
-    return nodos;
+    return true;
 }
 
 function inicializarFormularioNodo() {
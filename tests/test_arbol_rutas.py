@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import grafo_agua
+from grafo_agua import RedCargada
+
+LADO = 12
+EMBALSES = ['Embalse_0', 'Embalse_1']
+
+
+def tablas_aleatorias(semilla, reservados=10):
+    """Grid-like network around Arequipa; ``reservados`` nodes are left out of the node table.
+
+    Their edges are already in the edge table, as when a node is registered
+    after the pipes that reach it.
+    """
+    rng = np.random.default_rng(semilla)
+    n = LADO * LADO
+    fila, columna = np.divmod(np.arange(n), LADO)
+    nodos = pd.DataFrame({
+        'id_nodo': [f'N{i:04d}' for i in range(n)],
+        'latitud': -16.45 + fila * 0.004 + rng.normal(0, 0.0005, n),
+        'longitud': -71.56 + columna * 0.004 + rng.normal(0, 0.0005, n),
+        'tipo': 'tubo',
+        'estado': np.where(rng.random(n) < 0.05, 'obstaculo', 'transitable'),
+    })
+    embalses = pd.DataFrame({
+        'Nombre': EMBALSES,
+        'Latitud': [-16.452, -16.45 + LADO * 0.004],
+        'Longitud': [-71.562, -71.56 + LADO * 0.004],
+        'Volumen_Almacenado_m3': [1000000, 500000],
+    })
+    puntos = pd.DataFrame({
+        'nombre': ['PC_0'],
+        'latitud': [-16.45 + rng.uniform(0, LADO * 0.004)],
+        'longitud': [-71.56 + rng.uniform(0, LADO * 0.004)],
+        'tipo': ['obra'],
+    })
+
+    pares = [(i, i + 1) for i in range(n) if (i + 1) % LADO] + [(i, i + LADO) for i in range(n - LADO)]
+    filas = []
+    for u, v in pares:
+        distancia = rng.uniform(0.3, 0.6)
+        capacidad = int(rng.integers(100, 1000))
+        estado = 'bloqueado' if rng.random() < 0.05 else 'transitable'
+        filas.append((f'N{u:04d}', f'N{v:04d}', distancia, estado, capacidad))
+        filas.append((f'N{v:04d}', f'N{u:04d}', distancia, estado, capacidad))
+    for embalse, nodo in zip(EMBALSES, ('N0000', f'N{n - 1:04d}')):
+        filas.append((embalse, nodo, 0.1, 'transitable', 5000))
+        filas.append((nodo, embalse, 0.1, 'transitable', 5000))
+    aristas = pd.DataFrame(filas, columns=['origen', 'destino', 'distancia', 'estado', 'capacidad'])
+
+    reservados = rng.choice(np.arange(1, n - 1), size=reservados, replace=False)
+    pendientes = nodos.iloc[np.sort(reservados)].to_dict('records')
+    nodos = nodos.drop(nodos.index[reservados]).reset_index(drop=True)
+    return (embalses, puntos, nodos, aristas), pendientes
+
+
+def distancias_por_nombre(arbol):
+    nombres = arbol.grafo.nombres
+    return {nombres[i]: d for i, d in enumerate(arbol.distancia_nodo.tolist()) if np.isfinite(d)}
+
+
+def comprobar_como_nuevo(red, fuente):
+    """The repaired tree of ``red`` must match a tree built from scratch on the same data."""
+    reparado = red.arbol_rutas(fuente)
+    fresca = RedCargada('huella', 'version', red.embalses, red.puntos, red.nodos, red.aristas)
+    nuevo = fresca.arbol_rutas(fuente)
+
+    esperadas = distancias_por_nombre(nuevo)
+    obtenidas = distancias_por_nombre(reparado)
+    assert obtenidas.keys() == esperadas.keys()
+    for nombre, distancia in esperadas.items():
+        assert obtenidas[nombre] == pytest.approx(distancia, rel=1e-6)
+
+    # Every route of the repaired tree uses pipes in service and adds up to its distance
+    grafo = fresca.grafo
+    for nombre in obtenidas:
+        ruta = reparado.ruta(nombre)
+        total = 0.0
+        for u, v in zip(ruta, ruta[1:]):
+            i, j = grafo.indice[u], grafo.indice[v]
+            posiciones = np.arange(grafo.indptr[i], grafo.indptr[i + 1])
+            aristas = posiciones[(grafo.indices[posiciones] == j) & grafo.activa[posiciones]]
+            assert len(aristas) == 1, f"{u}->{v} is not in service"
+            total += float(grafo.peso[aristas[0]])
+        assert total == pytest.approx(obtenidas[nombre], rel=1e-5, abs=1e-6)
+
+
+@pytest.mark.parametrize("radio_km", [0, 0.5])
+@pytest.mark.parametrize("semilla", range(4))
+def test_arbol_reparado_coincide_con_uno_nuevo(monkeypatch, radio_km, semilla):
+    monkeypatch.setattr(grafo_agua, 'RADIO_PUNTO_CRITICO_KM', radio_km)
+    tablas, pendientes = tablas_aleatorias(semilla)
+    red = RedCargada('huella', 'version', *tablas)
+    fuentes = [EMBALSES[0], EMBALSES]
+    for fuente in fuentes:
+        red.arbol_rutas(fuente)
+
+    rng = np.random.default_rng(100 + semilla)
+    operaciones = ['punto'] * 4 + ['nodos'] * 3
+    rng.shuffle(operaciones)
+    for k, operacion in enumerate(operaciones):
+        if operacion == 'punto':
+            red.agregar_punto_critico({
+                'nombre': f'PC_nuevo_{k}',
+                'latitud': -16.45 + rng.uniform(0, LADO * 0.004),
+                'longitud': -71.56 + rng.uniform(0, LADO * 0.004),
+                'tipo': 'obra',
+            })
+        else:
+            lote, pendientes = pendientes[:3], pendientes[3:]
+            red.agregar_nodos(lote)
+        for fuente in fuentes:
+            comprobar_como_nuevo(red, fuente)
+
+
+def test_copia_no_cambia_con_las_reparaciones(monkeypatch):
+    monkeypatch.setattr(grafo_agua, 'RADIO_PUNTO_CRITICO_KM', 0.5)
+    tablas, pendientes = tablas_aleatorias(7)
+    red = RedCargada('huella', 'version', *tablas)
+    arbol = red.arbol_rutas(EMBALSES[0])
+    copia = arbol.copia()
+    padre, distancia = copia.padre.copy(), copia.distancia_nodo.copy()
+
+    red.agregar_nodos(pendientes)
+    grafo = red.grafo
+    centro = grafo.indice['N0078']
+    red.agregar_punto_critico({'nombre': 'PC_centro', 'latitud': float(grafo.latitud[centro]),
+                               'longitud': float(grafo.longitud[centro]), 'tipo': 'obra'})
+
+    assert not np.array_equal(arbol.distancia_nodo[:len(distancia)], distancia)
+    np.testing.assert_array_equal(copia.padre, padre)
+    np.testing.assert_array_equal(copia.distancia_nodo, distancia)
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from distancias import cerca_de_puntos, distancia_km
+
+
+def cerca_fuerza_bruta(latitudes, longitudes, puntos_lat, puntos_lon, radio_km):
+    cerca = np.zeros(len(latitudes), dtype=bool)
+    for plat, plon in zip(puntos_lat, puntos_lon):
+        cerca |= distancia_km(latitudes, longitudes, plat, plon) < radio_km
+    return cerca
+
+
+@pytest.mark.parametrize("radio_km", [0.05, 0.5, 5.0, 80.0])
+def test_cerca_de_puntos_coincide_con_la_distancia_exacta(radio_km):
+    rng = np.random.default_rng(0)
+    n = 20000
+    latitudes = rng.uniform(-16.5, -16.3, n)
+    longitudes = rng.uniform(-71.65, -71.45, n)
+    # Some coordinates in another city, beyond the flat-earth range
+    latitudes[:200] = rng.uniform(-12.1, -11.9, 200)
+    longitudes[:200] = rng.uniform(-77.1, -76.9, 200)
+    puntos_lat = rng.uniform(-16.5, -16.3, 6)
+    puntos_lon = rng.uniform(-71.65, -71.45, 6)
+
+    esperado = cerca_fuerza_bruta(latitudes, longitudes, puntos_lat, puntos_lon, radio_km)
+    obtenido = cerca_de_puntos(latitudes, longitudes, puntos_lat, puntos_lon, radio_km)
+    np.testing.assert_array_equal(obtenido, esperado)
+    assert esperado.any()
+
+
+def test_cerca_de_puntos_cruza_el_antimeridiano():
+    latitudes = np.array([-16.4, -16.4, -16.4])
+    longitudes = np.array([179.999, -179.999, 170.0])
+    cerca = cerca_de_puntos(latitudes, longitudes, [-16.4], [180.0], 0.5)
+    assert cerca.tolist() == [True, True, False]
+
+
+def test_cerca_de_puntos_sin_radio_o_sin_puntos():
+    latitudes = np.array([-16.4, -16.41])
+    longitudes = np.array([-71.5, -71.5])
+    assert not cerca_de_puntos(latitudes, longitudes, [-16.4], [-71.5], 0).any()
+    assert not cerca_de_puntos(latitudes, longitudes, [], [], 0.5).any()
@@ -0,0 +1,124 @@
+import random
+
+import networkx as nx
+import pytest
+
+from flujo_maximo import SUPERFUENTE, RedFlujo
+from grafo_csr import GrafoCSR
+
+
+def red_simetrica(n, m, semilla):
+    """Random pipe network where every pipe carries the same capacity both ways."""
+    rng = random.Random(semilla)
+    base = nx.gnm_random_graph(n, m, seed=semilla)
+    G = nx.DiGraph()
+    G.add_nodes_from(base.nodes)
+    for u, v in base.edges:
+        capacidad = rng.randint(1, 20)
+        G.add_edge(u, v, capacidad=capacidad)
+        G.add_edge(v, u, capacidad=capacidad)
+    return G
+
+
+def red_dirigida(n, m, semilla):
+    """Random network of one-directional pipes."""
+    rng = random.Random(semilla)
+    G = nx.gnm_random_graph(n, m, seed=semilla, directed=True)
+    for u, v in G.edges:
+        G.edges[u, v]['capacidad'] = rng.randint(1, 20)
+    return G
+
+
+def flujo_networkx(G, fuente, destino):
+    if fuente == destino:
+        return 0
+    return nx.maximum_flow_value(G, fuente, destino, capacity='capacidad')
+
+
+@pytest.mark.parametrize("semilla", range(5))
+def test_dinic_coincide_con_networkx_en_redes_dirigidas(semilla):
+    G = red_dirigida(12, 40, semilla)
+    red = RedFlujo(G)
+    assert not red.simetrica
+    for fuente in range(0, 12, 3):
+        for destino in G.nodes:
+            assert red.flujo_maximo(fuente, destino) == flujo_networkx(G, fuente, destino)
+
+
+@pytest.mark.parametrize("semilla", range(5))
+def test_dinic_coincide_con_networkx_en_redes_simetricas(semilla):
+    G = red_simetrica(12, 20, semilla)
+    red = RedFlujo(G)
+    assert red.simetrica
+    for fuente in range(0, 12, 4):
+        for destino in G.nodes:
+            assert red.flujo_maximo(fuente, destino) == flujo_networkx(G, fuente, destino)
+
+
+@pytest.mark.parametrize("semilla", range(5))
+def test_arbol_gomory_hu_da_el_flujo_de_cada_par(semilla):
+    G = red_simetrica(14, 24, semilla)
+    red = RedFlujo(G)
+    destinos = list(G.nodes)
+    for fuente in G.nodes:
+        # Asking for every node makes iterar_flujos_desde use the tree
+        flujos = red.flujos_desde(fuente, destinos)
+        assert red._arbol is not None
+        for destino in destinos:
+            assert flujos[destino] == flujo_networkx(G, fuente, destino)
+
+
+def test_arbol_gomory_hu_exige_capacidades_simetricas():
+    red = RedFlujo(red_dirigida(6, 12, 0))
+    with pytest.raises(ValueError):
+        red.arbol_gomory_hu()
+
+
+@pytest.mark.parametrize("semilla", range(3))
+def test_flujos_por_dinic_en_orden_y_con_destinos_inalcanzables(semilla):
+    G = red_dirigida(15, 25, semilla)
+    G.add_node('aislado')
+    red = RedFlujo(G)
+    destinos = ['aislado', 'desconocido', 0] + list(range(14, 0, -1))
+    resultado = list(red.iterar_flujos_desde(0, destinos))
+    assert [destino for destino, _ in resultado] == destinos
+    for destino, flujo in resultado:
+        esperado = flujo_networkx(G, 0, destino) if destino in G and destino != 'aislado' else 0
+        assert flujo == esperado
+
+
+@pytest.mark.parametrize("simetrica", [True, False])
+@pytest.mark.parametrize("semilla", range(3))
+def test_superfuente_suma_los_embalses(simetrica, semilla):
+    G = red_simetrica(14, 24, semilla) if simetrica else red_dirigida(14, 40, semilla)
+    fuentes = {0: 7, 5: 30, 9: 12}
+    red = RedFlujo(G, fuentes=fuentes)
+    assert red.simetrica == simetrica
+
+    referencia = G.copy()
+    for embalse, volumen in fuentes.items():
+        referencia.add_edge(SUPERFUENTE, embalse, capacidad=volumen)
+        if simetrica:
+            referencia.add_edge(embalse, SUPERFUENTE, capacidad=volumen)
+
+    destinos = [d for d in G.nodes if d not in fuentes]
+    # Few destinations (Dinic per destination) and every node (Gomory-Hu when symmetric)
+    for consulta in (destinos[:2], list(referencia.nodes)):
+        flujos = red.flujos_desde(SUPERFUENTE, consulta)
+        for destino in consulta:
+            assert flujos[destino] == flujo_networkx(referencia, SUPERFUENTE, destino)
+
+
+def test_red_desde_grafo_csr_usa_solo_aristas_activas():
+    G = red_dirigida(10, 30, 1)
+    for u, v in G.edges:
+        G.edges[u, v]['weight'] = 1.0
+    bloqueadas = list(G.edges)[:8]
+    for u, v in bloqueadas:
+        G.edges[u, v]['estado'] = 'bloqueado'
+    red = RedFlujo(GrafoCSR.desde_networkx(G))
+
+    activa = G.copy()
+    activa.remove_edges_from(bloqueadas)
+    for destino in range(1, 10):
+        assert red.flujo_maximo(0, destino) == flujo_networkx(activa, 0, destino)
@@ -0,0 +1,71 @@
+import networkx as nx
+import pytest
+
+from grafo_agua import RedCargada, iterar_rutas_y_flujos
+
+from test_arbol_rutas import EMBALSES, tablas_aleatorias
+
+
+def vista(semilla=0, fuente=EMBALSES[0]):
+    tablas, _ = tablas_aleatorias(semilla, reservados=0)
+    red = RedCargada('huella', 'version', *tablas)
+    return red, red.vista_calculo(fuente)
+
+
+@pytest.mark.parametrize("semilla", range(3))
+def test_cada_flujo_corresponde_a_su_destino(semilla):
+    red, (_, arbol, red_flujo, destinos) = vista(semilla)
+    resultados = list(iterar_rutas_y_flujos(None, EMBALSES[0], grafo=arbol.grafo, red_flujo=red_flujo,
+                                            arbol=arbol, destinos=destinos))
+    assert [destino for destino, _, _ in resultados] == destinos
+
+    G = red.G
+    for destino, ruta, flujo in resultados[::7]:
+        if ruta is None:
+            assert flujo == 0
+        else:
+            assert ruta[0] == EMBALSES[0] and ruta[-1] == destino
+            assert flujo == round(nx.maximum_flow_value(G, EMBALSES[0], destino, capacity='capacidad'))
+
+
+class RedFlujoFallida:
+    """Flow engine that fails after a few destinations."""
+
+    def __init__(self, red_flujo, correctos):
+        self.red_flujo = red_flujo
+        self.correctos = correctos
+
+    def iterar_flujos_desde(self, fuente, destinos):
+        for k, resultado in enumerate(self.red_flujo.iterar_flujos_desde(fuente, destinos)):
+            if k == self.correctos:
+                raise ValueError("fallo del motor de flujo")
+            yield resultado
+
+
+def test_un_fallo_de_flujo_termina_el_calculo():
+    _, (_, arbol, red_flujo, destinos) = vista()
+    resultados = []
+    with pytest.raises(ValueError):
+        for resultado in iterar_rutas_y_flujos(None, EMBALSES[0], grafo=arbol.grafo,
+                                               red_flujo=RedFlujoFallida(red_flujo, 5), arbol=arbol,
+                                               destinos=destinos):
+            resultados.append(resultado)
+    assert 5 <= len(resultados) < len(destinos)
+    assert all(flujo > 0 for _, ruta, flujo in resultados if ruta is not None)
+
+
+class RedFlujoDesordenada:
+    """Flow engine that answers for the destinations in reverse order."""
+
+    def __init__(self, red_flujo):
+        self.red_flujo = red_flujo
+
+    def iterar_flujos_desde(self, fuente, destinos):
+        return iter(list(self.red_flujo.iterar_flujos_desde(fuente, destinos))[::-1])
+
+
+def test_un_flujo_de_otro_destino_no_se_asigna():
+    _, (_, arbol, red_flujo, destinos) = vista()
+    with pytest.raises(RuntimeError):
+        list(iterar_rutas_y_flujos(None, EMBALSES[0], grafo=arbol.grafo, red_flujo=RedFlujoDesordenada(red_flujo),
+                                   arbol=arbol, destinos=destinos))
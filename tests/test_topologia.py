@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+import grafo_agua
+from grafo_agua import RedCargada, construir_grafo
+from test_arbol_rutas import LADO, tablas_aleatorias
+
+
+def por_nombre(columnas):
+    """Nodes and edges of topologia_columnar keyed by name, with codes replaced by their values."""
+    nodos, aristas = columnas["nodos"], columnas["aristas"]
+    tipos, estados, ids = columnas["tipos"], columnas["estados"], nodos["id"]
+    por_nodo = {
+        nombre: (nodos["lat"][i], nodos["lng"][i], tipos[nodos["tipo"][i]], estados[nodos["estado"][i]],
+                 nodos["capacidad"].get(i), nodos["subtipo"].get(i))
+        for i, nombre in enumerate(ids)
+    }
+    por_arista = {
+        (ids[u], ids[v]): (d, c, estados[e])
+        for u, v, d, c, e in zip(aristas["origen"], aristas["destino"], aristas["distancia"],
+                                 aristas["capacidad"], aristas["estado"])
+    }
+    return por_nodo, por_arista
+
+
+def comprobar_como_digrafo(red):
+    """The topology of ``red`` must describe the DiGraph construir_grafo builds from its tables."""
+    G = construir_grafo(red.embalses, red.puntos, red.nodos, red.aristas)
+    nodos, aristas = por_nombre(red.topologia())
+
+    assert nodos.keys() == set(G.nodes)
+    for nombre, datos in G.nodes(data=True):
+        lat, lng, tipo, estado, capacidad, subtipo = nodos[nombre]
+        assert (lat, lng) == pytest.approx(datos['pos'], abs=1e-6)
+        assert (tipo, estado, subtipo) == (datos['tipo'], datos['estado'], datos.get('subtipo'))
+        assert capacidad == pytest.approx(datos.get('capacidad'), rel=1e-6)
+
+    assert aristas.keys() == set(G.edges)
+    for u, v, datos in G.edges(data=True):
+        distancia, capacidad, estado = aristas[u, v]
+        assert distancia == pytest.approx(datos['distancia'], abs=1e-4)
+        assert capacidad == pytest.approx(datos['capacidad'], rel=1e-6)
+        assert estado == datos['estado']
+
+    # Positions are the compact graph ids, as the compact /procesar formats expect
+    assert red.topologia()["nodos"]["id"] == red.grafo.nombres
+
+
+@pytest.mark.parametrize("radio_km", [0, 0.5])
+@pytest.mark.parametrize("semilla", range(3))
+def test_topologia_sigue_al_digrafo_tras_actualizaciones(monkeypatch, radio_km, semilla):
+    monkeypatch.setattr(grafo_agua, 'RADIO_PUNTO_CRITICO_KM', radio_km)
+    tablas, pendientes = tablas_aleatorias(semilla)
+    red = RedCargada('huella', 'version', *tablas)
+    comprobar_como_digrafo(red)
+
+    rng = np.random.default_rng(200 + semilla)
+    for k, lote in enumerate((pendientes[:4], pendientes[4:])):
+        red.agregar_nodos(lote)
+        red.version = f'version-{k}-nodos'
+        comprobar_como_digrafo(red)
+        red.agregar_punto_critico({
+            'nombre': f'PC_nuevo_{k}',
+            'latitud': -16.45 + rng.uniform(0, LADO * 0.004),
+            'longitud': -71.56 + rng.uniform(0, LADO * 0.004),
+            'tipo': 'obra',
+        })
+        red.version = f'version-{k}-punto'
+        comprobar_como_digrafo(red)
+
+
+def test_topologia_no_construye_el_digrafo():
+    tablas, _ = tablas_aleatorias(5)
+    red = RedCargada('huella', 'version', *tablas)
+    red.topologia()
+    red.vistas()
+    assert red._G is None
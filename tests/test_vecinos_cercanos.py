@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from distancias import proyectar_km
+from generar_red_completa_arequipa import generar_aristas_red, vecinos_cercanos
+
+
+def vecinos_fuerza_bruta(latitudes, longitudes, k, radio_km):
+    """Distances to the k nearest neighbours within radio_km of every point (inf where missing)."""
+    x, y = proyectar_km(latitudes, longitudes)
+    d = np.hypot(x[:, None] - x[None, :], y[:, None] - y[None, :])
+    np.fill_diagonal(d, np.inf)
+    d[d >= radio_km] = np.inf
+    return np.sort(d, axis=1)[:, :k], (x, y)
+
+
+@pytest.mark.parametrize("n, k, radio_km", [(300, 4, 5.0), (500, 3, 0.4), (200, 6, 1.0), (50, 4, 20.0)])
+@pytest.mark.parametrize("semilla", range(3))
+def test_vecinos_coinciden_con_fuerza_bruta(n, k, radio_km, semilla):
+    rng = np.random.default_rng(semilla)
+    latitudes = rng.uniform(-16.45, -16.35, n)
+    longitudes = rng.uniform(-71.60, -71.50, n)
+    # A dense cluster next to sparse points exercises the widening of the search ring
+    latitudes[:n // 4] = -16.40 + rng.normal(0, 0.001, n // 4)
+    longitudes[:n // 4] = -71.55 + rng.normal(0, 0.001, n // 4)
+
+    vecinos = vecinos_cercanos(latitudes, longitudes, k, radio_km)
+    esperadas, (x, y) = vecinos_fuerza_bruta(latitudes, longitudes, k, radio_km)
+
+    assert vecinos.shape == (n, k)
+    hallados = vecinos >= 0
+    np.testing.assert_array_equal(hallados, np.isfinite(esperadas))
+    filas = np.nonzero(hallados)[0]
+    obtenidas = np.full((n, k), np.inf)
+    obtenidas[hallados] = np.hypot(x[filas] - x[vecinos[hallados]], y[filas] - y[vecinos[hallados]])
+    np.testing.assert_allclose(obtenidas, esperadas)
+    assert not np.any(vecinos == np.arange(n)[:, None])
+
+
+def test_pocos_puntos():
+    assert vecinos_cercanos(np.array([-16.4]), np.array([-71.5]), 3, 5.0).tolist() == [[-1, -1, -1]]
+    vecinos = vecinos_cercanos(np.array([-16.4, -16.401, -16.9]), np.array([-71.5, -71.5, -71.5]), 2, 5.0)
+    assert vecinos.tolist() == [[1, -1], [0, -1], [-1, -1]]
+
+
+def test_puntos_en_linea():
+    # Points along one street: the bounding box has no area
+    n = 2000
+    latitudes = np.full(n, -16.40)
+    longitudes = np.sort(np.random.default_rng(0).uniform(-71.60, -71.50, n))
+    vecinos = vecinos_cercanos(latitudes, longitudes, 2, 5.0)
+    esperadas, _ = vecinos_fuerza_bruta(latitudes, longitudes, 2, 5.0)
+    x, _ = proyectar_km(latitudes, longitudes)
+    np.testing.assert_allclose(np.sort(np.abs(x[:, None] - x[vecinos]), axis=1), esperadas)
+
+
+def test_ids_repetidos_no_se_conectan_consigo_mismos():
+    # data/nodos.csv repeats ids: every run appends its nodes after the existing ones
+    rng = np.random.default_rng(0)
+    existentes = [{'id_nodo': f'D{i:03d}', 'latitud': rng.uniform(-16.45, -16.35),
+                   'longitud': rng.uniform(-71.60, -71.50), 'tipo': 'distribucion', 'estado': 'transitable'}
+                  for i in range(60)]
+    # The same ids again, a few metres away: each row's nearest neighbour is its own id
+    repetidos = [dict(n, latitud=n['latitud'] + 0.0001) for n in existentes]
+    aristas = generar_aristas_red(existentes, repetidos + existentes[:20], [])
+
+    assert aristas
+    assert not [a for a in aristas if a['origen'] == a['destino']]
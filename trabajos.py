@@ -0,0 +1,104 @@
+"""
+Cola de trabajos en segundo plano para el sistema de distribución de agua.
+
+Los cálculos largos (procesamiento de rutas, generación de la red) se
+ejecutan en un pool de hilos fuera del hilo de la petición HTTP. El estado y
+el progreso de cada trabajo se guardan en la tabla ``trabajos``, de modo que
+cualquier proceso web puede responder consultas sobre él.
+"""
+
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# Minimum seconds between two progress writes to the database
+INTERVALO_PROGRESO_S = 0.5
+
+
+class ColaTrabajos:
+    """Runs job functions on a thread pool and records their state in the Trabajo table.
+
+    A job function is called as ``funcion(progreso, **parametros)`` inside an
+    application context; ``progreso(fraccion, mensaje=None)`` reports progress
+    and its return value (JSON-serialisable) becomes the job result.
+    """
+
+    def __init__(self, app, db, Trabajo, max_workers=None):
+        self.app = app
+        self.db = db
+        self.Trabajo = Trabajo
+        if max_workers is None:
+            max_workers = int(os.environ.get("TRABAJOS_MAX_WORKERS", "2"))
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="trabajo")
+
+    def encolar(self, tipo, funcion, **parametros):
+        """Create a pending job and submit it to the pool; returns the job id."""
+        trabajo = self.Trabajo(
+            tipo=tipo,
+            estado='pendiente',
+            progreso=0.0,
+            parametros_json=json.dumps(parametros, default=str)
+        )
+        self.db.session.add(trabajo)
+        self.db.session.commit()
+        trabajo_id = trabajo.id
+
+        self.executor.submit(self._ejecutar, trabajo_id, funcion, parametros)
+        logging.info(f"Job {trabajo_id} ({tipo}) queued")
+        return trabajo_id
+
+    def obtener(self, trabajo_id):
+        """Return a job row, or None if it does not exist."""
+        return self.db.session.get(self.Trabajo, trabajo_id)
+
+    def _actualizar(self, trabajo_id, **campos):
+        """Write fields of a job row and commit."""
+        trabajo = self.db.session.get(self.Trabajo, trabajo_id)
+        for campo, valor in campos.items():
+            setattr(trabajo, campo, valor)
+        self.db.session.commit()
+
+    def _ejecutar(self, trabajo_id, funcion, parametros):
+        """Worker body: run the job function and record its outcome."""
+        with self.app.app_context():
+            try:
+                self._actualizar(trabajo_id, estado='en_progreso', fecha_inicio=datetime.now())
+
+                ultima_escritura = [0.0]
+
+                def progreso(fraccion, mensaje=None):
+                    # Throttle writes so fine-grained progress does not flood the database
+                    ahora = time.monotonic()
+                    if mensaje is None and fraccion < 1 and ahora - ultima_escritura[0] < INTERVALO_PROGRESO_S:
+                        return
+                    ultima_escritura[0] = ahora
+                    campos = {'progreso': round(min(max(fraccion, 0.0), 1.0), 4)}
+                    if mensaje is not None:
+                        campos['mensaje'] = mensaje[:255]
+                    self._actualizar(trabajo_id, **campos)
+
+                resultado = funcion(progreso, **parametros)
+                self._actualizar(
+                    trabajo_id,
+                    estado='completado',
+                    progreso=1.0,
+                    mensaje=None,
+                    resultado_json=json.dumps(resultado, default=str),
+                    fecha_fin=datetime.now()
+                )
+                logging.info(f"Job {trabajo_id} completed")
+
+            except Exception as e:
+                logging.error(f"Job {trabajo_id} failed: {str(e)}")
+                self.db.session.rollback()
+                try:
+                    self._actualizar(trabajo_id, estado='error', error=str(e), fecha_fin=datetime.now())
+                except Exception as db_error:
+                    logging.error(f"Could not record failure of job {trabajo_id}: {db_error}")
+                    self.db.session.rollback()
+
+            finally:
+                self.db.session.remove()